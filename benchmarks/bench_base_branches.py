@@ -0,0 +1,56 @@
+# Microbenchmark for `base_branches_from_commits`.
+#
+# Builds a synthetic `CommitStore` with stacks of branches (no git repository involved) and times
+# base detection for increasing branch counts. Time per branch should stay roughly flat.
+#
+# Usage:
+# PYTHONPATH=src python benchmarks/bench_base_branches.py
+import time
+
+from branches.db import CommitStore, base_branches_from_commits
+
+STACK_DEPTH = 10
+COMMITS_PER_BRANCH = 3
+REPEAT = 5
+
+
+def build_store(branch_count: int) -> tuple[CommitStore, dict[str, int]]:
+  """Returns a store with `branch_count` branches stacked `STACK_DEPTH` deep"""
+  commits = CommitStore()
+  tips = {}
+  sha = 0
+  for branch_idx in range(branch_count):
+    if branch_idx % STACK_DEPTH == 0:
+      parent_shas = []
+    else:
+      parent_shas = [commits.shas[tips[f"b{branch_idx - 1}"]]]
+
+    for _ in range(COMMITS_PER_BRANCH):
+      sha += 1
+      sha_str = f"{sha:040x}"
+      commits.add(sha_str, parent_shas, "first.last@example.com", "first.last@example.com")
+      parent_shas = [sha_str]
+
+    tips[f"b{branch_idx}"] = commits.indexes[parent_shas[0]]
+
+  return commits, tips
+
+
+def main():
+  print(f"{'branches':>10} {'commits':>10} {'best (ms)':>10} {'per branch (us)':>16}")
+  for branch_count in [1_000, 10_000, 100_000]:
+    commits, tips = build_store(branch_count)
+    best = float("inf")
+    for _ in range(REPEAT):
+      start = time.perf_counter()
+      base_branches_from_commits(commits, tips)
+      best = min(best, time.perf_counter() - start)
+
+    print(
+      f"{branch_count:>10} {len(commits):>10} {best * 1000:>10.1f} "
+      f"{best / branch_count * 1_000_000:>16.2f}"
+    )
+
+
+if __name__ == "__main__":
+  main()
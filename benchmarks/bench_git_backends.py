@@ -0,0 +1,112 @@
+# Benchmark comparing the `GitUtils` backends: `git` commands (GitUtils) and pygit2 (Pygit2Utils).
+#
+# Creates a throwaway repository with `git fast-import`: a default branch and BRANCH_COUNT branches
+# with a few commits each. Then times the queries `branches` runs once per branch with each
+# backend, and a whole `branches --json` run with each backend. Needs pygit2 to be installed.
+#
+# Usage:
+# PYTHONPATH=src python benchmarks/bench_git_backends.py
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from branches.utils.git_utils import GitUtils
+from branches.utils.pygit2_utils import Pygit2Utils
+
+BRANCH_COUNT = 200
+MAIN_COMMITS = 100
+COMMITS_PER_BRANCH = 3
+
+
+def fast_import_stream() -> str:
+  """Returns a `git fast-import` stream with the default branch and `BRANCH_COUNT` branches"""
+  lines = []
+  mark = 0
+
+  def commit(ref: str, parent_mark: int | None, message: str) -> int:
+    nonlocal mark
+    mark += 1
+    lines.extend(
+      [
+        f"commit {ref}",
+        f"mark :{mark}",
+        f"author First Last <first.last@example.com> {1_700_000_000 + mark} +0000",
+        f"committer First Last <first.last@example.com> {1_700_000_000 + mark} +0000",
+        f"data {len(message)}",
+        message,
+      ]
+    )
+    if parent_mark is not None:
+      lines.append(f"from :{parent_mark}")
+    lines.append(f"M 644 inline {message}.txt")
+    lines.extend([f"data {len(message)}", message, ""])
+    return mark
+
+  main_marks = []
+  for idx in range(MAIN_COMMITS):
+    main_marks.append(commit("refs/heads/main", main_marks[-1] if main_marks else None, f"m{idx}"))
+
+  for branch_idx in range(BRANCH_COUNT):
+    parent = main_marks[branch_idx * MAIN_COMMITS // BRANCH_COUNT]
+    for commit_idx in range(COMMITS_PER_BRANCH):
+      parent = commit(f"refs/heads/b{branch_idx}", parent, f"b{branch_idx}c{commit_idx}")
+
+  return "\n".join(lines) + "\n"
+
+
+def best_of(repeat: int, function) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    start = time.perf_counter()
+    function()
+    best = min(best, time.perf_counter() - start)
+  return best
+
+
+def main():
+  with tempfile.TemporaryDirectory() as repo_dirpath:
+    subprocess.run(["git", "init", "-q", "-b", "main"], cwd=repo_dirpath, check=True)
+    subprocess.run(
+      ["git", "fast-import", "--quiet"],
+      cwd=repo_dirpath,
+      input=fast_import_stream(),
+      text=True,
+      check=True,
+    )
+    subprocess.run(["git", "checkout", "-q", "main"], cwd=repo_dirpath, check=True)
+
+    branches = [f"b{idx}" for idx in range(BRANCH_COUNT)]
+    print(f"{BRANCH_COUNT} branches, time per branch in ms")
+    print(f"{'query':>22} {'git':>8} {'pygit2':>8}")
+
+    backends = [GitUtils.from_path(repo_dirpath), Pygit2Utils.from_path(repo_dirpath)]
+    queries = {
+      "distance": lambda git_utils, branch: git_utils.distance("main", branch),
+      "shas_ahead_of": lambda git_utils, branch: git_utils.shas_ahead_of("main", branch),
+      "commits_ahead_of": lambda git_utils, branch: git_utils.commits_ahead_of("main", [branch]),
+      "date_authored": lambda git_utils, branch: git_utils.date_authored(branch),
+      "local_sha_from_branch": lambda git_utils, branch: git_utils.local_sha_from_branch(branch),
+    }
+    for name, query in queries.items():
+      times = [
+        best_of(3, lambda: [query(git_utils, branch) for branch in branches]) / BRANCH_COUNT
+        for git_utils in backends
+      ]
+      print(f"{name:>22} {times[0] * 1000:>8.2f} {times[1] * 1000:>8.2f}")
+
+    print(f"\n{'branches --json (ms)':>22}", end="")
+    for name in ["git", "pygit2"]:
+      env = {**os.environ, "BRANCHES_GIT_BACKEND": name}
+      env.pop("GITHUB_TOKEN", None)
+      command = [sys.executable, "-m", "branches", "--json"]
+      elapsed = best_of(
+        3, lambda: subprocess.run(command, cwd=repo_dirpath, env=env, capture_output=True)
+      )
+      print(f" {elapsed * 1000:>8.0f}", end="")
+    print()
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,122 @@
+# Benchmark checking that the hooks `branches --install-hooks` installs don't slow down git.
+#
+# Creates a throwaway repository with BRANCH_COUNT branches and a TOPIC_COMMITS commits long topic
+# branch. Times `git commit` and rebasing the topic branch onto a new main commit, without the hooks
+# and with them, and then checks that the state the hooks refresh in the background caught up with
+# the last change. Exits with an error if the hooks add more than MAX_OVERHEAD_MS to the median.
+#
+# Usage:
+# PYTHONPATH=src python benchmarks/bench_hooks.py
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BRANCH_COUNT = 100
+TOPIC_COMMITS = 20
+REPEAT = 15
+MAX_OVERHEAD_MS = {"commit": 10, "rebase": 40}
+
+
+def git(repo_dirpath: str, *args: str) -> str:
+  return subprocess.run(
+    ["git", *args], cwd=repo_dirpath, check=True, capture_output=True, text=True
+  ).stdout.strip()
+
+
+def timed(repo_dirpath: str, *args: str) -> float:
+  start = time.perf_counter()
+  git(repo_dirpath, *args)
+  return time.perf_counter() - start
+
+
+def wait_for_refresh(repo_dirpath: str) -> float:
+  """Waits until the refresh the hooks started in the background, if any, is done.
+
+  Returns:
+    How long it waited, in seconds.
+  """
+  start = time.perf_counter()
+  while os.path.exists(os.path.join(repo_dirpath, ".git", "branches-state", "refreshing")):
+    time.sleep(0.01)
+  return time.perf_counter() - start
+
+
+def measure(repo_dirpath: str) -> dict[str, float]:
+  """Returns the median time in ms of a commit and of a rebase of the topic branch.
+
+  Each one is timed once the background refresh started by the previous one is done, so that on
+  machines with a single core it doesn't compete with git for the CPU.
+  """
+  commits = []
+  rebases = []
+  for idx in range(REPEAT):
+    git(repo_dirpath, "checkout", "-q", "main")
+    wait_for_refresh(repo_dirpath)
+    commits.append(timed(repo_dirpath, "commit", "-q", "--allow-empty", "-m", f"main {idx}"))
+    git(repo_dirpath, "checkout", "-q", "topic")
+    git(repo_dirpath, "reset", "-q", "--hard", "topic-start")
+    wait_for_refresh(repo_dirpath)
+    rebases.append(timed(repo_dirpath, "rebase", "-q", "main"))
+
+  return {
+    "commit": statistics.median(commits) * 1000,
+    "rebase": statistics.median(rebases) * 1000,
+  }
+
+
+def main() -> int:
+  with tempfile.TemporaryDirectory() as repo_dirpath:
+    git(repo_dirpath, "init", "-q", "-b", "main")
+    git(repo_dirpath, "config", "user.email", "first.last@example.com")
+    git(repo_dirpath, "config", "user.name", "First Last")
+    git(repo_dirpath, "commit", "-q", "--allow-empty", "-m", "first")
+    for idx in range(BRANCH_COUNT):
+      git(repo_dirpath, "branch", f"b{idx}")
+
+    git(repo_dirpath, "checkout", "-q", "-b", "topic")
+    for idx in range(TOPIC_COMMITS):
+      with open(os.path.join(repo_dirpath, f"topic{idx}.txt"), "w") as topic_file:
+        topic_file.write(f"{idx}\n")
+      git(repo_dirpath, "add", "-A")
+      git(repo_dirpath, "commit", "-q", "-m", f"topic {idx}")
+    git(repo_dirpath, "branch", "topic-start")
+
+    without_hooks = measure(repo_dirpath)
+
+    subprocess.run(
+      [sys.executable, "-m", "branches", "-C", repo_dirpath, "--install-hooks"],
+      check=True,
+      capture_output=True,
+    )
+    with_hooks = measure(repo_dirpath)
+
+    print(f"{BRANCH_COUNT} branches, median of {REPEAT} runs in ms")
+    print(f"{'':>8} {'no hooks':>9} {'hooks':>9} {'overhead':>9}")
+    ret = 0
+    for name in ["commit", "rebase"]:
+      overhead = with_hooks[name] - without_hooks[name]
+      print(f"{name:>8} {without_hooks[name]:>9.1f} {with_hooks[name]:>9.1f} {overhead:>9.1f}")
+      if overhead > MAX_OVERHEAD_MS[name]:
+        print(f"{name} overhead is over the {MAX_OVERHEAD_MS[name]}ms budget")
+        ret = 1
+
+    # The refresher started by the last hook run saves the state of the last change
+    elapsed = wait_for_refresh(repo_dirpath)
+    with open(os.path.join(repo_dirpath, ".git", "branches-state", "state.json")) as state_file:
+      state = json.load(state_file)
+
+    topic_sha = git(repo_dirpath, "rev-parse", "topic")
+    print(f"\nstate saved {elapsed * 1000:.0f}ms after the last rebase")
+    if state["branches"]["topic"]["sha"] != topic_sha:
+      print("state is not up to date with the last rebase")
+      ret = 1
+
+    return ret
+
+
+if __name__ == "__main__":
+  sys.exit(main())
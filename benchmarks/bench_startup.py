@@ -0,0 +1,80 @@
+# Startup benchmark for the CLI entry point, checked against `startup_budget.json`.
+#
+# Runs `python -m branches` with each budgeted argument in a throwaway repository with one commit, no
+# origin and no GITHUB_TOKEN. For each one it reports the best wall time out of a few runs and the
+# slowest imports from `python -X importtime`. It exits with 1 if a wall time is over its budget or
+# if a module the budget forbids was imported.
+#
+# Usage:
+# PYTHONPATH=src python benchmarks/bench_startup.py
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+BUDGET_FILEPATH = os.path.join(os.path.dirname(__file__), "startup_budget.json")
+REPEAT = 5
+SLOWEST_IMPORTS = 5
+
+
+def run(args: list[str], cwd: str, env: dict[str, str]) -> subprocess.CompletedProcess[str]:
+  return subprocess.run(
+    [sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, check=True
+  )
+
+
+def imports(argument: str, cwd: str, env: dict[str, str]) -> list[tuple[int, str]]:
+  """Returns (cumulative microseconds, module) for every module `argument` imports"""
+  ret = []
+  stderr = run(["-X", "importtime", "-m", "branches", argument], cwd, env).stderr
+  for line in stderr.splitlines():
+    if line.startswith("import time:") and "cumulative" not in line:
+      _self, cumulative, module = line.removeprefix("import time:").split("|")
+      ret.append((int(cumulative), module.strip()))
+  return ret
+
+
+def main() -> int:
+  with open(BUDGET_FILEPATH) as budget_file:
+    budget = json.load(budget_file)
+
+  env = {key: value for key, value in os.environ.items() if key != "GITHUB_TOKEN"}
+  ret = 0
+
+  with tempfile.TemporaryDirectory() as repo_dirpath:
+    subprocess.run(["git", "init", "-q"], cwd=repo_dirpath, check=True)
+    subprocess.run(
+      ["git", "commit", "-q", "--allow-empty", "-m", "A"], cwd=repo_dirpath, check=True
+    )
+
+    print(f"{'argument':>10} {'best (ms)':>10} {'budget (ms)':>12}  slowest imports")
+    for argument, limits in budget.items():
+      best = float("inf")
+      for _ in range(REPEAT):
+        start = time.perf_counter()
+        run(["-m", "branches", argument], repo_dirpath, env)
+        best = min(best, time.perf_counter() - start)
+
+      imported = imports(argument, repo_dirpath, env)
+      slowest = sorted(imported, reverse=True)[:SLOWEST_IMPORTS]
+      print(
+        f"{argument:>10} {best * 1000:>10.1f} {limits['max_ms']:>12}  "
+        + ", ".join(f"{module} {cumulative / 1000:.1f}ms" for cumulative, module in slowest)
+      )
+
+      if best * 1000 > limits["max_ms"]:
+        print(f"  over budget by {best * 1000 - limits['max_ms']:.1f}ms")
+        ret = 1
+
+      modules = {module.split(".")[0] for _cumulative, module in imported}
+      for module in sorted(modules & set(limits["forbidden_modules"])):
+        print(f"  imports {module}")
+        ret = 1
+
+  return ret
+
+
+if __name__ == "__main__":
+  raise SystemExit(main())
@@ -0,0 +1,53 @@
+# Microbenchmark for the interactive view's `BranchesView`.
+#
+# Uses synthetic rows (no git repository or terminal involved) and times what every key press costs:
+# moving the selection and building the visible rows, and typing a filter. Both should stay well
+# under a frame (~16ms) no matter how many branches there are.
+#
+# Usage:
+# PYTHONPATH=src python benchmarks/bench_tui.py
+import time
+
+from branches.cli import COLUMNS
+from branches.render import Segment
+from branches.tui import BranchesView
+
+HEIGHT = 50
+FILTER = "feature/12"
+
+
+def quick_row(branch: str) -> dict:
+  return {
+    "local": (Segment("abcde"), Segment(" ")),
+    "behind": (Segment("1"),),
+    "ahead": (Segment("2"),),
+    "branch": (Segment(branch),),
+  }
+
+
+def main():
+  print(f"{'branches':>10} {'move (us)':>10} {'filter key (us)':>16}")
+  for branch_count in [1_000, 5_000, 50_000]:
+    view = BranchesView(
+      [f"feature/{idx}" for idx in range(branch_count)], COLUMNS, quick_row, quick_row
+    )
+
+    start = time.perf_counter()
+    for _ in range(branch_count):
+      view.move(1, HEIGHT)
+      for branch in view.visible(HEIGHT):
+        view.row(branch)
+    move = (time.perf_counter() - start) / branch_count
+
+    start = time.perf_counter()
+    for idx in range(1, len(FILTER) + 1):
+      view.set_filter(FILTER[:idx], HEIGHT)
+    for idx in reversed(range(len(FILTER))):
+      view.set_filter(FILTER[:idx], HEIGHT)
+    filter_key = (time.perf_counter() - start) / (len(FILTER) * 2)
+
+    print(f"{branch_count:>10} {move * 1_000_000:>10.1f} {filter_key * 1_000_000:>16.1f}")
+
+
+if __name__ == "__main__":
+  main()
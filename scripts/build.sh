@@ -19,6 +19,7 @@ pyinstaller --onedir \
             --workpath "$ROOT_DIR/build/macos/arm64" \
             --distpath "$ROOT_DIR/dist/macos/arm64" \
             --paths "$ROOT_DIR/src" \
+            --exclude-module pygit2 \
             "$ROOT_DIR/src/branches/__main__.py"
 
 docker run --rm -it \
@@ -39,6 +40,7 @@ docker run --rm -it \
                 --workpath build/linux/arm64 \
                 --distpath dist/linux/arm64 \
                 --paths src \
+                --exclude-module pygit2 \
                 src/branches/__main__.py
   '
 
@@ -60,6 +62,7 @@ docker run --rm -it \
                 --workpath build/linux/amd64 \
                 --distpath dist/linux/amd64 \
                 --paths src \
+                --exclude-module pygit2 \
                 src/branches/__main__.py
   '
 
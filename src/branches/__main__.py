@@ -1,4 +1,24 @@
-from branches.cli import main
+import sys
+
+from branches.client import main as client_main
+
+
+def main() -> int:
+  if sys.argv[1:] == ["--prompt"]:
+    # Run from shell prompts, so it skips argparse and everything else it doesn't need
+    from branches.prompt import main as prompt_main
+
+    return prompt_main()
+
+  # Ask a running `branches --daemon` first. The CLI is only imported when there's none
+  ret = client_main()
+  if ret is not None:
+    return ret
+
+  from branches.cli import main
+
+  return main()
+
 
 if __name__ == "__main__":
-  raise SystemExit(main())
+  sys.exit(main())
@@ -2,33 +2,42 @@
 # python branches.py
 from . import VERSION
 import argparse
-from .utils.git_utils import GitUtils
-from git import Commit
-import requests
 import os
 import subprocess
 import sys
-from urllib.parse import urlencode
-from rich.console import Console
-from rich import box
-from rich.live import Live
-from rich.table import Table
+import time
 from datetime import datetime, timezone
-import re
-from typing import TypeAlias
-from pydash import get
-import copy
+from typing import TYPE_CHECKING, TypeAlias
+from .db import (
+  AtLeast,
+  BaseBranch,
+  CommitStore,
+  Db,
+  Distance,
+  LocalBranch,
+  RemoteBranch,
+  StrBranchName,
+  StrSha,
+  base_branches_from_commits,
+  intern_sha,
+)
+from .render import Cell, PlainRenderer, RichRenderer, Segment, TsvRenderer
+from dataclasses import replace
+
+# Modules only some code paths need (requests, rich, json) are imported in those code
+# paths, so that `--version`, `--json` or running without a GitHub token don't pay for them.
+# `benchmarks/bench_startup.py` checks startup time against a budget.
+if TYPE_CHECKING:
+  from .conflicts import RebaseCheck, RebaseStep
+  from .utils.git_utils import GitUtils
 
 # Using some TypeAliases just for readability / documentation
-StrBranchName: TypeAlias = str
-StrSha: TypeAlias = str
 StrShaShort: TypeAlias = str
 StrShaRef: TypeAlias = str  # Examples: "branch1", "branch1~3", "branch2~1".
 StrCommand: TypeAlias = str
 DictUpdateParams: TypeAlias = dict
-DictTableRow: TypeAlias = dict
-
-console = Console(highlight=False)
+DictTableRow: TypeAlias = dict[str, Cell]
+DictRecord: TypeAlias = dict
 
 LOCAL_SHA_COLOR = "blue"
 CURRENT_BRANCH_COLOR = "green"
@@ -90,15 +99,45 @@ COLUMNS = {
 }
 
 PR_STATUS_COLORS = {"open": "green", "closed": "red", "merged": "medium_purple1"}
+MAX_AUTHORS = 10
+# Patterns of the integration branches, see `Db.integration`
+INTEGRATION_CONFIG = "branches.integration"
+
+# Set by `daemon.serve`, which answers many invocations from the same process: a
+# `requests.Session` that keeps the connection to GitHub open, and the pull requests fetched
+# recently, by branch, with the `time.monotonic()` they were fetched at.
+github_session = None
+pull_request_cache: dict[StrBranchName, tuple[float, dict | None]] | None = None
+PULL_REQUEST_CACHE_SECONDS = 60
+# Set by `workspace.start_worker`: a `multiprocessing.Value` with how many more GitHub requests
+# the processes showing a workspace may make between them.
+github_budget = None
 
 
 class GitHubApiError(Exception):
   pass
 
 
+class BaseBranchCycleError(Exception):
+  pass
+
+
 def main() -> int:
   """Entry point for the CLI."""
-  parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  ret = 1
+  try:
+    ret = branches(argument_parser().parse_args())
+  except KeyboardInterrupt:
+    print("Interrupted")
+
+  return ret
+
+
+def argument_parser() -> argparse.ArgumentParser:
+  # No abbreviations, the daemon client has to recognize local only options by their full name
+  parser = argparse.ArgumentParser(
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter, allow_abbrev=False
+  )
   parser.add_argument(
     "--no-push", action="store_true", default=False, help="Do not suggest push commands"
   )
@@ -129,21 +168,188 @@ def main() -> int:
     help="Automatically run update commands. THIS IS DANGEROUS!",
   )
 
+  parser.add_argument(
+    "--include",
+    action="append",
+    metavar="PATTERN",
+    help="Only show branches matching this shell-style pattern (e.g. 'feature/*'). The pattern "
+    "matches the whole branch name, and * also matches /. Can be repeated",
+  )
+
+  parser.add_argument(
+    "--exclude",
+    action="append",
+    metavar="PATTERN",
+    help="Do not show branches matching this pattern, matched like --include's (e.g. 'wip/*'). "
+    "Can be repeated",
+  )
+
+  parser.add_argument(
+    "--max-age",
+    type=positive_int_arg,
+    metavar="DAYS",
+    help="Do not show branches whose last commit is older than this many days",
+  )
+
+  parser.add_argument(
+    "--mine",
+    action="store_true",
+    default=False,
+    help="Only show branches whose last commit was authored by the current git user",
+  )
+
+  parser.add_argument(
+    "--integration",
+    action="append",
+    metavar="PATTERN",
+    help="Treat branches matching this pattern (e.g. 'release/*') like the default branch: other "
+    "branches are compared to and rebased onto the nearest one, and they're never rebased. Can be "
+    f"repeated. Defaults to the {INTEGRATION_CONFIG} git config values",
+  )
+
+  parser.add_argument(
+    "--max-authors",
+    type=positive_int_arg,
+    default=MAX_AUTHORS,
+    metavar="N",
+    help="Most authors other than you that --json and --tui list per branch. Tables only show "
+    "whether there are any, which usually takes reading a few commits of each branch",
+  )
+
+  parser.add_argument(
+    "--check-conflicts",
+    action="store_true",
+    default=False,
+    help="Replay the suggested rebases in memory, without touching the working tree, and print "
+    "which ones would stop on a conflict. Independent stacks are checked in parallel",
+  )
+
+  parser.add_argument(
+    "--columns",
+    type=columns_arg,
+    default=list(COLUMNS.keys()),
+    metavar="COLUMNS",
+    help=(
+      "Comma separated list of columns to display, out of: "
+      f"{','.join(COLUMNS.keys())}. Data only needed by hidden columns is not fetched"
+    ),
+  )
+
+  output = parser.add_mutually_exclusive_group()
+  output.add_argument(
+    "--json",
+    action="store_true",
+    default=False,
+    help="Print the branches and the update commands as a JSON document instead of a table. "
+    "Update commands are never run",
+  )
+  output.add_argument(
+    "--ndjson",
+    action="store_true",
+    default=False,
+    help="Like --json, but print one JSON record per line, each branch as soon as it is loaded",
+  )
+
+  output.add_argument(
+    "--plain",
+    action="store_true",
+    default=False,
+    help="Print the table as plain text once all branches are loaded. "
+    "The default when stdout is not a terminal",
+  )
+  output.add_argument(
+    "--tsv",
+    action="store_true",
+    default=False,
+    help="Print the table as tab separated values, each branch as soon as it is loaded",
+  )
+  output.add_argument(
+    "--tui",
+    action="store_true",
+    default=False,
+    help="Browse the branches in an interactive full screen view. Origin and PR details are "
+    "loaded as rows scroll into view. Update commands are not suggested",
+  )
+  output.add_argument(
+    "--rich",
+    action="store_true",
+    default=False,
+    help="Print the table with rich even when stdout is not a terminal",
+  )
+  output.add_argument(
+    "--daemon",
+    action="store_true",
+    default=False,
+    help="Serve this repository from a long-running process until it is idle for an hour. "
+    "While it runs, other invocations in the repository are answered by it",
+  )
+  output.add_argument(
+    "--prompt",
+    action="store_true",
+    default=False,
+    help="Print one short line about the current branch for shell prompts, from the state "
+    "--install-hooks keeps saved. Never runs git or queries origin or GitHub",
+  )
+
+  parser.add_argument(
+    "--workspace",
+    nargs="+",
+    metavar="DIR",
+    help="Show the branches of every git repository in DIR, or of DIR if it is one, each in its "
+    "own process. The JSON output is one document with all the repositories",
+  )
+  parser.add_argument(
+    "--watch",
+    action="store_true",
+    default=False,
+    help="Keep running and print the table again whenever refs change. Only the rows of branches "
+    "that changed are recomputed. Origin and PRs are refreshed every minute",
+  )
+
+  hooks = parser.add_mutually_exclusive_group()
+  hooks.add_argument(
+    "--install-hooks",
+    action="store_true",
+    default=False,
+    help="Install git hooks that keep the state of the branches saved in the git directory, "
+    "updating it in the background after checkouts, merges, rebases and amends",
+  )
+  hooks.add_argument(
+    "--uninstall-hooks",
+    action="store_true",
+    default=False,
+    help="Remove the hooks --install-hooks installed and the state they saved",
+  )
+  # Run by the hooks
+  hooks.add_argument("--refresh-state", action="store_true", default=False, help=argparse.SUPPRESS)
+
   group = parser.add_mutually_exclusive_group()
   group.add_argument("operation", nargs="?", choices=["amend"], help="Operation")
   group.add_argument(
     "-s", "--short", action="store_true", default=False, help="Show a short list only"
   )
 
-  ret = 1
-  try:
-    ret = branches(parser.parse_args())
-  except KeyboardInterrupt:
-    print("Interrupted")
+  return parser
+
 
+def positive_int_arg(value: str) -> int:
+  ret = int(value)
+  if ret < 1:
+    raise argparse.ArgumentTypeError("must be at least 1")
   return ret
 
 
+def columns_arg(value: str) -> list[str]:
+  """Parses the `--columns` argument. Columns are always displayed in `COLUMNS` order."""
+  columns = {column.strip() for column in value.split(",") if column.strip()}
+  unknown = columns - COLUMNS.keys()
+  if unknown:
+    raise argparse.ArgumentTypeError(f"unknown columns: {', '.join(sorted(unknown))}")
+
+  columns.add("branch")
+  return [column for column in COLUMNS.keys() if column in columns]
+
+
 def branches(args: argparse.Namespace) -> int:
   """Main function to display the branches table and update commands.
 
@@ -152,188 +358,753 @@ def branches(args: argparse.Namespace) -> int:
   Returns:
     int: Exit code (0 for success).
   """
-  # `header_style=""`` removes the bold which makes assigning a yellow header not work.
   ret = 0
 
   if args.version:
     print(VERSION)
     return ret
 
+  if args.workspace:
+    from .workspace import run
+
+    return run(args)
+
+  from .utils.git_utils import backend
+
   if args.path:
     if not os.path.isdir(args.path) or not os.path.exists(args.path):
       print(f"Path '{args.path}' does not exist or is not a directory.")
       return 1
-    repo = GitUtils.repo_from_path(args.path)
-  else:
-    repo = GitUtils.repo_from_path()
-  if repo is None:
+
+  if args.prompt:
+    from .prompt import main as prompt_main
+
+    return prompt_main(args.path)
+
+  git_utils = backend().from_path(args.path)
+  if git_utils is None:
     print("Not a git repository.")
     return 1
 
-  git_utils = GitUtils(repo=repo)
-  table = Table(padding=(0, 0), box=box.SIMPLE_HEAD, header_style="")
-  for _column_key, column_attr in COLUMNS.items():
-    table.add_column(column_attr["column_name"], **(column_attr["column_props"] or {}))
+  if args.daemon:
+    from .daemon import serve
+
+    return serve(git_utils.working_tree_dir())
+
+  if args.install_hooks:
+    return install_hooks(git_utils)
 
+  if args.uninstall_hooks:
+    from . import state
+
+    return state.uninstall_hooks(git_utils.hooks_dir(), git_utils.git_dirs()[1])
+
+  if args.refresh_state:
+    from . import state
+
+    return state.refresh(git_utils.git_dirs()[1], lambda: refresh_state(git_utils))
+
+  if args.watch:
+    return watch(args, git_utils)
+
+  ret, update_commands = show(args, git_utils)
+  if update_commands and (
+    args.yes or ("PYTEST_CURRENT_TEST" not in os.environ and prompt("Run update command?"))
+  ):
+    ret = run_commands(update_commands)
+
+  return ret
+
+
+def show(args: argparse.Namespace, git_utils: GitUtils) -> tuple[int, list[StrCommand]]:
+  """Prints the branches the way `args` asks for, and the update commands unless `args.quiet`.
+
+  Returns:
+    Tuple with two values:
+    1. Exit code (0 for success).
+    2. The printed update commands the user can be asked to run. Empty with `args.no`.
+  """
   if args.operation == "amend":
     args.short = True
 
-  with Live(table, console=console, refresh_per_second=20):
+  if args.json or args.ndjson:
+    return (print_records(args, git_utils), [])
+
+  if args.tui:
+    return (browse(args, git_utils), [])
+
+  with renderer(args) as table:
     db = print_table(args, table, git_utils)
 
-  print("")
+  if not (args.short or args.include or args.exclude or args.max_age is not None or args.mine):
+    save_state(db, git_utils)
+
+  return print_commands(args, db, git_utils)
+
+
+def print_commands(
+  args: argparse.Namespace, db: Db, git_utils: GitUtils
+) -> tuple[int, list[StrCommand]]:
+  """Prints the update commands for `db` unless `args.quiet`. Returns the same values as `show`."""
+  steps = [] if args.check_conflicts and not args.quiet else None
+  err, update_commands = planned_commands(args, db, git_utils, steps)
+  if err is not None:
+    print(err)
+    return (1, [])
+
+  if args.quiet:
+    return (0, [])
+
+  for message in unavailable_suggestions(db):
+    print(f"NOTE: {message}")
+
+  if len(update_commands) > 0:
+    print(" && \\\n".join(update_commands))
+    print("")
+
+  if steps:
+    print("Conflict check:")
+    for step, step_check in conflict_checks(args, db, steps, git_utils):
+      print(f"  {step.branch}: {step_check}")
+    print("")
+
+  return (0, [] if args.no else update_commands)
+
+
+def run_commands(commands: list[StrCommand], cwd: str | None = None) -> int:
+  """Runs `commands` in a shell, one after the other until one fails, and returns its exit code"""
+  sys.stdout.flush()
+  return subprocess.run(
+    " && ".join(commands), shell=True, stderr=subprocess.STDOUT, cwd=cwd
+  ).returncode
 
+
+def planned_commands(
+  args: argparse.Namespace, db: Db, git_utils: GitUtils, steps: list[RebaseStep] | None = None
+) -> tuple[str | None, list[StrCommand]]:
+  """Returns the update commands for the operation in `args`.
+
+  Args:
+    steps: if given, the rebases in the commands are appended to it, see `generate_update_commands`.
+
+  Returns:
+    Tuple with two values:
+    1. If the commands can't be planned, the message explaining why, otherwise None.
+    2. A list of commands to run
+  """
   if args.operation is None:
-    update_commands = generate_update_commands(db, git_utils, args.no_push)
+    try:
+      return (None, generate_update_commands(db, git_utils, args.no_push, steps=steps))
+    except BaseBranchCycleError as exception:
+      return (f"{exception}\n", [])
   elif args.operation == "amend":
     if len(git_utils.current_branch() or "") <= 0:
-      print("Cannot run amend on a detached HEAD. Check out a branch first.\n")
-      return 1
+      return ("Cannot run amend on a detached HEAD. Check out a branch first.\n", [])
 
-    if git_utils.main_branch() == git_utils.current_branch():
-      print("Cannot run amend on the main branch. Checkout a different branch.\n")
-      return 1
+    if db.default == db.current:
+      return ("Cannot run amend on the main branch. Checkout a different branch.\n", [])
 
-    changes_to_add = (
-      git_utils.staged_changes_filepaths()
-      + git_utils.unstaged_changes_filepaths()
-      + git_utils.untracked_filepaths()
-    )
-
-    if len(changes_to_add) <= 0:
-      print("No changes to amend with.\n")
-      return 1
+    if not git_utils.has_changes():
+      return ("No changes to amend with.\n", [])
 
-    err, update_commands = generate_amend_commands(db, git_utils, args.no_push)
+    err, update_commands = generate_amend_commands(db, git_utils, args.no_push, steps)
     if len(err or "") > 0:
+      return (err, [])
+    return (None, update_commands)
+  else:
+    return (None, [])  # Unexpected
+
+
+def conflict_checks(
+  args: argparse.Namespace, db: Db, steps: list[RebaseStep], git_utils: GitUtils
+) -> list[tuple[RebaseStep, RebaseCheck]]:
+  """Returns how each of the rebases `planned_commands` put in `steps` would go, see `conflicts`"""
+  from .conflicts import check
+
+  amended = db.current if args.operation == "amend" else None
+  return list(zip(steps, check(steps, git_utils, amended)))
+
+
+def print_records(args: argparse.Namespace, git_utils: GitUtils) -> int:
+  """Prints the state of the branches and the update commands as JSON.
+
+  With `--ndjson` every record is printed on its own line as soon as it is ready: first one with
+  the repository, then one per branch, and last one with the update commands. With `--json` the
+  same information is printed as a single document at the end. Warnings and errors go to stderr so
+  stdout is always valid JSON.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  import contextlib
+  import json
+
+  stdout = sys.stdout
+
+  def emit(record: DictRecord) -> None:
+    stdout.write(json.dumps(record) + "\n")
+    stdout.flush()
+
+  with contextlib.redirect_stdout(sys.stderr):
+    db = load_db(args, git_utils)
+    document = {
+      "default": db.default,
+      "current": db.current,
+      "remote_loaded": db.remote_loaded,
+      "prs_loaded": db.prs_loaded,
+    }
+    if args.ndjson:
+      emit({"type": "repository", **document})
+
+    records = []
+    show_warnings = True
+    for branch in db.local:
+      table_row(db, branch, git_utils, show_warnings, args.columns)
+      show_warnings = False
+      if args.ndjson:
+        emit({"type": "branch", **branch_record(db, branch)})
+      else:
+        records.append(branch_record(db, branch))
+
+    steps = [] if args.check_conflicts and not args.quiet else None
+    err, update_commands = planned_commands(args, db, git_utils, steps)
+    if err is not None:
       print(err)
       return 1
+
+    commands = {
+      "commands": [] if args.quiet else update_commands,
+      "notes": [] if args.quiet else unavailable_suggestions(db),
+    }
+    if steps is not None:
+      commands["conflict_checks"] = [
+        {
+          "branch": step.branch,
+          "onto": step.onto,
+          "status": step_check.status,
+          "sha": step_check.sha,
+          "paths": list(step_check.paths),
+          "reason": step_check.reason,
+        }
+        for step, step_check in conflict_checks(args, db, steps, git_utils)
+      ]
+
+  if args.ndjson:
+    emit({"type": "commands", **commands})
   else:
-    update_commands = []  # Unexpected
+    stdout.write(json.dumps({**document, "branches": records, **commands}, indent=2) + "\n")
 
-  if len(update_commands) > 0 and not args.quiet:
-    print(" && \\\n".join(update_commands))
-    print("")
-    if not args.no and (
-      args.yes or ("PYTEST_CURRENT_TEST" not in os.environ and prompt("Run update command?"))
-    ):
-      sys.stdout.flush()
-      ret = subprocess.run(
-        " && ".join(update_commands), shell=True, stderr=subprocess.STDOUT
-      ).returncode
+  return 0
+
+
+def browse(args: argparse.Namespace, git_utils: GitUtils) -> int:
+  """Shows the branches in the interactive full screen view of `tui`.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  if not sys.stdout.isatty():
+    print("--tui needs stdout to be a terminal.")
+    return 1
+
+  from .tui import BranchesView, run
+
+  db = load_db(args, git_utils)
+  view = BranchesView(
+    list(db.local.keys()),
+    {column_key: COLUMNS[column_key] for column_key in args.columns},
+    quick_row=lambda branch: quick_row(db, branch),
+    load_row=lambda branch: table_row(db, branch, git_utils, False, args.columns),
+  )
+  run(view, lambda branch: branch_details(db, branch))
+
+  return 0
+
+
+def install_hooks(git_utils: GitUtils) -> int:
+  """Installs the hooks that keep the saved state up to date, and saves it for the first time.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  from . import state
+
+  ret = state.install_hooks(
+    git_utils.hooks_dir(), git_utils.git_dirs()[1], git_utils.working_tree_dir()
+  )
+  if ret == 0:
+    refresh_state(git_utils)
+
+  return ret
+
+
+def refresh_state(git_utils: GitUtils) -> None:
+  """Saves the state of all the branches without querying origin or GitHub. Origin is what the
+  remote tracking branches say.
+  """
+  from .utils.git_utils import backend
+
+  # The hooks run this after refs changed, HEAD may be on another branch
+  git_utils = backend().from_path(git_utils.working_tree_dir())
+  db = create_db(git_utils, load_remote=False, authors_limit=MAX_AUTHORS)
+  db.prs_loaded = False
+
+  # Origin as of the last fetch or push, for the Origin relationship
+  tracking_shas = git_utils.tracking_shas()
+  for branch in tracking_shas.keys() & db.local.keys():
+    branch_integration = db.local[branch].integration or db.default
+    db.remote[branch] = construct_remote(
+      tracking_shas[branch],
+      db.email,
+      branch,
+      branch_integration,
+      git_utils,
+      tracking_shas.get(branch_integration),
+      db.authors_limit,
+    )
+  db.remote_loaded = True
+
+  save_state(db, git_utils)
+
+
+def save_state(db: Db, git_utils: GitUtils) -> None:
+  """Saves the state of the branches in `db` if the hooks that keep it up to date are installed.
+
+  `db` must have all the branches, and `table_row` must have loaded the ones it could.
+  """
+  from . import state
+
+  common_dir = git_utils.git_dirs()[1]
+  if state.enabled(common_dir):
+    state.write(
+      common_dir,
+      db.default,
+      [branch_record(db, branch) for branch in db.local],
+      prs_loaded=db.prs_loaded and "GITHUB_TOKEN" in os.environ,
+      remote_loaded=db.remote_loaded,
+    )
+
+
+def watch(args: argparse.Namespace, git_utils: GitUtils) -> int:
+  """Prints the table and the update commands, and prints them again whenever refs change, until
+  interrupted. On a terminal the screen is cleared first so the table updates in place.
+
+  The `Db` is loaded again on every change: a single walk of the commits ahead of the default and
+  integration branches, and the comparison of each branch to its integration branch, which is only
+  run for the branches whose sha or integration branch sha changed. Rows only need `table_row`
+  again when their branch's record, the default branch, origin or the current branch changed.
+  Origin shas and PRs are queried again every `PULL_REQUEST_CACHE_SECONDS`, or for origin, when
+  remote tracking refs change.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  global pull_request_cache
+
+  if args.json or args.ndjson or args.tui or args.operation is not None:
+    print("--watch can't be combined with --json, --ndjson, --tui or amend.")
+    return 1
+
+  from .utils.git_utils import backend
+  from .watch import RefWatcher
+
+  watcher = RefWatcher(*git_utils.git_dirs())
+  pull_request_cache = {}
+  # Per branch: what its row depends on, the row, and its records once `table_row` completed them
+  rows: dict[StrBranchName, tuple[tuple, DictTableRow, LocalBranch, RemoteBranch | None]] = {}
+  remote_shas = None
+  previous = None
+  refreshed_at = time.monotonic()
+  show_warnings = True
+
+  try:
+    while True:
+      started_at = time.monotonic()
+      if started_at - refreshed_at >= PULL_REQUEST_CACHE_SECONDS:
+        pull_request_cache.clear()
+        rows.clear()
+        remote_shas = None
+        previous = None
+        refreshed_at = started_at
+
+      if sys.stdout.isatty():
+        sys.stdout.write("\x1b[H\x1b[2J")
+
+      db = load_db(args, git_utils, remote_shas, previous)
+      if remote_shas is None and db.remote_loaded:
+        remote_shas = {branch: remote.sha for branch, remote in db.remote.items()}
+
+      previous_rows = rows
+      rows = {}
+      with renderer(args) as table:
+        for branch in db.local:
+          key = (
+            replace(db.local[branch], tip=-1),
+            db.local[db.default].sha,
+            db.remote_sha(branch),
+            db.remote_sha(db.local[branch].integration or db.default),
+            branch == db.current,
+          )
+          if branch in previous_rows and previous_rows[branch][0] == key:
+            _key, row_dict, branchd, remote = previous_rows[branch]
+            db.local[branch] = replace(branchd, tip=db.local[branch].tip)
+            if remote is not None:
+              db.remote[branch] = remote
+          else:
+            row_dict = table_row(db, branch, git_utils, show_warnings, args.columns)
+            show_warnings = False
+
+          rows[branch] = (key, row_dict, db.local[branch], db.remote.get(branch))
+          table.add_row([row_dict.get(column_key) for column_key in args.columns])
+
+      # Planning the update commands changes the records of the branches it pulls
+      previous = replace(db, local=dict(db.local))
+
+      # Nothing is ever run. Errors (a base branch cycle mid rebase) are printed like the commands
+      print_commands(args, db, git_utils)
+
+      elapsed_ms = (time.monotonic() - started_at) * 1000
+      updated_at = datetime.now().strftime("%H:%M:%S")
+      print(
+        f"Watching refs ({watcher.method}). Updated at {updated_at} in {elapsed_ms:.0f}ms. "
+        "Press Ctrl-C to quit.",
+        flush=True,
+      )
+
+      timeout = refreshed_at + PULL_REQUEST_CACHE_SECONDS - time.monotonic()
+      changed = watcher.wait(max(timeout, 0))
+      if any(f"{os.sep}refs{os.sep}remotes{os.sep}" in path for path in changed):
+        remote_shas = None
+
+      # HEAD may be on another branch
+      git_utils = backend().from_path(git_utils.working_tree_dir())
+  except KeyboardInterrupt:
+    return 0
+  finally:
+    watcher.close()
+
+
+def quick_row(db: Db, branch: StrBranchName) -> DictTableRow:
+  """Returns the cells of `branch` that can be built from `db` alone, without running any query.
+
+  The interactive view shows these until `table_row` loads the rest of the row.
+  """
+  branchd = db.local[branch]
+  current_style = CURRENT_BRANCH_COLOR if branch == db.current else None
+  behind, ahead = branchd.distance_default
+
+  ret = {
+    "origin": (Segment(" "), Segment((db.remote_sha(branch) or "")[:5])),
+    "local": (
+      Segment(branchd.sha[:5]),
+      Segment("!", "red") if branchd.shas_ahead_default_other_authors else Segment(" "),
+    ),
+    "behind": (Segment(str(behind), current_style),),
+    "ahead": (Segment(str(ahead), current_style),),
+    "branch": (Segment(branch, current_style),),
+    "base": (Segment(base_label(db, branch)),),
+  }
+
+  if branchd.has_merge_commits:
+    ret["ahead"] += (Segment(" "), Segment("M", MERGE_COMMIT_COLOR))
+
+  return ret
+
+
+def branch_details(db: Db, branch: StrBranchName) -> str:
+  """Returns the details line the interactive view shows for the selected branch"""
+  branchd = db.local[branch]
+  ret = f"{branch} {branchd.sha}"
+
+  relationship = db.remote_relationship(branch)
+  if relationship is not None:
+    ret += f"  origin: {relationship}"
+
+  if branchd.shas_ahead_default_other_authors:
+    ret += f"  other authors: {', '.join(sorted(branchd.shas_ahead_default_other_authors))}"
+
+  if branchd.pr_url is not None:
+    ret += f"  PR ({branchd.pr_status}): {branchd.pr_url}"
+
+  return ret
+
+
+def branch_record(db: Db, branch: StrBranchName) -> DictRecord:
+  """Returns everything `db` knows about `branch` as a JSON serializable dict.
+
+  Must be called after `table_row` loaded the origin and PR state of `branch`. `remote` is None
+  when the branch is not in origin, and `pr` when it has no pull request. Neither tells anything
+  when the db's `remote_loaded` or `prs_loaded` are false. In shallow clones `behind` and `ahead`
+  can be lower bounds, see `distance_at_least`.
+  """
+  branchd = db.local[branch]
+  behind, ahead = branchd.distance_default
+  ret = {
+    "name": branch,
+    "current": branch == db.current,
+    "default": branchd.default,
+    "sha": branchd.sha,
+    "behind": behind,
+    "ahead": ahead,
+    "distance_at_least": isinstance(behind, AtLeast) or isinstance(ahead, AtLeast),
+    "base": branchd.base if branchd.base != db.default else None,
+    "integration": branchd.integration,
+    "base_behind": branchd.distance_base[0],
+    "base_ahead": branchd.distance_base[1],
+    "has_merge_commits": branchd.has_merge_commits,
+    "other_authors": sorted(branchd.shas_ahead_default_other_authors),
+    "remote": None,
+    "pr": None,
+  }
+
+  remote = db.remote.get(branch)
+  if remote is not None:
+    local_only, remote_only = remote.distance_local or (0, 0)
+    ret["remote"] = {
+      "sha": remote.sha,
+      "relationship": remote.relationship,
+      "ahead_of_local": remote_only,
+      "behind_local": local_only,
+      "other_authors": sorted(remote.shas_ahead_default_other_authors),
+    }
+
+  if branchd.pr_status is not None:
+    ret["pr"] = {
+      "status": branchd.pr_status,
+      "number": branchd.pr_number,
+      "url": branchd.pr_url,
+      "sha": branchd.pr_sha,
+    }
 
   return ret
 
 
-def print_table(args: argparse.Namespace, table: Table, git_utils: GitUtils) -> dict:
+def renderer(args: argparse.Namespace) -> RichRenderer | PlainRenderer | TsvRenderer:
+  """Returns the renderer for the table. rich is only used when stdout is a terminal."""
+  columns = {column_key: COLUMNS[column_key] for column_key in args.columns}
+  if args.tsv:
+    return TsvRenderer(columns)
+  elif args.plain or (not args.rich and not sys.stdout.isatty()):
+    return PlainRenderer(columns)
+  else:
+    return RichRenderer(columns)
+
+
+def print_table(
+  args: argparse.Namespace, table: RichRenderer | PlainRenderer | TsvRenderer, git_utils: GitUtils
+) -> Db:
   """Prints out the state of all local branches in a table.
 
   Returns:
-    A dict with the required arguments to generate update commands. The keys of this dict must be
-    the arguments to the function that outputs the update commands.
+    The `Db` with the state of all the branches shown. It is what the functions that output the
+    update commands work with.
   """
-  db = create_db(git_utils, short=args.short)
+  db = load_db(args, git_utils)
   show_warnings = True
-  for branch in db["local"]:
-    row_dict = table_row(db, branch, git_utils, show_warnings)
+  for branch in db.local:
+    row_dict = table_row(db, branch, git_utils, show_warnings, args.columns)
     show_warnings = False
-    table.add_row(*[row_dict.get(column_key) for column_key in COLUMNS.keys()])
+    table.add_row([row_dict.get(column_key) for column_key in args.columns])
 
   return db
 
 
+def load_db(
+  args: argparse.Namespace,
+  git_utils: GitUtils,
+  remote_shas: dict[StrBranchName, StrSha] | None = None,
+  previous: Db | None = None,
+) -> Db:
+  """Creates the `Db` of the branches `args` asks for, loading only what `args.columns` needs
+
+  Args:
+    remote_shas: the shas of the branches in origin, if they are already known. Otherwise they're
+      queried with `git ls-remote`.
+    previous: a `Db` loaded before with the same `args`, see `refresh_distances`.
+  """
+  load_remote = bool({"origin", "relationship"} & set(args.columns))
+  db = create_db(
+    git_utils,
+    branches=filtered_branches(args, git_utils),
+    short=args.short,
+    load_remote=load_remote and remote_shas is None,
+    integration=args.integration,
+    # Tables only show whether there are other authors, JSON and the TUI's details list them
+    authors_limit=args.max_authors if args.json or args.ndjson or args.tui else 1,
+    previous=previous,
+  )
+
+  if load_remote and remote_shas is not None:
+    db.remote_loaded = True
+    for branch in remote_shas.keys() & db.local.keys():
+      db.remote[branch] = RemoteBranch(sha=remote_shas[branch])
+    fetch_remote_shas(db, git_utils)
+
+  db.prs_loaded = "pr" in args.columns
+  return db
+
+
+def filtered_branches(args: argparse.Namespace, git_utils: GitUtils) -> list[StrBranchName] | None:
+  """Returns the local branches that pass the branch filters in `args`.
+
+  The current branch is always kept. Returns None if there are no filters.
+  """
+  if not (args.include or args.exclude or args.max_age is not None or args.mine):
+    return None
+
+  ret = git_utils.branches(
+    include=args.include,
+    exclude=args.exclude,
+    max_age_days=args.max_age,
+    author_email=git_utils.current_user_email() if args.mine else None,
+  )
+
+  current = git_utils.current_branch()
+  if current and current not in ret:
+    ret.append(current)
+
+  return ret
+
+
 def create_db(
   git_utils: GitUtils,
   default: str | None = None,
   branches: list[str] | None = None,
   ignore_behind: bool = False,
   short=False,
-  remote: dict[StrBranchName, dict] = None,
-):
+  remote: dict[StrBranchName, RemoteBranch] | None = None,
+  load_remote: bool = True,
+  authors_limit: int | None = None,
+  integration: list[str] | None = None,
+  previous: Db | None = None,
+) -> Db:
+  """Creates the `Db` of the local `branches`, all of them by default.
+
+  Args:
+    integration: patterns of the integration branches, see `Db.integration`. The values of the
+      `INTEGRATION_CONFIG` git config by default.
+    previous: a `Db` created before for the same repository, see `refresh_distances`.
+  """
   if not default:
     default = git_utils.main_branch()
 
-  db = {
-    "email": git_utils.current_user_email(),
-    "default": default,
-    "current": git_utils.current_branch(),
-    "local": {},
-    "remote": {},
-  }
+  db = Db(
+    email=git_utils.current_user_email(),
+    default=default,
+    current=git_utils.current_branch(),
+    authors_limit=authors_limit,
+  )
 
-  local: dict[str, dict] = {
-    default: {
-      "sha": git_utils.local_sha_from_branch(default),
-      "pr_status": None,
-      "pr_sha": None,
-      "distance_default": (0, 0),
-      "distance_base": (0, 0),
-      "base": default,
-      "has_merge_commits": False,
-      "shas_ahead_default": [],
-      "shas_ahead_default_other_authors": set(),
-      "default": True,
-    }
+  local: dict[StrBranchName, LocalBranch] = {
+    default: LocalBranch(
+      sha=git_utils.local_sha_from_branch(default),
+      base=default,
+      default=True,
+    )
   }
 
   if branches is None:
     branches = git_utils.branches()
 
+  branch_shas = git_utils.local_shas_from_branches()
+  commits = None
+
+  if integration is None:
+    integration = git_utils.config_values(INTEGRATION_CONFIG)
+  db.integration = integration_branches(integration, branch_shas, default)
+
+  if short:
+    # Only the branches connected to the current branch are displayed. Find them with the commit
+    # store alone so the per-branch queries below only run for those.
+    commits = load_commits(
+      [local[default].sha, *db.integration.values()],
+      [branch_shas[branch] for branch in branches if branch not in db.integration],
+      db.email,
+      git_utils,
+      authors_limit,
+    )
+    branches = connected_branches(commits, branches, branch_shas, default, db.current)
+
   for branch in branches:
     if branch == default:
       continue
 
-    distance_default = git_utils.distance(default, branch)
-    if ignore_behind and distance_default[0]:
+    if ignore_behind and git_utils.distance(default, branch)[0]:
       continue
 
-    local[branch] = {
-      "sha": git_utils.local_sha_from_branch(branch),
-      "pr_status": None,  # one of [None, "open", "merged", "closed"]
-      "pr_sha": None,
-      "distance_default": distance_default,
-      "distance_base": distance_default,
-      "base": default,
-      "has_merge_commits": False,
-      "shas_ahead_default": [],
-      "shas_ahead_default_other_authors": set(),
-      "default": False,
-    }
+    local[branch] = LocalBranch(sha=branch_shas[branch], base=default)
 
-  refresh_distances(local, default, db["email"], git_utils)
+  db.commits = refresh_distances(
+    local, default, db.email, git_utils, commits, authors_limit, db.integration, previous
+  )
 
-  for branch in local_branches_order(local, short, db["current"], db["default"]):
-    if branch not in db["local"]:
-      db["local"][branch] = local[branch]
+  for branch in local_branches_order(local, short, db.current, db.default):
+    if branch not in db.local:
+      db.local[branch] = local[branch]
 
-  if remote is None:
-    for branch, remote_sha in git_utils.remote_shas(list(db["local"].keys())).items():
-      db["remote"][branch] = construct_empty_remote(remote_sha)
+  if not load_remote:
+    db.remote_loaded = False
+  elif remote is None:
+    for branch, remote_sha in git_utils.remote_shas(list(db.local.keys())).items():
+      db.remote[branch] = RemoteBranch(sha=remote_sha)
+    fetch_remote_shas(db, git_utils)
   else:
-    for branch in remote.keys() & db["local"].keys():
-      db["remote"][branch] = construct_remote(
-        remote[branch]["sha"],
-        db["email"],
+    for branch in remote.keys() & db.local.keys():
+      branch_integration = db.local[branch].integration or default
+      remote_integration = remote.get(branch_integration)
+      db.remote[branch] = construct_remote(
+        remote[branch].sha,
+        db.email,
         branch,
-        default,
+        branch_integration,
         git_utils,
-        get(remote, [default, "sha"]),
+        remote_integration.sha if remote_integration is not None else None,
+        db.authors_limit,
       )
 
   return db
 
 
+def integration_branches(
+  patterns: list[str], branch_shas: dict[StrBranchName, StrSha], default: StrBranchName
+) -> dict[StrBranchName, StrSha]:
+  """Returns the local branches other than `default` that match any of the shell-style `patterns`,
+  with their shas
+  """
+  if not patterns:
+    return {}
+
+  from fnmatch import fnmatchcase
+
+  return {
+    branch: sha
+    for branch, sha in branch_shas.items()
+    if branch != default and any(fnmatchcase(branch, pattern) for pattern in patterns)
+  }
+
+
+def fetch_remote_shas(db: Db, git_utils: GitUtils) -> None:
+  """Fetches the commits of `db.remote` that differ from the local branch and don't exist locally,
+  all at once. `table_row` needs them, and would otherwise fetch them one by one.
+  """
+  git_utils.fetch_shas(
+    [remote.sha for branch, remote in db.remote.items() if remote.sha != db.local[branch].sha]
+  )
+
+
 def table_row(
-  db: dict,
+  db: Db,
   branch: StrBranchName,
   git_utils: GitUtils,
   show_warnings: bool,
+  columns: list[str] | None = None,
 ) -> DictTableRow:
-  """Populates `ret` and returns a dictionary with `COLUMNS` values to add to the table
+  """Populates `ret` and returns a dictionary with `COLUMNS` cells to add to the table
 
   The main two purposes of this function are:
     1. Create a dict with column information about this `branch`. Caller should use this dict to
-       add a row to the table that is being printed out to the screen.
+       add a row to the table that is being printed out to the screen. Each value is a `Cell`, the
+       segments of text of the cell with their style, so that any renderer can output it.
     2. Populate/modify `ret`. As it gains more information about `branch` to display out to the
        screen, if this information is relevant to the later fuction that creates the update commands
        it will populate `ret` with this information.
@@ -346,19 +1117,23 @@ def table_row(
     branch_distances: the ahead/behind distances (values) for each branch (keys).
     ret: The keys of this dict must be the arguments to the function that outputs the update
       commands.
+    columns: `COLUMNS` keys that are displayed. Data only needed by other columns is not fetched.
   """
+  if columns is None:
+    columns = list(COLUMNS.keys())
+
   row_dict = {}  # See `COLUMNS` for valid keys.
-  default = db["default"]
+  default = db.default
+  # What the distances, the ahead lists and the compare links are relative to
+  integration = db.local[branch].integration or default
   sync_status = "not_pushed"  # means this branch is not in origin
   # 'synced'       means this branch is in origin and is the same as local
   # 'unsynced'     means this branch is in origin but is not the same as local
 
-  local_commit = git_utils.local_commit_from_sha(db["local"][branch]["sha"])
-  local_sha = str(local_commit)
+  local_sha = db.local[branch].sha
   local_sha_short = local_sha[:5]
 
-  remote_commit: Commit | None = None
-  remote_sha = get(db, ["remote", branch, "sha"])
+  remote_sha = db.remote_sha(branch)
   remote_sha_short = ""
 
   if remote_sha is not None:
@@ -367,36 +1142,27 @@ def table_row(
       sync_status = "synced"
     else:
       sync_status = "unsynced"
-      remote_commit = git_utils.local_commit_from_sha(remote_sha)
-      if remote_commit is None:
-        remote_commit = git_utils.fetch_single_sha(remote_sha)
+      git_utils.fetch_single_sha(remote_sha)
 
-    db["remote"][branch] = construct_remote(
+    db.remote[branch] = construct_remote(
       remote_sha,
-      db["email"],
+      db.email,
       branch,
-      default,
+      integration,
       git_utils,
-      get(db, ["remote", default, "sha"]),
+      db.remote_sha(integration),
+      db.authors_limit,
     )
 
-  try:
-    pr = None
-    if "GITHUB_TOKEN" in os.environ:
-      pr = pull_request(branch, os.environ["GITHUB_TOKEN"], git_utils)
-    elif show_warnings and "PYTEST_CURRENT_TEST" not in os.environ:
-      print("WARNING: GITHUB_TOKEN envar is not set.")
-  except requests.exceptions.ConnectionError:
-    pr = None
-    if show_warnings:
-      print("WARNING: there is internet connection issues.")
-      print("Network dependent functionality will not work.")
-  except GitHubApiError as exception:
-    pr = None
-    if show_warnings:
-      print(f"WARNING: {exception}")
+  pr = None
+  if "pr" not in columns:
+    pass
+  elif "GITHUB_TOKEN" in os.environ:
+    pr = pull_request_or_warn(branch, os.environ["GITHUB_TOKEN"], git_utils, show_warnings)
+  elif show_warnings and "PYTEST_CURRENT_TEST" not in os.environ:
+    print("WARNING: GITHUB_TOKEN envar is not set.")
 
-  # TODO: only consider the PR if it's against the db["default"] ?
+  # TODO: only consider the PR if it's against the db.default ?
   if pr is not None and branch != default:
     if pr.get("state") == "open":
       pr_status = "open"
@@ -405,93 +1171,100 @@ def table_row(
     else:
       pr_status = "closed"
 
-    db["local"][branch]["pr_status"] = pr_status
-    db["local"][branch]["pr_sha"] = pr["head"]["sha"]
-
-    pr_short_sha = pr["head"]["sha"][:5]
-    if pr["head"]["sha"] == local_sha:
-      pr_short_sha = f"[{LOCAL_SHA_COLOR}]{pr_short_sha}[/{LOCAL_SHA_COLOR}]"
+    db.local[branch] = replace(
+      db.local[branch],
+      pr_status=pr_status,
+      pr_sha=intern_sha(pr["head"]["sha"]),
+      pr_number=pr["number"],
+      pr_url=pr["html_url"],
+    )
 
     row_dict["pr"] = (
-      f"[link={pr['html_url']}][{PR_STATUS_COLORS[pr_status]}]#{pr['number']}"
-      f"[/{PR_STATUS_COLORS[pr_status]}][/link] ({pr_short_sha}) by " + pr["user"]["login"]
+      Segment(f"#{pr['number']}", PR_STATUS_COLORS[pr_status], pr["html_url"]),
+      Segment(" ("),
+      Segment(pr["head"]["sha"][:5], LOCAL_SHA_COLOR if pr["head"]["sha"] == local_sha else None),
+      Segment(") by " + pr["user"]["login"]),
     )
 
-  message_remote_sha = remote_sha_short
+  remote_style = None
+  remote_link = None
   if sync_status == "synced":
-    message_remote_sha = f"[{LOCAL_SHA_COLOR}]{remote_sha_short}[/{LOCAL_SHA_COLOR}]"
+    remote_style = LOCAL_SHA_COLOR
   elif sync_status == "unsynced":
-    if remote_commit.committed_date < local_commit.committed_date:
-      message_remote_sha = f"[dim]{remote_sha_short}[/dim]"
+    if git_utils.date_committed(remote_sha) < git_utils.date_committed(local_sha):
+      remote_style = "dim"
     else:
-      message_remote_sha = f"[bold]{remote_sha_short}[/bold]"
+      remote_style = "bold"
 
-    row_dict["relationship"] = db["remote"][branch]["relationship"]
-    if row_dict["relationship"] == "Y":
-      row_dict["relationship"] = "[yellow]" + row_dict["relationship"] + "[/yellow]"
+    relationship = db.remote[branch].relationship
+    row_dict["relationship"] = (Segment(relationship, "yellow" if relationship == "Y" else None),)
 
   if sync_status in ["synced", "unsynced"] and branch != default:
     owner, repo = git_utils.owner_and_repo()
-    url = f"https://github.com/{owner}/{repo}/tree/{branch}"
-    message_remote_sha = f"[link={url}]{message_remote_sha}[/link]"
+    remote_link = f"https://github.com/{owner}/{repo}/tree/{branch}"
 
-  behind, ahead = db["local"][branch]["distance_default"]
-  row_dict["ahead"] = str(ahead)
-  row_dict["behind"] = str(behind)
+  current_style = CURRENT_BRANCH_COLOR if branch == git_utils.current_branch() else None
+  behind, ahead = db.local[branch].distance_default
+  ahead_link = None
+  behind_link = None
 
   if (
     sync_status in ["synced"]
     and branch != default
-    and default in db["remote"]
-    and db["remote"][default]["sha"] == db["local"][default]["sha"]
+    and integration in db.remote
+    and db.remote[integration].sha == db.local[integration].sha
   ):
     if ahead > 0:
-      url = f"https://github.com/{owner}/{repo}/compare/{default}...{branch}"
-      row_dict["ahead"] = f"[link={url}]{row_dict['ahead']}[/link]"
+      ahead_link = f"https://github.com/{owner}/{repo}/compare/{integration}...{branch}"
 
     if behind > 0:
-      url = f"https://github.com/{owner}/{repo}/compare/{branch}...{default}"
-      row_dict["behind"] = f"[link={url}]{row_dict['behind']}[/link]"
+      behind_link = f"https://github.com/{owner}/{repo}/compare/{branch}...{integration}"
+
+  row_dict["ahead"] = (Segment(str(ahead), current_style, ahead_link),)
+  row_dict["behind"] = (Segment(str(behind), current_style, behind_link),)
 
-  if db["email"] is None and show_warnings:
+  if db.email is None and show_warnings:
     print("WARNING: No user email configured in git.")
     print("Set it with git config --global user.email 'first.last@example.com'")
 
-  if get(db, ["remote", branch, "shas_ahead_default_other_authors"], []):
-    message_remote_sha = f"[red]![/red]{message_remote_sha}"
+  if branch in db.remote and db.remote[branch].shas_ahead_default_other_authors:
+    remote_marker = Segment("!", "red")
   else:
-    message_remote_sha = f" {message_remote_sha}"
+    remote_marker = Segment(" ")
 
-  if db["local"][branch]["shas_ahead_default_other_authors"]:
-    message_local_sha = f"{local_sha_short}[red]![/red]"
+  if db.local[branch].shas_ahead_default_other_authors:
+    local_marker = Segment("!", "red")
   else:
-    message_local_sha = f"{local_sha_short} "
+    local_marker = Segment(" ")
 
-  base_branch = ""
-  if db["local"][branch]["base"] != default:
-    base_branch = db["local"][branch]["base"]
-    if db["local"][branch]["distance_base"][0]:
-      base_branch += f"~{db['local'][branch]['distance_base'][0]}"
+  row_dict["base"] = (Segment(base_label(db, branch)),)
+  row_dict["origin"] = (remote_marker, Segment(remote_sha_short, remote_style, remote_link))
+  row_dict["local"] = (Segment(local_sha_short), local_marker)
+  if "age" in columns:
+    age = (datetime.now(timezone.utc) - git_utils.date_authored(local_sha)).days
+    row_dict["age"] = (Segment(str(age)),)
+  row_dict["branch"] = (Segment(branch, current_style),)
 
-  row_dict["base"] = base_branch
-  row_dict["origin"] = message_remote_sha
-  row_dict["local"] = message_local_sha
-  row_dict["age"] = str((datetime.now(timezone.utc) - git_utils.date_authored(local_sha)).days)
-  row_dict["branch"] = branch
+  if db.local[branch].has_merge_commits:
+    row_dict["ahead"] += (Segment(" "), Segment("M", MERGE_COMMIT_COLOR))
 
-  if branch == git_utils.current_branch():
-    row_dict["branch"] = f"[{CURRENT_BRANCH_COLOR}]{row_dict['branch']}[/{CURRENT_BRANCH_COLOR}]"
-    row_dict["ahead"] = f"[{CURRENT_BRANCH_COLOR}]{row_dict['ahead']}[/{CURRENT_BRANCH_COLOR}]"
-    row_dict["behind"] = f"[{CURRENT_BRANCH_COLOR}]{row_dict['behind']}[/{CURRENT_BRANCH_COLOR}]"
+  return row_dict
 
-  if db["local"][branch]["has_merge_commits"]:
-    row_dict["ahead"] = f"{row_dict['ahead']} [{MERGE_COMMIT_COLOR}]M[/{MERGE_COMMIT_COLOR}]"
 
-  return row_dict
+def base_label(db: Db, branch: StrBranchName) -> str:
+  """Returns what the Base column shows for `branch`. Empty if it's based on the default branch."""
+  branchd = db.local[branch]
+  if branchd.base == db.default:
+    return ""
+
+  ret = branchd.base
+  if branchd.distance_base[0]:
+    ret += f"~{branchd.distance_base[0]}"
+  return ret
 
 
 def local_branches_order(
-  local: dict[str, dict],
+  local: dict[StrBranchName, LocalBranch],
   short: bool,
   current: StrBranchName,
   default: StrBranchName,
@@ -508,21 +1281,23 @@ def local_branches_order(
     # maps base branches to the branches that depend on those base branches
     dependent_branches: dict[StrBranchName, list[StrBranchName]] = {}
     # maps a branch to its base branch
-    base_branches: dict[StrBranchName, tuple[StrShaRef, int, int]] = {}
+    base_branches: dict[StrBranchName, BaseBranch] = {}
     for branch in sorted(
       local.keys(),
       key=lambda branch_name: (
-        local[branch_name]["distance_base"][1],
+        local[branch_name].distance_base[1],
         branch_name,
       ),
     ):
       branchd = local[branch]
-      if default in [branch, branchd["base"]]:
+      if branch == default or branchd.base == default:
         continue
 
-      dependent_branches[branchd["base"]] = dependent_branches.get(branchd["base"], [])
-      dependent_branches[branchd["base"]].append(branch)
-      base_branches[branch] = (branchd["base"], *branchd["distance_base"])
+      dependent_branches[branchd.base] = dependent_branches.get(branchd.base, [])
+      dependent_branches[branchd.base].append(branch)
+      # Like the default branch, integration branches are only part of the stack when current
+      if branchd.base != branchd.integration:
+        base_branches[branch] = (branchd.base, *branchd.distance_base)
 
     queue: list[StrBranchName] = []
     queue_saw: set[StrBranchName] = set()
@@ -563,61 +1338,202 @@ def local_branches_order(
   return ret
 
 
-def construct_empty_remote(remote_sha: StrSha) -> dict:
-  return {
-    "sha": remote_sha,
-    "distance_local": None,
-    "relationship": None,  # one of [None, ">", "<", "Y"]
-    "distance_default": None,
-    "shas_ahead_default": [],
-    "shas_ahead_default_other_authors": set(),
-    "distance_default_local": None,
-    "shas_ahead_default_local": [],
-    "shas_ahead_default_local_other_authors": set(),
-  }
+def load_commits(
+  default_shas: list[StrSha],
+  branch_shas: list[StrSha],
+  local_email: str | None,
+  git_utils: GitUtils,
+  authors_limit: int | None = None,
+) -> CommitStore:
+  """Loads all the commits of all the `branch_shas` that are not in any of `default_shas`, the
+  default and integration branches, with a single `git log`
+  """
+  commits = CommitStore(authors_limit=authors_limit)
+  for sha, parent_shas, email in git_utils.commits_ahead_of(default_shas, branch_shas):
+    commits.add(sha, parent_shas, email, local_email)
+  return commits
+
+
+def connected_branches(
+  commits: CommitStore,
+  branches: list[StrBranchName],
+  branch_shas: dict[StrBranchName, StrSha],
+  default: StrBranchName,
+  current: StrBranchName | None,
+) -> list[StrBranchName]:
+  """Returns the branches `--short` displays: the default one and the current branch's stack.
+
+  Only uses `commits`, which must have the commits ahead of the default branch of all `branches`,
+  so it doesn't run any query per branch.
+  """
+  local = {default: LocalBranch(sha=branch_shas.get(default, ""), base=default, default=True)}
+  tips = {}
+  for branch in branches:
+    if branch == default:
+      continue
+
+    tip = commits.indexes.get(branch_shas[branch], -1)
+    local[branch] = LocalBranch(sha=branch_shas[branch], base=default, tip=tip)
+    if tip >= 0 and not commits.has_merges[tip]:
+      tips[branch] = tip
+
+  bases = base_branches_from_commits(commits, tips)
+  for branch, (base, behind, ahead) in bases.items():
+    local[branch] = replace(local[branch], base=base, distance_base=(behind, ahead))
+
+  if (
+    current in local
+    and current != default
+    and local[current].tip < 0
+    and local[current].sha != local[default].sha
+  ):
+    # The current branch has nothing in the store, like an integration branch does. The branches
+    # forking from its tip are on top of it, unless that's also the tip of the default branch.
+    for branch, tip in tips.items():
+      if branch not in bases and commits.fork_points[tip] == branch_shas[current]:
+        local[branch] = replace(local[branch], base=current, distance_base=(0, commits.depths[tip]))
+
+  return local_branches_order(local, True, current, default)
 
 
 def refresh_distances(
-  local: dict[StrBranchName, dict], default: StrBranchName, local_email: str, git_utils: GitUtils
-) -> dict[StrBranchName, dict]:
+  local: dict[StrBranchName, LocalBranch],
+  default: StrBranchName,
+  local_email: str,
+  git_utils: GitUtils,
+  commits: CommitStore | None = None,
+  authors_limit: int | None = None,
+  integration: dict[StrBranchName, StrSha] | None = None,
+  previous: Db | None = None,
+) -> CommitStore:
   """
   For each branch except the default one in local, it updates:
+  - integration
   - distance_default
   - has_merge_commits
-  - shas_ahead_default
+  - tip
   - shas_ahead_default_other_authors
 
-  To do this, it uses local[default]["sha"], and the "sha" field for each branch in local
+  To do this, it uses local[default].sha, the shas of the `integration` branches, and the `sha`
+  field for each branch in local. All the commits not in the default or integration branches are
+  loaded with a single `git log` into a `CommitStore` that the branches point into, unless `commits`
+  already has them. Integration branches are compared to the default branch, and every other branch
+  to the nearest integration branch, see `nearest_integration`.
+
+  Both comparisons run a query per branch. They're reused from `previous`, if given, for the
+  branches whose sha and integration branch sha are the same as in it.
 
   Additionally, it calls `refresh_bases` so it updates all fields that refresh_bases updates
+
+  Returns:
+    The `CommitStore` the `tip` of each branch points into.
   """
-  default_sha = local[default]["sha"]
+  # The integration branches in `local` may have been moved since `integration` was loaded
+  integration_shas = {default: local[default].sha}
+  for branch, sha in (integration or {}).items():
+    integration_shas[branch] = local[branch].sha if branch in local else sha
+  if commits is None:
+    branch_shas = [
+      branchd.sha for branch, branchd in local.items() if branch not in integration_shas
+    ]
+    commits = load_commits(
+      list(integration_shas.values()), branch_shas, local_email, git_utils, authors_limit
+    )
+
+  known_distances, known_integrations = previous_distances(previous, integration_shas)
+  nearest: dict[StrSha | None, StrBranchName] = {}
   for branch, branchd in local.items():
     if branch == default:
       continue
 
-    branchd["distance_default"] = git_utils.distance(default_sha, branchd["sha"])
+    tip = commits.indexes.get(branchd.sha, -1)
+    has_merge_commits = tip >= 0 and commits.has_merges[tip]
+
+    branch_integration = default
+    if len(integration_shas) > 1 and branch not in integration_shas:
+      if branchd.sha in known_integrations:
+        branch_integration = known_integrations[branchd.sha]
+      else:
+        # Where the branch forks from the integration branches. All branches forking from the
+        # same commit share the same integration branch.
+        fork_point = commits.fork_points[tip] if tip >= 0 else branchd.sha
+        if fork_point not in nearest:
+          nearest[fork_point] = nearest_integration(
+            fork_point, integration_shas, default, git_utils
+          )
+        branch_integration = nearest[fork_point]
+
+    distance_key = (integration_shas[branch_integration], branchd.sha)
+    if distance_key not in known_distances:
+      known_distances[distance_key] = git_utils.distance(*distance_key)
+
+    local[branch] = replace(
+      branchd,
+      integration=branch_integration,
+      distance_default=known_distances[distance_key],
+      tip=tip,
+      has_merge_commits=has_merge_commits,
+      shas_ahead_default_other_authors=(
+        commits.other_authors[tip] if tip >= 0 and not has_merge_commits else frozenset()
+      ),
+    )
+
+  refresh_bases(local, default, commits)
+  return commits
 
-    for parents in git_utils.parent_shas_of_ref(branchd["sha"], branchd["distance_default"][1]):
-      if len(parents) > 2:
-        branchd["has_merge_commits"] = True
-        continue
 
-    branchd["shas_ahead_default"] = []
-    branchd["shas_ahead_default_other_authors"] = set()
+def previous_distances(
+  previous: Db | None, integration_shas: dict[StrBranchName, StrSha]
+) -> tuple[dict[tuple[StrSha, StrSha], Distance], dict[StrSha, StrBranchName]]:
+  """Returns what `refresh_distances` found for the branches of `previous`:
 
-    for sha in git_utils.shas_ahead_of(default_sha, branchd["sha"]):
-      if branchd["has_merge_commits"]:
-        continue
-      email = git_utils.commit_author_email(sha)
-      branchd["shas_ahead_default"].append({"sha": sha, "email": email})
-      if git_utils.commit_author_email(sha) != local_email:
-        branchd["shas_ahead_default_other_authors"].add(email)
+  - The `distance_default` of each branch, by the shas of its integration branch and its own.
+  - The integration branch of each branch, by its sha. Only if the integration branches have the
+    same shas, in the same order, as `integration_shas`.
+  """
+  if previous is None:
+    return ({}, {})
+
+  previous_shas = {previous.default: previous.local[previous.default].sha}
+  for branch, sha in previous.integration.items():
+    previous_shas[branch] = previous.local[branch].sha if branch in previous.local else sha
+
+  distances = {}
+  integrations = {}
+  same_integration = list(previous_shas.items()) == list(integration_shas.items())
+  for branch, branchd in previous.local.items():
+    if branchd.integration is None:
+      continue
+
+    distances[(previous_shas[branchd.integration], branchd.sha)] = branchd.distance_default
+    # Integration branches are compared to the default branch, whatever their sha
+    if same_integration and branch not in previous_shas:
+      integrations[branchd.sha] = branchd.integration
+
+  return (distances, integrations)
 
-    local[branch] = branchd
 
-  refresh_bases(local, default)
-  return local
+def nearest_integration(
+  sha: StrSha | None,
+  integration_shas: dict[StrBranchName, StrSha],
+  default: StrBranchName,
+  git_utils: GitUtils,
+) -> StrBranchName:
+  """Returns the integration branch that contains `sha` and has the fewest commits on top of it.
+  Ties go to the one first in `integration_shas`, and it's `default` if none contains it.
+  """
+  ret = default
+  ret_behind = None
+  if sha is None:
+    return ret
+
+  for branch, branch_sha in integration_shas.items():
+    behind, ahead = git_utils.distance(branch_sha, sha)
+    if ahead == 0 and (ret_behind is None or behind < ret_behind):
+      ret = branch
+      ret_behind = behind
+
+  return ret
 
 
 def construct_remote(
@@ -627,44 +1543,65 @@ def construct_remote(
   default: StrBranchName,
   git_utils: GitUtils,
   remote_default_sha: StrSha | None = None,
-):
-  ret = construct_empty_remote(remote_sha)
+  authors_limit: int | None = None,
+) -> RemoteBranch:
+  """Returns what origin's `remote_sha` of `branch` is compared to the local branches.
 
-  local_sha = git_utils.local_commit_from_branch(branch).hexsha
-  default_sha = git_utils.local_commit_from_branch(default).hexsha
+  Args:
+    authors_limit: most other authors to look for, see `Db.authors_limit`.
+  """
+  local_sha = git_utils.local_sha_from_branch(branch)
+  default_sha = git_utils.local_sha_from_branch(default)
   behind, ahead = git_utils.distance(local_sha, remote_sha)
 
-  ret["distance_local"] = (behind, ahead)
   if behind == 0 and ahead:
-    ret["relationship"] = ">"
+    relationship = ">"
   elif behind and ahead == 0:
-    ret["relationship"] = "<"
+    relationship = "<"
   elif behind and ahead:
-    ret["relationship"] = "Y"
+    relationship = "Y"
   else:
-    ret["relationship"] = "="
+    relationship = "="
 
+  distance_default = None
+  other_authors = frozenset()
   if remote_default_sha:
-    ret["distance_default"] = git_utils.distance(remote_default_sha, remote_sha)
-    for sha in git_utils.shas_ahead_of(remote_default_sha, remote_sha):
-      email = git_utils.commit_author_email(sha)
-      ret["shas_ahead_default"].append({"sha": sha, "email": email})
-      if email != local_email:
-        ret["shas_ahead_default_other_authors"].add(email)
-
-  default_sha = default_sha
-  ret["distance_default_local"] = git_utils.distance(default_sha, remote_sha)
-  for sha in git_utils.shas_ahead_of(default_sha, remote_sha):
-    email = git_utils.commit_author_email(sha)
-    ret["shas_ahead_default_local"].append({"sha": sha, "email": email})
-    if email != local_email and branch != default:
-      ret["shas_ahead_default_local_other_authors"].add(email)
+    distance_default = git_utils.distance(remote_default_sha, remote_sha)
+    other_authors = git_utils.other_authors_ahead_of(
+      remote_default_sha, remote_sha, local_email, authors_limit
+    )
+
+  local_other_authors = frozenset()
+  if branch != default:
+    local_other_authors = git_utils.other_authors_ahead_of(
+      default_sha, remote_sha, local_email, authors_limit
+    )
+
+  return RemoteBranch(
+    sha=remote_sha,
+    distance_local=(behind, ahead),
+    relationship=relationship,
+    distance_default=distance_default,
+    shas_ahead_default_other_authors=other_authors,
+    distance_default_local=git_utils.distance(default_sha, remote_sha),
+    shas_ahead_default_local_other_authors=local_other_authors,
+  )
+
+
+def unavailable_suggestions(db: Db) -> list[str]:
+  """Returns what update suggestions can't be made because of the data that wasn't loaded"""
+  ret = []
+
+  if not db.remote_loaded:
+    ret.append("Origin is not displayed, so pull, push and delete commands can't be suggested.")
+  elif not db.prs_loaded:
+    ret.append("PR is not displayed, so delete commands for merged branches can't be suggested.")
 
   return ret
 
 
 def generate_amend_commands(
-  db: dict, git_utils: GitUtils, no_push: bool = False
+  db: Db, git_utils: GitUtils, no_push: bool = False, steps: list[RebaseStep] | None = None
 ) -> tuple[str | None, list[StrCommand] | None]:
   """Returns a list of commands to run to amend the current commit and maintain tree structure
 
@@ -673,53 +1610,137 @@ def generate_amend_commands(
     1. If an error occurs, this will be the message string, otherwise None.
     2. A list of commands to run
   """
-  if db["local"][db["current"]]["has_merge_commits"]:
+  if db.local[db.current].has_merge_commits:
     return ("Tool limitation: cannot amend or update branches with merge commits.", None)
-  remote = copy.deepcopy(db["remote"])
-  db = create_db(
-    git_utils,
-    default=db["current"],
-    branches=db["local"].keys() - {db["default"]},
-    ignore_behind=True,
-    remote=db["remote"],
-  )
-  for branch, branchd in db["local"].items():
-    branchd["distance_default"] = (
-      branchd["distance_default"][0] + 1,
-      branchd["distance_default"][1],
+  # Branch records are immutable, so the remote state can be shared with the new db as is.
+  remote = db.remote
+  if db.local[db.current].tip >= 0:
+    db = amend_db(db, git_utils)
+  else:
+    # The current branch has nothing ahead of the default and integration branches, so the
+    # branches on top of it are not in the commit store
+    db = create_db(
+      git_utils,
+      default=db.current,
+      branches=db.local.keys() - {db.default},
+      ignore_behind=True,
+      remote=db.remote,
+      load_remote=db.remote_loaded,
+      authors_limit=db.authors_limit,
+      # Only the current branch and the branches on top of it are amended
+      integration=[],
     )
-    if branchd["has_merge_commits"]:
-      return ("Tool limitation: cannot amend or update branches with merge commits.", None)
-  db["remote"] = remote
+    for branch, branchd in db.local.items():
+      db.local[branch] = replace(
+        branchd, distance_default=(branchd.distance_default[0] + 1, branchd.distance_default[1])
+      )
+
+  if any(branchd.has_merge_commits for branchd in db.local.values()):
+    return ("Tool limitation: cannot amend or update branches with merge commits.", None)
+  db.remote = remote
   amend_commands = ["git add -A && git commit --amend --no-edit"]
-  other_authors = db["local"][db["current"]]["shas_ahead_default_other_authors"]
-  if get(db, ["remote", db["current"], "relationship"]) == "=" and not other_authors:
+  other_authors = db.local[db.current].shas_ahead_default_other_authors
+  if db.remote_relationship(db.current) == "=" and not other_authors:
     amend_commands[0] += " && git push -f"
-  return (None, amend_commands + generate_update_commands(db, git_utils, no_push, True))
+
+  try:
+    return (None, amend_commands + generate_update_commands(db, git_utils, no_push, True, steps))
+  except BaseBranchCycleError as exception:
+    return (str(exception), None)
+
+
+def amend_db(db: Db, git_utils: GitUtils) -> Db:
+  """Returns the db `generate_update_commands` plans an amend with: the current branch as the
+  default one, and the branches on top of it one commit behind it.
+
+  It's derived from the `CommitStore` of `db` instead of being loaded again. The current branch must
+  be in it. The branches on top of it are the ones whose chain goes through its tip, which makes
+  them part of its stack, so `db` has them even if it only has the branches `--short` shows. Their
+  distances, other authors and bases come from the store as well. Only branches with merge commits,
+  whose chain can miss the tip when it's not a first parent, run a query.
+  """
+  commits = db.commits
+  current = db.local[db.current]
+  current_depth = commits.depths[current.tip]
+  ret = Db(
+    email=db.email,
+    default=db.current,
+    current=db.current,
+    commits=commits,
+    remote_loaded=db.remote_loaded,
+    authors_limit=db.authors_limit,
+  )
+  # With its tip, the current branch owns its commits in `refresh_bases`, so the branches on top of
+  # it are based on it rather than on each other
+  ret.local[db.current] = LocalBranch(
+    sha=current.sha, base=db.current, default=True, tip=current.tip
+  )
+
+  for branch, branchd in db.local.items():
+    if branch == db.current or branchd.tip < 0:
+      continue
+
+    other_authors = set()
+    idx = branchd.tip
+    while idx >= 0 and commits.depths[idx] > current_depth:
+      email = commits.emails[idx]
+      if email != db.email and (db.authors_limit is None or len(other_authors) < db.authors_limit):
+        other_authors.add(email)
+      idx = commits.parents[idx]
+
+    has_merge_commits = commits.has_merges[branchd.tip]
+    if idx != current.tip and not (
+      has_merge_commits and git_utils.is_ancestor(current.sha, branchd.sha)
+    ):
+      continue
+
+    ret.local[branch] = LocalBranch(
+      sha=branchd.sha,
+      distance_default=(1, commits.depths[branchd.tip] - current_depth),
+      base=db.current,
+      has_merge_commits=has_merge_commits,
+      tip=branchd.tip,
+      shas_ahead_default_other_authors=frozenset(other_authors),
+      integration=db.current,
+    )
+
+  refresh_bases(ret.local, db.current, commits)
+  return ret
 
 
 def generate_update_commands(
-  db: dict, git_utils: GitUtils, no_push: bool = False, is_amend: bool = False
+  db: Db,
+  git_utils: GitUtils,
+  no_push: bool = False,
+  is_amend: bool = False,
+  steps: list[RebaseStep] | None = None,
 ) -> list[StrCommand]:
-  """Creates and returns the list of git commands to run to update the branches."""
+  """Creates and returns the list of git commands to run to update the branches.
+
+  `db` is left untouched. Planning works on a derived view of it that only replaces the records of
+  the branches it changes.
+
+  Args:
+    steps: if given, a `RebaseStep` is appended to it for each rebase command, in the same order.
+  """
+  db = db.derive()
   update_commands = []
-  default = db["default"]
-  current_original = db["current"]
-  current = db["current"]
+  default = db.default
+  current_original = db.current
+  current = db.current
 
   #
   # Populate branches_to_delete
   #
 
   branches_to_delete: set[StrBranchName] = set()
-  for branch, branchd in db["local"].items():
-    if branch == default:
+  for branch, branchd in db.local.items():
+    if branch == default or branch in db.integration:
       continue
-    if (
-      branchd["pr_status"] == "merged"
-      and branchd["pr_sha"] == branchd["sha"]
-      and branch not in db["remote"]
-    ):
+    if not db.remote_loaded:
+      # Without remote data there is no way to tell whether the branch was deleted in origin
+      continue
+    if branchd.pr_status == "merged" and branchd.pr_sha == branchd.sha and branch not in db.remote:
       branches_to_delete.add(branch)
   if branches_to_delete and current != default:
     update_commands.append(f"git checkout {default}")
@@ -728,20 +1749,22 @@ def generate_update_commands(
     update_commands.append(f"git branch -D {branch}")
 
   for branch in branches_to_delete:
-    del db["local"][branch]
+    del db.local[branch]
 
   #
   # Pull default
   #
 
   branches_behind: set[StrBranchName] = set()
-  if not is_amend and get(db, ["remote", default, "relationship"]) == ">":
+  if not is_amend and db.remote_relationship(default) == ">":
     update_commands.append("git pull")
     if current != default:
       update_commands[-1] = f"git checkout {default} && " + update_commands[-1]
       current = default
-    db["local"][default]["sha"] = db["remote"][default]["sha"]
-    refresh_distances(db["local"], default, db["email"], git_utils)
+    db.local[default] = replace(db.local[default], sha=db.remote[default].sha)
+    db.commits = refresh_distances(
+      db.local, default, db.email, git_utils, None, db.authors_limit, db.integration
+    )
 
   #
   # Populate branches_pulled
@@ -749,25 +1772,31 @@ def generate_update_commands(
 
   branches_pulled: set[StrBranchName] = set()
   if not is_amend:
-    for branch in sorted(db["remote"].keys() - branches_to_delete - {default}):
-      branchd = db["remote"][branch]
-      if branchd["relationship"] == ">" and not branchd["shas_ahead_default_local_other_authors"]:
+    for branch in sorted(db.remote.keys() - branches_to_delete - {default}):
+      branchd = db.remote[branch]
+      # Integration branches are pulled like the default branch, whoever authored the commits
+      if branchd.relationship == ">" and (
+        branch in db.integration or not branchd.shas_ahead_default_local_other_authors
+      ):
         update_commands.append(f"git checkout {branch} && git pull")
         current = branch
         branches_pulled.add(branch)
-        db["local"][branch]["sha"] = branchd["sha"]
+        db.local[branch] = replace(db.local[branch], sha=branchd.sha)
 
   if branches_pulled:
-    refresh_distances(db["local"], default, db["email"], git_utils)
+    db.commits = refresh_distances(
+      db.local, default, db.email, git_utils, None, db.authors_limit, db.integration
+    )
 
   #
   # Populate branches_behind
   #
 
-  for branch, branchd in db["local"].items():
-    if branchd["distance_default"][0]:
+  for branch, branchd in db.local.items():
+    if branchd.distance_default[0]:
       branches_behind.add(branch)
   branches_behind.discard(default)
+  branches_behind -= db.integration.keys()
 
   #
   # Populate branches_to_rebase
@@ -775,7 +1804,7 @@ def generate_update_commands(
 
   branches_to_rebase: set[StrBranchName] = set()
   for branch in branches_behind:
-    if not db["local"][branch]["has_merge_commits"]:
+    if not db.local[branch].has_merge_commits:
       branches_to_rebase.add(branch)
 
   #
@@ -784,9 +1813,9 @@ def generate_update_commands(
 
   safe_to_push: set[StrBranchName] = set()
   if not no_push:
-    for branch in branches_to_rebase & db["remote"].keys():
-      other_authors = len(db["local"][branch]["shas_ahead_default_other_authors"])
-      if db["remote"][branch]["relationship"] == "=" and not other_authors:
+    for branch in branches_to_rebase & db.remote.keys():
+      other_authors = len(db.local[branch].shas_ahead_default_other_authors)
+      if db.remote[branch].relationship == "=" and not other_authors:
         safe_to_push.add(branch)
 
   #
@@ -794,16 +1823,19 @@ def generate_update_commands(
   #
 
   if branches_to_rebase:
-    base_branches = refresh_bases(db["local"], db["default"])
+    base_branches = refresh_bases(db.local, db.default, db.commits)
     rebased_branches: set[StrBranchName] = set()
 
-    for branch in rebase_order(base_branches) + list(branches_to_rebase):
+    # Sorted so the commands, and the order they're checked in, don't depend on set order
+    for branch in rebase_order(base_branches) + sorted(branches_to_rebase):
       if branch not in branches_to_rebase or branch in rebased_branches:
         continue
 
-      base_branch = db["local"][branch]["base"]
-      behind, ahead = db["local"][branch]["distance_base"]
-      if base_branch == default:
+      base_branch = onto = db.local[branch].base
+      behind, ahead = db.local[branch].distance_base
+      if base_branch == (db.local[branch].integration or default):
+        # Rebased onto the tip
+        behind = 0
         if not is_amend:
           ahead = None
       elif behind:
@@ -812,6 +1844,20 @@ def generate_update_commands(
       update_commands.append(rebase_command(branch, base_branch, safe_to_push, ahead))
       current = branch
 
+      if steps is not None:
+        from .conflicts import RebaseStep
+
+        shas = db.commits.chain_shas(db.local[branch].tip)
+        steps.append(
+          RebaseStep(
+            branch=branch,
+            onto=onto,
+            onto_sha=db.local[onto].sha if onto in db.local else db.integration[onto],
+            onto_behind=behind,
+            shas=shas if ahead is None else shas[len(shas) - ahead :],
+          )
+        )
+
       rebased_branches.add(branch)
 
   if current_original in branches_to_delete and current != default:
@@ -844,159 +1890,105 @@ def rebase_command(
   return ret
 
 
-def branches_ahead_shas_to_refs(
-  local: dict[StrBranchName:dict],
-) -> list[tuple[StrBranchName, list[StrShaRef]]]:
-  """Returns a list of branch refs for each branch
-
-  It bases the computation on "shas_ahead_default"
-
-  Args:
-    db: database
-
-  Returns:
-    list: List of [branch, refs] pairs. For example:
-      [
-        ("b2", ["b2"]),
-        ("b5", ["b5~1", "b5"]),
-        ("b3", ["b2", "b3~1", "b3"]),
-        ("b6", ["b5~1", "b5", "b6"])
-      ]
-  """
-  branches_ahead_shas: dict[str, list[str]] = {}
-
-  for branch, branchd in local.items():
-    for shad in branchd["shas_ahead_default"]:
-      branches_ahead_shas[branch] = branches_ahead_shas.get(branch, [])
-      branches_ahead_shas[branch].append(shad["sha"])
-
-  branches_ahead_refs = []
-  sha_to_ref = {}
-
-  for branch, shas in sorted(branches_ahead_shas.items(), key=lambda x: (len(x[1]), x[0])):
-    to_append = (branch, [])
-
-    for idx, sha in enumerate(shas):
-      if sha not in sha_to_ref:
-        distance = len(shas) - idx - 1
-
-        if distance <= 0:
-          ref = branch
-        else:
-          ref = f"{branch}~{distance}"
-
-        sha_to_ref[sha] = ref
-
-      to_append[1].append(sha_to_ref[sha])
-
-    branches_ahead_refs.append(to_append)
-
-  return branches_ahead_refs
-
-
 def rebase_order(
-  base_branches: dict[StrBranchName, tuple[StrShaRef, int, int]],
+  base_branches: dict[StrBranchName, BaseBranch],
 ) -> list[StrBranchName]:
   """
   Determines the order in which branches should be rebased based on their base branches.
 
+  Every base branch comes before the branches based on it. Each branch is visited once: walking up
+  from a branch stops at the first base branch that is already in the order, so this runs in O(n)
+  and doesn't recurse no matter how deep the stacks are.
+
   Args:
-    base_branches (dict): Mapping of branch names to their base branch refs.
+    base_branches (dict): Mapping of branch names to their base branches.
 
   Returns:
     list: Ordered list of branches for rebasing.
+
+  Raises:
+    BaseBranchCycleError: if following the base branches leads back to a branch already visited.
   """
   ret = []
+  ordered: set[StrBranchName] = set()
 
   for branch in base_branches.keys():
-    for branch_to_rebase in rebase_order_for(branch, base_branches):
-      if branch_to_rebase not in ret:
-        ret.append(branch_to_rebase)
-
-  return ret
-
-
-def rebase_order_for(
-  branch: StrBranchName, base_branches: dict[StrBranchName, tuple[StrShaRef, int, int]]
-) -> list[StrBranchName]:
-  """
-  Recursively determines the rebase order for a given branch.
+    path: list[StrBranchName] = []
+    in_path: set[StrBranchName] = set()
+    node = branch
+    while node not in ordered:
+      if node in in_path:
+        cycle = " -> ".join([*path[path.index(node) :], node])
+        raise BaseBranchCycleError(f"Base branches form a cycle: {cycle}")
+
+      path.append(node)
+      in_path.add(node)
+      if node not in base_branches:
+        break
+      node = base_branches[node][0]
 
-  Args:
-    branch (str): Branch name to determine order for.
-    base_branches (dict): Mapping of branch names to their base branch refs.
+    for node in reversed(path):
+      ret.append(node)
+      ordered.add(node)
 
-  Returns:
-    list: Ordered list of branches for rebasing.
-  """
-  if branch in base_branches:
-    ret = rebase_order_for(base_branches[branch][0], base_branches)
-    ret.append(branch)
-    return ret
-  else:
-    return [branch]
+  return ret
 
 
 def refresh_bases(
-  local: dict[StrBranchName:dict], default: StrBranchName
-) -> dict[StrBranchName, tuple[StrShaRef, int, int]]:
+  local: dict[StrBranchName, LocalBranch], default: StrBranchName, commits: CommitStore
+) -> dict[StrBranchName, BaseBranch]:
   """
   For each branch in local, it updates:
   - base
   - distance_base
   """
-  ret = base_branches_from_branches_ahead_refs(branches_ahead_shas_to_refs(local))
+  ret = base_branches_from_commits(
+    commits,
+    {
+      branch: branchd.tip
+      for branch, branchd in local.items()
+      if branchd.tip >= 0 and not branchd.has_merge_commits
+    },
+  )
 
   for branch, branchd in local.items():
     if branch in ret:
-      branchd["base"] = ret[branch][0]
-      branchd["distance_base"] = (ret[branch][1], ret[branch][2])
+      local[branch] = replace(
+        branchd, base=ret[branch][0], distance_base=(ret[branch][1], ret[branch][2])
+      )
     else:
-      branchd["base"] = default
-      branchd["distance_base"] = branchd["distance_default"]
+      local[branch] = replace(
+        branchd, base=branchd.integration or default, distance_base=branchd.distance_default
+      )
 
   return ret
 
 
-def base_branches_from_branches_ahead_refs(
-  branches_ahead_refs: list[tuple[StrBranchName, list[StrShaRef]]],
-) -> dict[StrBranchName, tuple[StrShaRef, int, int]]:
-  """Determines the base branch for each branch from a list of ahead refs.
+def pull_request_or_warn(
+  branch: StrBranchName, github_token: str, git_utils: GitUtils, show_warnings: bool
+) -> dict | None:
+  """Like `pull_request`, but GitHub errors print a warning, if `show_warnings`, and return None"""
+  import requests
 
-  Args:
-    List of [branch, refs] pairs. For example:
-      [
-        ('b2', ['b2']),
-        ('b5', ['b5~1', 'b5']),
-        ('b3', ['b2', 'b3~1', 'b3']),
-        ('b6', ['b5~1', 'b5', 'b6'])
-      ]
+  if pull_request_cache is not None and branch in pull_request_cache:
+    fetched_at, cached = pull_request_cache[branch]
+    if time.monotonic() - fetched_at < PULL_REQUEST_CACHE_SECONDS:
+      return cached
 
-  Returns:
-    A dict mapping of branch names to their base branch refs and how many commits on top of their
-    base branch they have. For example:
-      {
-        "b3": ("b2", 0, 2),
-        "b6": ("b5", 0, 1)
-      }
-  """
-  ret = {}
-
-  for branch, refs in branches_ahead_refs:
-    commit_count = 0
-    for ref in reversed(refs):
-      result = re.search(r"^\s*(.*?)(?:~(\d+))?\s*$", ref)
-      parent_branch = result.group(1)
-      if parent_branch != branch:
-        if result.group(2) is None:
-          behind = 0
-        else:
-          behind = int(result.group(2))
-        ret[branch] = (parent_branch, behind, commit_count)
-        break
-      commit_count += 1
+  try:
+    ret = pull_request(branch, github_token, git_utils)
+    if pull_request_cache is not None:
+      pull_request_cache[branch] = (time.monotonic(), ret)
+    return ret
+  except requests.exceptions.ConnectionError:
+    if show_warnings:
+      print("WARNING: there is internet connection issues.")
+      print("Network dependent functionality will not work.")
+  except GitHubApiError as exception:
+    if show_warnings:
+      print(f"WARNING: {exception}")
 
-  return ret
+  return None
 
 
 def pull_request(branch: StrBranchName, github_token: str, git_utils: GitUtils) -> dict | None:
@@ -1027,9 +2019,19 @@ def pull_request(branch: StrBranchName, github_token: str, git_utils: GitUtils)
     else:
       return None
 
+  from urllib.parse import urlencode
+
+  import requests
+
+  if github_budget is not None:
+    with github_budget.get_lock():
+      if github_budget.value <= 0:
+        raise GitHubApiError("the GitHub request budget of this workspace is spent.")
+      github_budget.value -= 1
+
   params = urlencode({"head": f"{owner}:{branch}", "state": "all"})
 
-  response = requests.get(
+  response = (github_session or requests).get(
     f"{proto}://{domain}/repos/{owner}/{repo}/pulls?{params}",
     headers={
       "Accept": "application/vnd.github+json",
@@ -1038,6 +2040,12 @@ def pull_request(branch: StrBranchName, github_token: str, git_utils: GitUtils)
     },
   )
 
+  remaining = response.headers.get("X-RateLimit-Remaining", "")
+  if github_budget is not None and remaining.isdigit():
+    # Leave what other tools need of the rate limit alone
+    with github_budget.get_lock():
+      github_budget.value = min(github_budget.value, int(remaining))
+
   if response.status_code != 200:
     raise GitHubApiError(f"GitHub returned a {response.status_code}: {response.text}")
 
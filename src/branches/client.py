@@ -0,0 +1,176 @@
+"""Thin client for `branches --daemon`.
+
+`__main__` calls `main` before importing the CLI. If a daemon serves the repository the current
+directory is in, the arguments are sent to it over its Unix socket and its output is printed, so a
+warm invocation only pays for starting the interpreter. Otherwise the CLI runs as usual.
+
+Only modules the interpreter loads anyway are imported at module level.
+"""
+
+import os
+import stat
+import sys
+
+# Invocations the daemon can't answer: they depend on a different repository, the terminal or
+# the process itself
+LOCAL_ONLY_ARGS = {
+  "-C",
+  "--path",
+  "--daemon",
+  "--tui",
+  "--prompt",
+  "--watch",
+  "--workspace",
+  "--install-hooks",
+  "--uninstall-hooks",
+  "--refresh-state",
+  "-v",
+  "--version",
+}
+
+# Environment variables the output depends on. They're sent to the daemon, which runs the invocation
+# with them instead of its own.
+CLIENT_ENVARS = (
+  "GITHUB_TOKEN",
+  "GITHUB_PROTO",
+  "GITHUB_DOMAIN",
+  "BRANCHES_GIT_BACKEND",
+  "NO_COLOR",
+  "FORCE_COLOR",
+  "TERM",
+  "COLORTERM",
+)
+
+
+def main() -> int | None:
+  """Has the daemon run the invocation in `sys.argv` and prints its output.
+
+  Update commands suggested by the daemon are run here, after prompting like the CLI does.
+
+  Returns:
+    The exit code, or None if there's no daemon to ask and the CLI should run instead.
+  """
+  argv = sys.argv[1:]
+  if options(argv) & LOCAL_ONLY_ARGS:
+    return None
+
+  toplevel = repository_toplevel(os.getcwd())
+  if toplevel is None:
+    return None
+
+  path = socket_path(toplevel)
+  if not is_own_socket(path):
+    return None
+
+  import json
+  import socket
+
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      connection.connect(path)
+      request = {
+        "argv": argv,
+        "isatty": sys.stdout.isatty(),
+        "columns": terminal_columns(),
+        "env": {name: os.environ[name] for name in CLIENT_ENVARS if name in os.environ},
+      }
+      connection.sendall(json.dumps(request).encode() + b"\n")
+      connection.shutdown(socket.SHUT_WR)
+      response = json.loads(read_all(connection))
+  except (OSError, ValueError):
+    # A daemon that died without removing its socket, or one that went away mid request
+    return None
+
+  sys.stdout.write(response["stdout"])
+  sys.stderr.write(response["stderr"])
+
+  commands = response["commands"]
+  if commands:
+    from .cli import prompt, run_commands
+
+    if (
+      "-y" in options(argv)
+      or "--yes" in options(argv)
+      or ("PYTEST_CURRENT_TEST" not in os.environ and prompt("Run update command?"))
+    ):
+      return run_commands(commands)
+
+  return response["returncode"]
+
+
+def repository_toplevel(path: str) -> str | None:
+  """Returns the top level directory of the repository `path` is in, or None if it's not in one.
+
+  Unlike `git rev-parse --show-toplevel` this doesn't start a process. It only looks for a `.git`
+  entry in `path` and its parents, which is enough to find a socket for it.
+  """
+  path = os.path.realpath(path)
+  while True:
+    if os.path.exists(os.path.join(path, ".git")):
+      return path
+
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+
+def is_own_socket(path: str) -> bool:
+  """Returns whether `path` is a socket that only the current user owns and can connect to.
+
+  The directory sockets are in can be shared with other users, and whoever listens on the socket
+  chooses the update commands the client runs.
+  """
+  try:
+    path_stat = os.lstat(path)
+  except OSError:
+    return False
+
+  return (
+    stat.S_ISSOCK(path_stat.st_mode)
+    and path_stat.st_uid == os.getuid()
+    and not path_stat.st_mode & (stat.S_IRWXG | stat.S_IRWXO)
+  )
+
+
+def options(argv: list[str]) -> set[str]:
+  """Returns the options in `argv`, with combined short ones like `-qy` split into `-q` and `-y`"""
+  ret = set()
+  for arg in argv:
+    if arg == "--":
+      break
+    elif arg.startswith("--"):
+      ret.add(arg.split("=")[0])
+    elif arg.startswith("-"):
+      for flag in arg[1:]:
+        ret.add(f"-{flag}")
+        if flag == "C":
+          # The rest is its value
+          break
+
+  return ret
+
+
+def socket_path(toplevel: str) -> str:
+  """Returns the path of the socket the daemon for the repository at `toplevel` listens on"""
+  import hashlib
+
+  digest = hashlib.sha1(os.path.realpath(toplevel).encode()).hexdigest()[:12]
+  directory = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+  return os.path.join(directory, f"branches-{os.getuid()}-{digest}.sock")
+
+
+def terminal_columns() -> int | None:
+  """Returns the width of the terminal stdout is, or None if it's not a terminal or doesn't say"""
+  try:
+    # Pseudo-terminals can report a width of 0
+    return os.get_terminal_size(sys.stdout.fileno()).columns or None
+  except (OSError, ValueError):
+    return None
+
+
+def read_all(connection) -> bytes:
+  chunks = []
+  while chunk := connection.recv(65536):
+    chunks.append(chunk)
+  return b"".join(chunks)
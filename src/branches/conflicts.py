@@ -0,0 +1,142 @@
+"""`branches --check-conflicts`: whether the planned rebases would apply cleanly.
+
+Every rebase in the update commands is replayed in memory, one commit at a time, with the same
+three-way merge `git rebase` does for each commit. Nothing is checked out and no ref is moved: the
+only things written are trees and temporary commits in the object database, which nothing points to
+and `git gc` eventually removes. See `GitUtils.replay`.
+
+Branches stacked on a branch that is rebased are replayed on top of its replayed commits. Stacks
+don't depend on each other, so they're checked in parallel, one thread and one `GitUtils` per stack.
+
+The result of each rebase is one of:
+- clean: every commit applies without conflicts.
+- conflict: the first commit that doesn't apply, and the paths that conflict.
+- unknown: it couldn't be checked, for example because the branch it's rebased onto conflicts.
+
+Commits `git rebase` would skip because they're already upstream are replayed like any other, so
+they can be reported as conflicts that the real rebase doesn't run into.
+"""
+
+import os
+from dataclasses import dataclass, field
+
+from .db import StrBranchName, StrSha
+from .utils.git_utils import GitCommandError, GitUtils
+
+
+@dataclass(slots=True, frozen=True)
+class RebaseStep:
+  """A rebase in the update commands, as `generate_update_commands` planned it"""
+
+  branch: StrBranchName
+  # The branch is rebased onto `onto~onto_behind`. `onto_sha` is where `onto` is before any command
+  # runs, or after it's pulled.
+  onto: StrBranchName
+  onto_sha: StrSha
+  onto_behind: int
+  # The commits replayed, oldest first
+  shas: list[StrSha] = field(default_factory=list)
+
+
+@dataclass(slots=True, frozen=True)
+class RebaseCheck:
+  status: str  # one of ["clean", "conflict", "unknown"]
+  # The first commit that doesn't apply, and the paths that conflict
+  sha: StrSha | None = None
+  paths: tuple[str, ...] = ()
+  # Why the status is unknown
+  reason: str | None = None
+
+  def __str__(self) -> str:
+    if self.status == "conflict":
+      return f"conflicts in {', '.join(self.paths)} when applying {self.sha[:5]}"
+    elif self.status == "unknown":
+      return f"unknown, {self.reason}"
+    return self.status
+
+
+def check(
+  steps: list[RebaseStep], git_utils: GitUtils, amended: StrBranchName | None = None
+) -> list[RebaseCheck]:
+  """Replays the rebases in `steps` and returns how each one of them would go, in the same order.
+
+  Args:
+    amended: the branch the update commands amend first, if any. Rebases onto it are replayed on
+      top of what the working tree would be amended with.
+  """
+  if not steps:
+    return []
+
+  start: dict[StrBranchName, list[str]] = {}
+  if amended is not None:
+    start[amended] = [git_utils.worktree_tree()]
+
+  # Steps whose branch is rebased onto a branch rebased before go in the same stack
+  stacks: list[list[RebaseStep]] = []
+  stack_of: dict[StrBranchName, int] = {}
+  for step in steps:
+    idx = stack_of.get(step.onto)
+    if idx is None:
+      idx = len(stacks)
+      stacks.append([])
+    stacks[idx].append(step)
+    stack_of[step.branch] = idx
+
+  workers = min(len(stacks), os.cpu_count() or 1)
+  if workers > 1:
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(workers) as pool:
+      results = list(
+        pool.map(lambda stack: check_stack(stack, type(git_utils), git_utils, start), stacks)
+      )
+  else:
+    results = [check_stack(stack, type(git_utils), git_utils, start) for stack in stacks]
+
+  checks = {id(step): step_check for result in results for step, step_check in result}
+  return [checks[id(step)] for step in steps]
+
+
+def check_stack(
+  stack: list[RebaseStep],
+  backend: type[GitUtils],
+  git_utils: GitUtils,
+  start: dict[StrBranchName, list[str]],
+) -> list[tuple[RebaseStep, RebaseCheck]]:
+  """Replays the rebases of one stack in order, each branch on top of its base's replayed commits.
+
+  Runs with a `GitUtils` of its own, the backends are not meant to be shared between threads.
+  """
+  git_utils = backend(git_utils.working_tree_dir())
+  # What each rebased branch would be made of: the tree it's rebased onto, then the tree after each
+  # of its replayed commits
+  trees = dict(start)
+  ret = []
+
+  for step in stack:
+    if step.onto in trees:
+      onto_trees = trees[step.onto]
+      if step.onto_behind >= len(onto_trees):
+        ret.append((step, RebaseCheck("unknown", reason=f"{step.onto} is rebased too")))
+        continue
+      onto = onto_trees[-1 - step.onto_behind]
+    elif step.onto in {other.branch for other, _check in ret}:
+      ret.append((step, RebaseCheck("unknown", reason=f"{step.onto} can't be replayed")))
+      continue
+    else:
+      onto = f"{step.onto_sha}~{step.onto_behind}"
+
+    try:
+      replayed, conflict = git_utils.replay(onto, step.shas)
+    except GitCommandError as exception:
+      ret.append((step, RebaseCheck("unknown", reason=str(exception))))
+      continue
+
+    if conflict is not None:
+      ret.append((step, RebaseCheck("conflict", sha=conflict[0], paths=tuple(conflict[1]))))
+      continue
+
+    trees[step.branch] = replayed
+    ret.append((step, RebaseCheck("clean")))
+
+  return ret
@@ -0,0 +1,293 @@
+"""`branches --daemon`: answers the invocations `client` forwards for one repository.
+
+Every invocation otherwise starts from scratch: interpreter, imports, git backend, connection to
+GitHub. The daemon keeps all of that in memory between invocations:
+
+- The `GitUtils` backend, and with it everything the backend caches (pygit2 keeps the repository
+  and its object cache open). It's replaced when refs change, or for a client that asks for another
+  backend.
+- A `requests.Session`, so the connection to GitHub is reused, and the pull requests fetched in the
+  last `cli.PULL_REQUEST_CACHE_SECONDS`.
+- The output of each invocation, by arguments and environment, for `OUTPUT_CACHE_SECONDS` or until
+  refs change. Outputs that may show pull requests go stale sooner if those are due to be fetched
+  again.
+
+Refs are checked with a single `git for-each-ref` per invocation, so a warm answer costs that and
+rendering nothing at all.
+
+Protocol: the client sends `{"argv": [...], "isatty", "columns", "env"}` as JSON and closes its
+end. `isatty` and `columns` describe its stdout, and the output is rendered as if it were the
+daemon's. `env` has the client's values of `client.CLIENT_ENVARS`, which the invocation runs with
+instead of the daemon's. The daemon replies with `{"stdout", "stderr", "returncode", "commands"}` and
+closes the connection. Prompting for and running the update commands happens in the client, which
+only connects to a socket it owns.
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+
+from . import cli
+from .client import CLIENT_ENVARS, read_all, socket_path
+from .utils.git_utils import GitUtils, backend
+
+IDLE_TIMEOUT_SECONDS = 3600
+OUTPUT_CACHE_SECONDS = 30
+
+
+class Daemon:
+  def __init__(self, repo_path: str):
+    import requests
+
+    self._repo_path = repo_path
+    self._refs = None
+    self._git_utils: GitUtils | None = None
+    self._backend_name: str | None = None
+    self._github: tuple[str | None, ...] | None = None
+    # Maps requests to when their output goes stale and the output
+    self._outputs: dict[tuple, tuple[float, dict]] = {}
+
+    cli.github_session = requests.Session()
+    cli.pull_request_cache = {}
+
+  def respond(
+    self,
+    argv: list[str],
+    isatty: bool = False,
+    columns: int | None = None,
+    env: dict[str, str] | None = None,
+  ) -> tuple[dict, bool]:
+    """Runs the invocation `argv`, or reuses its recent output if refs haven't changed since.
+
+    Args:
+      isatty: whether the client's stdout is a terminal, which decides how the table is rendered.
+      columns: the width of the client's terminal, if it's one.
+      env: the client's values of `CLIENT_ENVARS`. The ones missing are unset for the invocation.
+
+    Returns:
+      The response for the client, and whether it came from the cache.
+    """
+    env = {name: value for name, value in (env or {}).items() if name in CLIENT_ENVARS}
+    refs = self._read_refs()
+    if refs != self._refs:
+      self._refs = refs
+      self._git_utils = None
+      self._outputs.clear()
+
+    key = (isatty, columns, *environment_key(env), *argv)
+    if key in self._outputs:
+      expires_at, response = self._outputs[key]
+      if time.monotonic() < expires_at:
+        return (response, True)
+
+    with client_environment(env):
+      if self._git_utils is None or env.get("BRANCHES_GIT_BACKEND") != self._backend_name:
+        self._git_utils = backend().from_path(self._repo_path)
+        self._backend_name = env.get("BRANCHES_GIT_BACKEND")
+
+      # Pull requests fetched for one token or server aren't reused for another
+      github = environment_key({name: env[name] for name in env if name.startswith("GITHUB_")})
+      if github != self._github:
+        self._github = github
+        cli.pull_request_cache.clear()
+
+      response, cacheable = self._run(argv, isatty, columns)
+
+    if cacheable:
+      self._outputs[key] = (self._expires_at(), response)
+
+    return (response, False)
+
+  def _expires_at(self) -> float:
+    """Returns when the output of the invocation that just ran goes stale.
+
+    That's `OUTPUT_CACHE_SECONDS` from now, or sooner if a pull request it may show is due to be
+    fetched again before then.
+    """
+    now = time.monotonic()
+    ret = now + OUTPUT_CACHE_SECONDS
+    for fetched_at, _pr in cli.pull_request_cache.values():
+      if now - fetched_at < cli.PULL_REQUEST_CACHE_SECONDS:
+        ret = min(ret, fetched_at + cli.PULL_REQUEST_CACHE_SECONDS)
+    return ret
+
+  def _run(self, argv: list[str], isatty: bool, columns: int | None) -> tuple[dict, bool]:
+    stdout = ClientOutput(isatty)
+    stderr = io.StringIO()
+    commands = []
+    # amend depends on the working tree, which refs don't say anything about
+    cacheable = False
+
+    with (
+      contextlib.redirect_stdout(stdout),
+      contextlib.redirect_stderr(stderr),
+      terminal_columns(columns),
+    ):
+      try:
+        args = cli.argument_parser().parse_args(argv)
+        returncode, commands = cli.show(args, self._git_utils)
+        cacheable = args.operation is None
+      except SystemExit as exception:
+        # --help, or invalid arguments
+        returncode = exception.code if isinstance(exception.code, int) else 1
+      except Exception:
+        traceback.print_exc()
+        returncode = 1
+
+    response = {
+      "stdout": stdout.getvalue(),
+      "stderr": stderr.getvalue(),
+      "returncode": returncode,
+      "commands": commands,
+    }
+    return (response, cacheable)
+
+  def _read_refs(self) -> str:
+    """Returns every local and remote tracking branch with its sha, and which one HEAD is on"""
+    return subprocess.run(
+      [
+        "git",
+        "-C",
+        self._repo_path,
+        "for-each-ref",
+        "--format=%(objectname) %(HEAD) %(refname)",
+        "refs/heads/",
+        "refs/remotes/",
+      ],
+      capture_output=True,
+      text=True,
+    ).stdout
+
+
+class ClientOutput(io.StringIO):
+  """Collects the output of an invocation, and tells whether the client's stdout is a terminal"""
+
+  def __init__(self, isatty: bool):
+    super().__init__()
+    self._isatty = isatty
+
+  def isatty(self) -> bool:
+    return self._isatty
+
+
+def environment_key(env: dict[str, str]) -> tuple[str | None, ...]:
+  """Returns the values of `CLIENT_ENVARS` in `env`, in order, with the GitHub token hashed"""
+  ret = []
+  for name in CLIENT_ENVARS:
+    value = env.get(name)
+    if name == "GITHUB_TOKEN" and value is not None:
+      value = hashlib.sha256(value.encode()).hexdigest()
+    ret.append(value)
+  return tuple(ret)
+
+
+@contextlib.contextmanager
+def client_environment(env: dict[str, str]):
+  """Sets `CLIENT_ENVARS` to the client's values in `env`, and unsets the ones it doesn't have"""
+  previous = {name: os.environ.get(name) for name in CLIENT_ENVARS}
+  for name in CLIENT_ENVARS:
+    if name in env:
+      os.environ[name] = env[name]
+    else:
+      os.environ.pop(name, None)
+  try:
+    yield
+  finally:
+    for name, value in previous.items():
+      if value is None:
+        os.environ.pop(name, None)
+      else:
+        os.environ[name] = value
+
+
+@contextlib.contextmanager
+def terminal_columns(columns: int | None):
+  """Has rich size its output for a terminal `columns` wide, when it's not None"""
+  if columns is None:
+    yield
+    return
+
+  previous = os.environ.get("COLUMNS")
+  os.environ["COLUMNS"] = str(columns)
+  try:
+    yield
+  finally:
+    if previous is None:
+      del os.environ["COLUMNS"]
+    else:
+      os.environ["COLUMNS"] = previous
+
+
+def serve(repo_path: str) -> int:
+  """Answers invocations for the repository at `repo_path`, one at a time, until it's idle for
+  `IDLE_TIMEOUT_SECONDS` or gets interrupted.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  path = socket_path(repo_path)
+  if os.path.exists(path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+      try:
+        probe.connect(path)
+        print(f"A daemon is already serving {repo_path} on {path}.")
+        return 1
+      except OSError:
+        # Left behind by a daemon that was killed
+        os.unlink(path)
+
+  daemon = Daemon(repo_path)
+
+  # Nobody else gets to connect to the socket
+  umask = os.umask(0o077)
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    server.bind(path)
+  finally:
+    os.umask(umask)
+
+  # Leave through the `finally` below, which removes the socket
+  signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+  try:
+    server.listen()
+    server.settimeout(IDLE_TIMEOUT_SECONDS)
+    print(f"Serving {repo_path} on {path}", flush=True)
+
+    while True:
+      try:
+        connection, _ = server.accept()
+      except TimeoutError:
+        print("Idle, exiting")
+        return 0
+
+      with connection:
+        connection.settimeout(None)
+        started_at = time.monotonic()
+        try:
+          request = json.loads(read_all(connection))
+          response, cached = daemon.respond(
+            request["argv"],
+            request.get("isatty", False),
+            request.get("columns"),
+            request.get("env"),
+          )
+          connection.sendall(json.dumps(response).encode())
+        except (OSError, ValueError, KeyError) as exception:
+          print(f"Dropped a request: {exception!r}", flush=True)
+          continue
+
+      elapsed_ms = (time.monotonic() - started_at) * 1000
+      status = "cached" if cached else "ran"
+      print(f"{elapsed_ms:6.1f}ms {status:6} {' '.join(request['argv'])}", flush=True)
+  finally:
+    server.close()
+    os.unlink(path)
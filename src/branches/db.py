@@ -0,0 +1,248 @@
+"""Typed records describing the state of local and remote branches.
+
+These replace the previous dict-of-dicts `db`. All records use `__slots__` so that repositories with
+hundreds of branches and long ahead lists don't pay for a `__dict__` per branch and per commit.
+
+Branch and commit records are immutable. Code that needs a modified version of a branch replaces
+its record with `dataclasses.replace`, and `Db.derive` gives a view of the db that can be modified
+without affecting the original one or copying the branches that don't change.
+"""
+
+import sys
+from dataclasses import dataclass, field, replace
+from typing import TypeAlias
+
+# Using some TypeAliases just for readability / documentation
+StrBranchName: TypeAlias = str
+StrSha: TypeAlias = str
+Distance: TypeAlias = tuple[int, int]  # (behind, ahead), each one possibly an `AtLeast`
+# (base branch, commits behind the base branch's tip, commits on top of the base branch)
+# For example ("b2", 1, 3) is what a branch that has 3 commits on top of b2~1 is based on.
+BaseBranch: TypeAlias = tuple[StrBranchName, int, int]
+
+
+class AtLeast(int):
+  """A distance counted in a shallow clone that reached the end of the history available locally.
+
+  The real distance is this one or more, so it's shown as "N+". It compares and adds up like any
+  other int, and arithmetic on it returns plain ints.
+  """
+
+  __slots__ = ()
+
+  def __str__(self) -> str:
+    return f"{int(self)}+"
+
+  def __repr__(self) -> str:
+    return f"AtLeast({int(self)})"
+
+
+def intern_sha(sha: StrSha) -> StrSha:
+  """Returns the interned version of `sha`.
+
+  The same sha shows up in many places (ahead lists of stacked branches, remote state, PR heads).
+  Interning makes all of them share the same string object and makes equality checks an identity
+  check in the common case.
+  """
+  return sys.intern(sha)
+
+
+@dataclass(slots=True)
+class CommitStore:
+  """All the commits ahead of the default branch, stored once and shared by every branch.
+
+  Commits are identified by their index in the store. `parents[idx]` is the index of the first parent
+  of the commit, or -1 when that parent is not ahead of the default branch. Branches only keep the
+  index of their tip and walk the chain from there, so in a stack like main <- b1 <- b2 <- b3 the
+  commits of b1 are stored once instead of once per branch stacked on top of it.
+
+  Commits must be added parents first.
+  """
+
+  shas: list[StrSha] = field(default_factory=list)
+  emails: list[str | None] = field(default_factory=list)
+  parents: list[int] = field(default_factory=list)
+  # How many commits there are from the bottom of the store up to, and including, the commit
+  depths: list[int] = field(default_factory=list)
+  # True if the commit, or any commit below it in the store, is a merge commit
+  has_merges: list[bool] = field(default_factory=list)
+  # Authors other than the current user of the commit and all the commits below it in the store.
+  # Commits with no new author share the frozenset of their parent.
+  other_authors: list[frozenset[str]] = field(default_factory=list)
+  # First parent of the commit at the bottom of the chain of the commit, the commit the chain forks
+  # from. None if the bottom commit has no parents.
+  fork_points: list[StrSha | None] = field(default_factory=list)
+  indexes: dict[StrSha, int] = field(default_factory=dict)
+  # Most authors kept in each `other_authors`, None for no limit. Whether there is any other author
+  # is all most callers need, and the sets stop growing, and being copied, once they're full.
+  authors_limit: int | None = None
+
+  def __len__(self) -> int:
+    return len(self.shas)
+
+  def add(
+    self, sha: StrSha, parent_shas: list[StrSha], email: str | None, local_email: str | None
+  ) -> int:
+    parent_indexes = [self.indexes.get(parent_sha, -1) for parent_sha in parent_shas]
+    parent = parent_indexes[0] if parent_indexes else -1
+
+    has_merges = len(parent_shas) > 1 or any(
+      self.has_merges[idx] for idx in parent_indexes if idx >= 0
+    )
+
+    other_authors = self.other_authors[parent] if parent >= 0 else frozenset()
+    if (
+      email != local_email
+      and email not in other_authors
+      and (self.authors_limit is None or len(other_authors) < self.authors_limit)
+    ):
+      other_authors = other_authors | {email}
+
+    idx = len(self.shas)
+    self.shas.append(sha)
+    self.emails.append(email)
+    self.parents.append(parent)
+    self.depths.append(self.depths[parent] + 1 if parent >= 0 else 1)
+    self.has_merges.append(has_merges)
+    self.other_authors.append(other_authors)
+    if parent >= 0:
+      self.fork_points.append(self.fork_points[parent])
+    else:
+      self.fork_points.append(parent_shas[0] if parent_shas else None)
+    self.indexes[sha] = idx
+
+    return idx
+
+  def chain(self, tip: int) -> list[int]:
+    """Returns the indexes of the commits from the bottom of the store up to `tip`, oldest first"""
+    ret = []
+    while tip >= 0:
+      ret.append(tip)
+      tip = self.parents[tip]
+    ret.reverse()
+    return ret
+
+  def chain_shas(self, tip: int) -> list[StrSha]:
+    return [self.shas[idx] for idx in self.chain(tip)]
+
+
+def base_branches_from_commits(
+  commits: CommitStore, tips: dict[StrBranchName, int]
+) -> dict[StrBranchName, BaseBranch]:
+  """Determines the base branch of each branch from the shared commit chains in `commits`.
+
+  The parent pointers of the store form a tree of commits rooted at the default branch. Every commit
+  is owned by the shortest branch that contains it (ties are broken by branch name). A branch is
+  based on the owner of the first commit below its tip that it doesn't own, and the offset is how
+  far that commit is from the owner's tip. Branches that own all their commits are based on the
+  default branch and are left out of the result.
+
+  Each commit is claimed once and each branch only walks the commits it owns plus one, so this runs
+  in O(total commits), after sorting the branches.
+
+  Args:
+    commits: the shared commit store.
+    tips: the index in `commits` of the tip of each branch. Branches with merge commits or with
+      nothing ahead of the default branch should be left out.
+
+  Returns:
+    A dict mapping branch names to their `BaseBranch`. For example:
+      {
+        "b3": ("b2", 0, 2),
+        "b6": ("b5", 1, 1)
+      }
+  """
+  owners = [-1] * len(commits)
+  branches = sorted(
+    tips.items(), key=lambda branch_tip: (commits.depths[branch_tip[1]], branch_tip[0])
+  )
+
+  for owner, (_branch, tip) in enumerate(branches):
+    idx = tip
+    while idx >= 0 and owners[idx] < 0:
+      owners[idx] = owner
+      idx = commits.parents[idx]
+
+  ret = {}
+  for owner, (branch, tip) in enumerate(branches):
+    ahead = 0
+    idx = tip
+    while idx >= 0 and owners[idx] == owner:
+      ahead += 1
+      idx = commits.parents[idx]
+
+    if idx >= 0:
+      base_branch, base_tip = branches[owners[idx]]
+      ret[branch] = (base_branch, commits.depths[base_tip] - commits.depths[idx], ahead)
+
+  return ret
+
+
+@dataclass(slots=True, frozen=True)
+class LocalBranch:
+  sha: StrSha
+  distance_default: Distance = (0, 0)
+  distance_base: Distance = (0, 0)
+  base: StrBranchName | None = None
+  pr_status: str | None = None  # one of [None, "open", "merged", "closed"]
+  pr_sha: StrSha | None = None
+  pr_number: int | None = None
+  pr_url: str | None = None
+  has_merge_commits: bool = False
+  # Index of the branch's sha in the db's `CommitStore`, -1 if it isn't ahead of the default branch
+  tip: int = -1
+  # At most the db's `authors_limit` of them
+  shas_ahead_default_other_authors: frozenset[str] = frozenset()
+  default: bool = False
+  # The integration branch `distance_default` and the ahead lists are relative to: the default
+  # branch, or the nearest of the db's `integration` branches. None for the default branch.
+  integration: StrBranchName | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class RemoteBranch:
+  sha: StrSha
+  distance_local: Distance | None = None
+  relationship: str | None = None  # one of [None, "=", ">", "<", "Y"]
+  distance_default: Distance | None = None
+  # Both sets of other authors have at most the db's `authors_limit` authors
+  shas_ahead_default_other_authors: frozenset[str] = frozenset()
+  distance_default_local: Distance | None = None
+  shas_ahead_default_local_other_authors: frozenset[str] = frozenset()
+
+
+@dataclass(slots=True)
+class Db:
+  email: str | None
+  default: StrBranchName
+  current: StrBranchName | None
+  # Starting with Python 3.7, dictionaries officially maintain the order in which keys were inserted
+  # The order of `local` is the order in which branches are displayed.
+  local: dict[StrBranchName, LocalBranch] = field(default_factory=dict)
+  remote: dict[StrBranchName, RemoteBranch] = field(default_factory=dict)
+  commits: CommitStore = field(default_factory=CommitStore)
+  # Whether origin and GitHub were queried. When they weren't, `remote` and the PR fields of the
+  # local branches are empty because nothing is known, not because there is nothing.
+  remote_loaded: bool = True
+  prs_loaded: bool = True
+  # Most authors other than `email` kept per branch, None for all of them. See `CommitStore`.
+  authors_limit: int | None = None
+  # Long-lived branches other than the default one that branches are cut from and rebased onto,
+  # like `develop` or `release/*`, with their local shas. They're never rebased themselves.
+  integration: dict[StrBranchName, StrSha] = field(default_factory=dict)
+
+  def derive(self) -> "Db":
+    """Returns a db that can be modified without modifying this one.
+
+    Only the branch mappings are copied. The branch records themselves are immutable so both dbs
+    share them until one of the two replaces a record.
+    """
+    return replace(self, local=dict(self.local), remote=dict(self.remote))
+
+  def remote_sha(self, branch: StrBranchName) -> StrSha | None:
+    remote = self.remote.get(branch)
+    return remote.sha if remote is not None else None
+
+  def remote_relationship(self, branch: StrBranchName) -> str | None:
+    remote = self.remote.get(branch)
+    return remote.relationship if remote is not None else None
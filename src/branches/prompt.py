@@ -0,0 +1,144 @@
+"""`branches --prompt`: one compact line about the current branch, for shell prompts.
+
+`__main__` runs it without importing the rest of `branches`. It only reads files: HEAD, the refs
+and the state the hooks keep saved (see `state`). It never runs git or touches the network, so it
+takes about as long as starting the interpreter.
+
+For a branch 1 commit behind and 2 commits ahead of the default branch, based on b2, in sync with
+the remote tracking branch and with an open PR, the line is:
+
+  branch1 <-1 ->2 on b2 origin= #12 open
+
+The origin relationship is one of the `COLUMNS["relationship"]` values, or "?" when the saved state
+doesn't say. When the saved state is out of date the distances and base are replaced by "...", and
+a refresh is started in the background if the hooks are installed.
+"""
+
+import os
+
+from . import state
+from .client import repository_toplevel
+
+
+def main(path: str | None = None) -> int:
+  """Prints the prompt line for the repository `path`, or the current directory, is in.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  dirs = git_dirs(path or os.getcwd())
+  if dirs is None:
+    return 1
+
+  toplevel, git_dir, common_dir = dirs
+  head = _read(os.path.join(git_dir, "HEAD"))
+  if not head.startswith("ref: refs/heads/"):
+    print(f"({head[:7]})")
+    return 0
+
+  branch = head.removeprefix("ref: refs/heads/")
+  lines = state.read_prompt_lines(common_dir)
+  line, fresh = prompt_line(
+    branch,
+    ref_sha(common_dir, f"refs/heads/{branch}"),
+    ref_sha(common_dir, f"refs/remotes/origin/{branch}"),
+    lines,
+  )
+  print(line)
+
+  default = next((fields for fields in lines.values() if fields[2] == "default"), None)
+  if default is not None and ref_sha(common_dir, f"refs/heads/{default[0]}") != default[1]:
+    # Distances to the default branch changed too
+    fresh = False
+
+  if not fresh and state.enabled(common_dir):
+    state.start_refresh(common_dir, toplevel)
+
+  return 0
+
+
+def prompt_line(
+  branch: str, sha: str | None, origin_sha: str | None, lines: dict[str, list[str]]
+) -> tuple[str, bool]:
+  """Returns the prompt line of `branch`, and whether the saved state of the branch is up to date.
+
+  Args:
+    sha: the sha of the branch, None if it has no commits yet.
+    origin_sha: the sha of its remote tracking branch, None if there is none.
+    lines: `state.read_prompt_lines`.
+  """
+  if sha is None:
+    return (branch, True)
+
+  parts = [branch]
+  fields = lines.get(branch)
+  fresh = fields is not None and fields[1] == sha
+  if fresh:
+    _name, _sha, _default, behind, ahead, base, remote_sha, relationship, *_pr = fields
+    if behind != "0":
+      parts.append(f"<-{behind}")
+    if ahead != "0":
+      parts.append(f"->{ahead}")
+    if base:
+      parts.append(f"on {base}")
+  else:
+    parts.append("...")
+
+  if origin_sha == sha:
+    parts.append("origin=")
+  elif origin_sha is not None:
+    known = fresh and remote_sha == origin_sha and relationship
+    parts.append(f"origin{relationship if known else '?'}")
+
+  if fields is not None and fields[8]:
+    # PRs don't depend on the branch's sha, they're shown even if the rest is out of date
+    parts.append(f"#{fields[8]} {fields[9]}")
+
+  return (" ".join(parts), fresh)
+
+
+def git_dirs(path: str) -> tuple[str, str, str] | None:
+  """Returns the top level directory, the git directory and the common git directory of the
+  repository `path` is in, or None if it's not in one. Bare repositories are not supported.
+  """
+  path = repository_toplevel(path)
+  if path is None:
+    return None
+
+  git_dir = os.path.join(path, ".git")
+  if os.path.isfile(git_dir):
+    # Linked worktree or submodule: .git says where the git directory is
+    git_dir = os.path.join(path, _read(git_dir).removeprefix("gitdir: "))
+
+  common_dir = git_dir
+  if os.path.exists(os.path.join(git_dir, "commondir")):
+    common_dir = os.path.join(git_dir, _read(os.path.join(git_dir, "commondir")))
+
+  return (path, os.path.normpath(git_dir), os.path.normpath(common_dir))
+
+
+def ref_sha(common_dir: str, ref: str) -> str | None:
+  """Returns the sha `ref` points to, reading the loose ref or packed-refs like git does"""
+  sha = _read(os.path.join(common_dir, ref))
+  if sha:
+    return sha
+
+  suffix = f" {ref}"
+  try:
+    with open(os.path.join(common_dir, "packed-refs")) as packed_refs:
+      for line in packed_refs:
+        line = line.rstrip("\n")
+        if line.endswith(suffix):
+          return line.removesuffix(suffix)
+  except OSError:
+    pass
+
+  return None
+
+
+def _read(path: str) -> str:
+  try:
+    with open(path) as file:
+      return file.read().strip()
+  except OSError:
+    return ""
@@ -0,0 +1,143 @@
+"""Renderers for the branches table.
+
+`cli.table_row` builds every cell as a tuple of `Segment`s instead of rich markup. The plain and TSV
+renderers write the text of the segments without ever loading rich, and the rich renderer turns
+them into `rich.text.Text` directly, without parsing markup.
+
+All renderers are context managers with an `add_row` method, and take the displayed `COLUMNS`
+entries, keyed by column key.
+"""
+
+import sys
+from dataclasses import dataclass
+from typing import TextIO, TypeAlias
+
+
+@dataclass(slots=True, frozen=True)
+class Segment:
+  """A piece of a cell's text, all with the same style and link"""
+
+  text: str
+  style: str | None = None
+  link: str | None = None
+
+
+Cell: TypeAlias = tuple[Segment, ...]
+
+
+def plain_text(cell: Cell | None) -> str:
+  return "".join(segment.text for segment in cell or ())
+
+
+def justify(value: str, width: int, how: str | None) -> str:
+  """Pads `value` to `width` the way rich justifies cells: "left", "right" or "center"."""
+  if how == "right":
+    return value.rjust(width)
+  elif how == "center":
+    left = (width - len(value)) // 2
+    return " " * left + value.ljust(width - left)
+  else:
+    return value.ljust(width)
+
+
+class RichRenderer:
+  """Renders the table with `rich.live.Live`, refreshing it as rows are added"""
+
+  def __init__(self, columns: dict[str, dict]):
+    from rich import box
+    from rich.console import Console
+    from rich.live import Live
+    from rich.table import Table
+
+    # `header_style=""`` removes the bold which makes assigning a yellow header not work.
+    self._table = Table(padding=(0, 0), box=box.SIMPLE_HEAD, header_style="")
+    for column_attr in columns.values():
+      self._table.add_column(column_attr["column_name"], **(column_attr["column_props"] or {}))
+
+    self._live = Live(self._table, console=Console(highlight=False), refresh_per_second=20)
+
+  def __enter__(self) -> "RichRenderer":
+    self._live.__enter__()
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self._live.__exit__(*exc_info)
+    # Live leaves the cursor at the end of the table's last line
+    print("")
+
+  def add_row(self, cells: list[Cell | None]) -> None:
+    from rich.style import Style
+    from rich.text import Text
+
+    row = []
+    for cell in cells:
+      text = Text()
+      for segment in cell or ():
+        style = Style.parse(segment.style) if segment.style else Style()
+        if segment.link:
+          style += Style(link=segment.link)
+        text.append(segment.text, style)
+      row.append(text)
+
+    self._table.add_row(*row)
+
+
+class PlainRenderer:
+  """Writes the table once, after all the rows are added, without any styling.
+
+  The layout is the same one the rich renderer uses, so the output doesn't change when stdout is not
+  a terminal.
+  """
+
+  def __init__(self, columns: dict[str, dict], file: TextIO | None = None):
+    self._headers = [column_attr["column_name"] for column_attr in columns.values()]
+    self._justify = [
+      (column_attr["column_props"] or {}).get("justify", "left") for column_attr in columns.values()
+    ]
+    self._rows: list[list[str]] = []
+    self._file = file or sys.stdout
+
+  def __enter__(self) -> "PlainRenderer":
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    widths = [max(len(value) for value in column) for column in zip(self._headers, *self._rows)]
+    width = sum(widths) + len(widths) + 1
+    lines = [
+      " " * width,
+      self._line(self._headers, widths),
+      " " + "─" * (width - 2) + " ",
+      *[self._line(row, widths) for row in self._rows],
+      " " * width,
+    ]
+    self._file.write("\n".join(lines) + "\n")
+    self._file.flush()
+
+  def add_row(self, cells: list[Cell | None]) -> None:
+    self._rows.append([plain_text(cell) for cell in cells])
+
+  def _line(self, values: list[str], widths: list[int]) -> str:
+    cells = [justify(*value_width_how) for value_width_how in zip(values, widths, self._justify)]
+    return " " + " ".join(cells) + " "
+
+
+class TsvRenderer:
+  """Writes the column keys and then every row as soon as it is added, separated by tabs"""
+
+  def __init__(self, columns: dict[str, dict], file: TextIO | None = None):
+    self._keys = list(columns.keys())
+    self._file = file or sys.stdout
+
+  def __enter__(self) -> "TsvRenderer":
+    self._write(self._keys)
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    pass
+
+  def add_row(self, cells: list[Cell | None]) -> None:
+    self._write([plain_text(cell).strip() for cell in cells])
+
+  def _write(self, values: list[str]) -> None:
+    self._file.write("\t".join(values) + "\n")
+    self._file.flush()
@@ -0,0 +1,346 @@
+"""Persistent branch state, kept up to date by git hooks.
+
+`branches --install-hooks` installs the `HOOKS` and creates the state directory, `STATE_DIRNAME` in
+the common git directory. From then on:
+
+- Every checkout, merge, rebase and amend has a hook request a refresh and start
+  `branches --refresh-state` in the background, unless one is already running. The hooks run little
+  more than shell builtins, so they don't slow down `git rebase` (see `benchmarks/bench_hooks.py`).
+- Hooks that git runs once per commit are not used, since a rebase runs them once per commit it
+  picks. `reference-transaction` runs up to three times per ref update, around 200 times for a 20
+  commit rebase, which costs more than the rebase itself even when the hook does nothing. The same
+  goes for `post-commit`, to a lesser extent. Plain commits and new branches are picked up by the
+  next refresh, or by the next `branches` run.
+- The refresher waits until no refresh was requested for `DEBOUNCE_SECONDS`, so a rebase moving
+  refs many times is only followed by one refresh, and writes the state of every branch without
+  querying origin or GitHub.
+- Every `branches` table run writes the state too, including the PRs when they were fetched. The
+  refresher keeps the last known PRs.
+
+`state.json` holds the `cli.branch_record` of every branch, by branch name. `prompt.txt` holds the
+few fields `branches --prompt` shows, one tab separated line per branch, so that the prompt doesn't
+need to import `json` (and with it `re`). This module is imported by the prompt, so everything else
+is imported where it's used.
+"""
+
+import os
+import sys
+import time
+from collections.abc import Callable
+
+# Not `branches`: git creates a `branches` directory of its own, a legacy way to define remotes
+STATE_DIRNAME = "branches-state"
+STATE_FILENAME = "state.json"
+PROMPT_FILENAME = "prompt.txt"
+DEBOUNCE_SECONDS = 0.5
+HOOKS = ("post-checkout", "post-merge", "post-rewrite")
+HOOK_MARKER = "# Installed by `branches --install-hooks`"
+# Set by git while running hooks. They'd point the refresher to the index or directory of the
+# command that ran the hook.
+GIT_ENVARS = ("GIT_DIR", "GIT_WORK_TREE", "GIT_INDEX_FILE", "GIT_PREFIX")
+
+HOOK_TEMPLATE = """#!/bin/sh
+{marker}, removed by `branches --uninstall-hooks`.
+# Requests a refresh of the state `branches` keeps in {state_dir}
+# and starts it in the background. Besides mkdir, and mv when a refresher starts, only shell builtins
+# run here, so git isn't slowed down.
+state_dir={quoted_state_dir}
+lock="$state_dir/refreshing"
+echo "$$" 2>/dev/null > "$state_dir/requested" || exit 0
+if mkdir "$lock" 2>/dev/null; then
+  # Until the refresher's pid replaces it, this hook holds the lock
+  echo "$$" > "$lock/pid"
+else
+  pid=
+  read -r pid 2>/dev/null < "$lock/pid"
+  if [ -n "$pid" ]; then
+    kill -0 "$pid" 2>/dev/null && exit 0
+  elif [ -z "$(find "$lock" -prune -mmin +1 2>/dev/null)" ]; then
+    # Being set up by another hook, unless that one died and left it behind a while ago
+    exit 0
+  fi
+fi
+unset {git_envars}
+# git usually moves more refs right after this, let it finish before starting python
+(sleep {debounce}; {command}) < /dev/null > /dev/null 2>&1 &
+# Readers see either pid, never an empty file
+echo "$!" 2>/dev/null > "$lock/pid.$$" && mv -f "$lock/pid.$$" "$lock/pid"
+"""
+
+
+def state_dir(common_dir: str) -> str:
+  return os.path.join(common_dir, STATE_DIRNAME)
+
+
+def enabled(common_dir: str) -> bool:
+  """Returns whether the hooks were installed, and so whether the state should be written"""
+  return os.path.isdir(state_dir(common_dir))
+
+
+def read(common_dir: str) -> dict | None:
+  """Returns the saved state, or None if there is none or it can't be read"""
+  import json
+
+  try:
+    with open(os.path.join(state_dir(common_dir), STATE_FILENAME)) as state_file:
+      return json.load(state_file)
+  except (OSError, ValueError):
+    return None
+
+
+def write(
+  common_dir: str, default: str, records: list[dict], prs_loaded: bool, remote_loaded: bool = True
+) -> None:
+  """Replaces the saved state with `records`, the `cli.branch_record`s of the branches.
+
+  Args:
+    prs_loaded: whether the `pr` of the records was fetched. If not, the PRs of the previous state
+      are kept.
+    remote_loaded: whether the `remote` of the records was loaded. If not, the remote of the
+      previous state is kept for the branches whose sha didn't change, since the relationship
+      depends on it.
+  """
+  import json
+
+  branches = {record["name"]: record for record in records}
+  if not (prs_loaded and remote_loaded):
+    previous = (read(common_dir) or {}).get("branches", {})
+    for name, record in branches.items():
+      previous_record = previous.get(name, {})
+      if not prs_loaded:
+        record["pr"] = previous_record.get("pr")
+      if not remote_loaded and previous_record.get("sha") == record["sha"]:
+        record["remote"] = previous_record.get("remote")
+
+  state = {"written_at": time.time(), "default": default, "branches": branches}
+  _write(common_dir, STATE_FILENAME, json.dumps(state))
+  _write(common_dir, PROMPT_FILENAME, "".join(prompt_line(record) for record in records))
+
+
+def prompt_line(record: dict) -> str:
+  """Returns the line of `prompt.txt` for the branch `record`"""
+  base = record["base"] or ""
+  if base and record["base_behind"]:
+    base += f"~{record['base_behind']}"
+
+  remote = record["remote"] or {}
+  pr = record["pr"] or {}
+  fields = [
+    record["name"],
+    record["sha"],
+    "default" if record["default"] else "",
+    record["behind"],
+    record["ahead"],
+    base,
+    remote.get("sha"),
+    remote.get("relationship"),
+    pr.get("number"),
+    pr.get("status"),
+  ]
+  return "\t".join("" if field is None else str(field) for field in fields) + "\n"
+
+
+def read_prompt_lines(common_dir: str) -> dict[str, list[str]]:
+  """Returns the fields of every line of `prompt.txt`, by branch name. See `prompt_line`."""
+  try:
+    with open(os.path.join(state_dir(common_dir), PROMPT_FILENAME)) as prompt_file:
+      lines = prompt_file.read().splitlines()
+  except OSError:
+    return {}
+
+  return {fields[0]: fields for fields in (line.split("\t") for line in lines)}
+
+
+def _write(common_dir: str, filename: str, content: str) -> None:
+  directory = state_dir(common_dir)
+  temp_path = os.path.join(directory, f"{filename}.{os.getpid()}.tmp")
+  with open(temp_path, "w") as state_file:
+    state_file.write(content)
+  # Readers see either the previous version or this one, never a partially written file
+  os.replace(temp_path, os.path.join(directory, filename))
+
+
+def refresh(common_dir: str, save: Callable[[], None]) -> int:
+  """Calls `save` once refreshes stop being requested, and again as long as they keep coming.
+
+  Started in the background by the hooks, which create the `refreshing` lock directory and save
+  in it the pid of the shell that runs this. Both are removed when done.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  directory = state_dir(common_dir)
+  requested_path = os.path.join(directory, "requested")
+  lock_path = os.path.join(directory, "refreshing")
+  pid_path = os.path.join(lock_path, "pid")
+
+  os.makedirs(lock_path, exist_ok=True)
+
+  try:
+    while True:
+      requested_at = _mtime(requested_path)
+      while (elapsed := time.time() - requested_at / 1e9) < DEBOUNCE_SECONDS:
+        time.sleep(DEBOUNCE_SECONDS - elapsed)
+        requested_at = _mtime(requested_path)
+
+      save()
+      if _mtime(requested_path) == requested_at:
+        return 0
+  finally:
+    for remove, path in [(os.unlink, pid_path), (os.rmdir, lock_path)]:
+      try:
+        remove(path)
+      except OSError:
+        pass
+
+
+def refresh_argv(toplevel: str) -> list[str]:
+  """Returns the command that runs `branches --refresh-state` for the repository at `toplevel`, with
+  this same `branches` and Python.
+  """
+  if getattr(sys, "frozen", False):
+    # The executable built with PyInstaller
+    return [sys.executable, "-C", toplevel, "--refresh-state"]
+
+  src_dirpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  return [
+    "env",
+    f"PYTHONPATH={src_dirpath}",
+    sys.executable,
+    "-m",
+    "branches",
+    "-C",
+    toplevel,
+    "--refresh-state",
+  ]
+
+
+def start_refresh(common_dir: str, toplevel: str) -> None:
+  """Does what the hooks do: requests a refresh, and starts `refresh` in the background unless it's
+  already running.
+  """
+  directory = state_dir(common_dir)
+  lock_path = os.path.join(directory, "refreshing")
+  pid_path = os.path.join(lock_path, "pid")
+
+  try:
+    with open(os.path.join(directory, "requested"), "w") as requested_file:
+      requested_file.write(str(os.getpid()))
+    os.mkdir(lock_path)
+    _write_pid(pid_path, os.getpid())
+  except FileExistsError:
+    if _running(lock_path):
+      return
+  except OSError:
+    return
+
+  argv = refresh_argv(toplevel)
+  pid = os.posix_spawnp(
+    argv[0],
+    argv,
+    {name: value for name, value in os.environ.items() if name not in GIT_ENVARS},
+    file_actions=[(os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_RDWR, 0) for fd in (0, 1, 2)],
+    setsid=True,
+  )
+  _write_pid(pid_path, pid)
+
+
+def install_hooks(hooks_dir: str, common_dir: str, toplevel: str) -> int:
+  """Installs the hooks in `hooks_dir` and creates the state directory.
+
+  Hooks that exist and weren't installed by `branches` are left alone.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  import shlex
+
+  for hook in HOOKS:
+    if _foreign_hook(os.path.join(hooks_dir, hook)):
+      print(f"{os.path.join(hooks_dir, hook)} already exists. Not installing any hook.")
+      return 1
+
+  os.makedirs(hooks_dir, exist_ok=True)
+  os.makedirs(state_dir(common_dir), exist_ok=True)
+  content = HOOK_TEMPLATE.format(
+    marker=HOOK_MARKER,
+    state_dir=state_dir(common_dir),
+    quoted_state_dir=shlex.quote(state_dir(common_dir)),
+    git_envars=" ".join(GIT_ENVARS),
+    command=shlex.join(refresh_argv(toplevel)),
+    debounce=DEBOUNCE_SECONDS,
+  )
+  for hook in HOOKS:
+    path = os.path.join(hooks_dir, hook)
+    with open(path, "w") as hook_file:
+      hook_file.write(content)
+    os.chmod(path, 0o755)
+    print(f"Installed {path}")
+
+  return 0
+
+
+def uninstall_hooks(hooks_dir: str, common_dir: str) -> int:
+  """Removes the hooks `install_hooks` installed and the state directory.
+
+  Returns:
+    int: Exit code (0 for success).
+  """
+  for hook in HOOKS:
+    path = os.path.join(hooks_dir, hook)
+    if os.path.exists(path) and not _foreign_hook(path):
+      os.unlink(path)
+      print(f"Removed {path}")
+
+  import shutil
+
+  shutil.rmtree(state_dir(common_dir), ignore_errors=True)
+
+  return 0
+
+
+def _foreign_hook(path: str) -> bool:
+  try:
+    with open(path) as hook_file:
+      return HOOK_MARKER not in hook_file.read()
+  except FileNotFoundError:
+    return False
+
+
+def _running(lock_path: str) -> bool:
+  """Returns whether the process whose pid is in the lock at `lock_path` is running.
+
+  A lock without a pid is being set up, unless it's older than `DEBOUNCE_SECONDS`: whoever created
+  it died before saving their pid.
+  """
+  try:
+    with open(os.path.join(lock_path, "pid")) as pid_file:
+      pid = pid_file.read()
+  except FileNotFoundError:
+    pid = ""
+  except OSError:
+    return False
+
+  if not pid:
+    return time.time() - _mtime(lock_path) / 1e9 < DEBOUNCE_SECONDS
+
+  try:
+    os.kill(int(pid), 0)
+  except (OSError, ValueError):
+    return False
+  return True
+
+
+def _write_pid(pid_path: str, pid: int) -> None:
+  """Saves `pid` so that readers see either the previous pid or this one, never an empty file"""
+  temp_path = f"{pid_path}.{os.getpid()}"
+  with open(temp_path, "w") as pid_file:
+    pid_file.write(str(pid))
+  os.replace(temp_path, pid_path)
+
+
+def _mtime(path: str) -> int:
+  try:
+    return os.stat(path).st_mtime_ns
+  except FileNotFoundError:
+    return 0
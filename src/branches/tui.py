@@ -0,0 +1,245 @@
+"""Interactive, full screen view of the branches table.
+
+Only the rows that fit on the screen are drawn, so the cost of a frame doesn't depend on how many
+branches there are. Rows start out with the cells the `Db` already has. The expensive ones (origin
+relationship, PR) are loaded once a row scrolls into view or gets selected, one row per loop
+iteration so keys are still handled while rows load.
+
+Keys:
+  j / down, k / up, page down, page up, g / home, G / end: move the selection
+  /: filter branches by name. Enter keeps the filter, escape clears it
+  q / escape: quit
+"""
+
+import curses
+from collections.abc import Callable
+
+from .render import Cell, justify, plain_text
+
+# curses only has the 8 basic colors. Styles with other colors use the closest one.
+CURSES_COLORS = {
+  "red": curses.COLOR_RED,
+  "green": curses.COLOR_GREEN,
+  "yellow": curses.COLOR_YELLOW,
+  "blue": curses.COLOR_BLUE,
+  "dark_orange3": curses.COLOR_YELLOW,
+  "medium_purple1": curses.COLOR_MAGENTA,
+}
+
+KEY_ESCAPE = 27
+KEYS_ENTER = (curses.KEY_ENTER, 10, 13)
+KEYS_BACKSPACE = (curses.KEY_BACKSPACE, 8, 127)
+
+
+class BranchesView:
+  """What the view shows: the branches matching the filter, the selected one and the first one on
+  the screen. It doesn't use curses so it can be driven without a terminal.
+
+  Args:
+    branches: all the branches, in display order.
+    columns: the displayed `COLUMNS` entries, keyed by column key.
+    quick_row: returns the cells of a branch that can be built without running any query.
+    load_row: returns all the cells of a branch.
+  """
+
+  def __init__(
+    self,
+    branches: list[str],
+    columns: dict[str, dict],
+    quick_row: Callable[[str], dict[str, Cell]],
+    load_row: Callable[[str], dict[str, Cell]],
+  ):
+    self.branches = branches
+    self.columns = columns
+    self.matches = branches
+    self.filter = ""
+    self.selected = 0
+    self.top = 0
+    # Column widths only grow, so columns don't jump around while scrolling
+    self.widths = [len(column_attr["column_name"]) for column_attr in columns.values()]
+    self._quick_row = quick_row
+    self._load_row = load_row
+    self._rows: dict[str, list[Cell | None]] = {}
+    self._loaded: set[str] = set()
+
+  def row(self, branch: str) -> list[Cell | None]:
+    if branch not in self._rows:
+      self._set_row(branch, self._quick_row(branch))
+    return self._rows[branch]
+
+  def load(self, branch: str) -> None:
+    self._set_row(branch, self._load_row(branch))
+    self._loaded.add(branch)
+
+  def next_to_load(self, height: int) -> str | None:
+    """Returns the branch to load next: the selected one first, then the ones on the screen"""
+    for branch in [self.selected_branch(), *self.visible(height)]:
+      if branch is not None and branch not in self._loaded:
+        return branch
+    return None
+
+  def selected_branch(self) -> str | None:
+    return self.matches[self.selected] if self.matches else None
+
+  def visible(self, height: int) -> list[str]:
+    return self.matches[self.top : self.top + height]
+
+  def move(self, delta: int, height: int) -> None:
+    self.selected = max(0, min(self.selected + delta, len(self.matches) - 1))
+    if self.selected < self.top:
+      self.top = self.selected
+    elif self.selected >= self.top + height:
+      self.top = self.selected - height + 1
+
+  def set_filter(self, text: str, height: int) -> None:
+    selected = self.selected_branch()
+    # Typing one more character can only narrow down the current matches
+    candidates = self.matches if text.startswith(self.filter) else self.branches
+    self.filter = text
+    text = text.casefold()
+    self.matches = [branch for branch in candidates if text in branch.casefold()]
+    self.selected = self.matches.index(selected) if selected in self.matches else 0
+    self.top = 0
+    self.move(0, height)
+
+  def _set_row(self, branch: str, row_dict: dict[str, Cell]) -> None:
+    cells = [row_dict.get(column_key) for column_key in self.columns]
+    for idx, cell in enumerate(cells):
+      self.widths[idx] = max(self.widths[idx], len(plain_text(cell)))
+    self._rows[branch] = cells
+
+
+def run(view: BranchesView, details: Callable[[str], str]) -> None:
+  """Shows `view` until the user quits.
+
+  Args:
+    details: returns the line shown at the bottom of the screen for the selected branch.
+  """
+  curses.wrapper(_loop, view, details)
+
+
+def _loop(screen: "curses.window", view: BranchesView, details: Callable[[str], str]) -> None:
+  curses.curs_set(0)
+  attrs = _attrs()
+  editing = False
+
+  while True:
+    # Header line at the top, details and status lines at the bottom
+    height = max(curses.LINES - 3, 1)
+    _draw(screen, view, height, editing, details, attrs)
+
+    branch = view.next_to_load(height)
+    screen.timeout(0 if branch is not None else -1)
+    key = screen.getch()
+
+    if key == -1:
+      if branch is not None:
+        view.load(branch)
+    elif key == curses.KEY_RESIZE:
+      curses.update_lines_cols()
+      view.move(0, max(curses.LINES - 3, 1))
+    elif editing:
+      if key in KEYS_ENTER:
+        editing = False
+      elif key == KEY_ESCAPE:
+        editing = False
+        view.set_filter("", height)
+      elif key in KEYS_BACKSPACE:
+        view.set_filter(view.filter[:-1], height)
+      elif 32 <= key < 127:
+        view.set_filter(view.filter + chr(key), height)
+    elif key in (ord("q"), KEY_ESCAPE):
+      return
+    elif key in (ord("j"), curses.KEY_DOWN):
+      view.move(1, height)
+    elif key in (ord("k"), curses.KEY_UP):
+      view.move(-1, height)
+    elif key == curses.KEY_NPAGE:
+      view.move(height, height)
+    elif key == curses.KEY_PPAGE:
+      view.move(-height, height)
+    elif key in (ord("g"), curses.KEY_HOME):
+      view.move(-len(view.matches), height)
+    elif key in (ord("G"), curses.KEY_END):
+      view.move(len(view.matches), height)
+    elif key == ord("/"):
+      editing = True
+
+
+def _attrs() -> dict[str, int]:
+  """Returns the curses attribute for each style used in the table"""
+  ret = {"bold": curses.A_BOLD, "dim": curses.A_DIM}
+  if curses.has_colors():
+    curses.start_color()
+    curses.use_default_colors()
+    for idx, (style, color) in enumerate(CURSES_COLORS.items(), start=1):
+      curses.init_pair(idx, color, -1)
+      ret[style] = curses.color_pair(idx)
+  return ret
+
+
+def _draw(
+  screen: "curses.window",
+  view: BranchesView,
+  height: int,
+  editing: bool,
+  details: Callable[[str], str],
+  attrs: dict[str, int],
+) -> None:
+  screen.erase()
+  width = curses.COLS
+  justify_by_column = [
+    (column_attr["column_props"] or {}).get("justify") for column_attr in view.columns.values()
+  ]
+  style_by_column = [
+    (column_attr["column_props"] or {}).get("style") for column_attr in view.columns.values()
+  ]
+
+  x = 1
+  for column_attr, column_width, how in zip(view.columns.values(), view.widths, justify_by_column):
+    _write(screen, 0, x, justify(column_attr["column_name"], column_width, how), curses.A_UNDERLINE)
+    x += column_width + 1
+
+  for y, branch in enumerate(view.visible(height), start=1):
+    selected = view.top + y - 1 == view.selected
+    base_attr = curses.A_REVERSE if selected else 0
+    if selected:
+      _write(screen, y, 0, " " * (width - 1), base_attr)
+
+    x = 1
+    cells = view.row(branch)
+    for cell, column_width, how, style in zip(
+      cells, view.widths, justify_by_column, style_by_column
+    ):
+      text = plain_text(cell)
+      # Write the padding first, then each segment with its own style on top of it
+      _write(screen, y, x, justify(text, column_width, how), base_attr | attrs.get(style, 0))
+      offset = {"right": column_width - len(text), "center": (column_width - len(text)) // 2}
+      offset = offset.get(how, 0)
+      for segment in cell or ():
+        attr = base_attr | attrs.get(style, 0) | attrs.get(segment.style, 0)
+        _write(screen, y, x + offset, segment.text, attr)
+        offset += len(segment.text)
+      x += column_width + 1
+
+  selected = view.selected_branch()
+  if selected is not None:
+    _write(screen, curses.LINES - 2, 1, details(selected), curses.A_BOLD)
+
+  status = f"{view.selected + 1 if view.matches else 0}/{len(view.matches)}"
+  if editing or view.filter:
+    status += f"  /{view.filter}"
+  if not editing:
+    status += "  (/ filter, q quit)"
+  _write(screen, curses.LINES - 1, 1, status, 0)
+  screen.refresh()
+
+
+def _write(screen: "curses.window", y: int, x: int, text: str, attr: int) -> None:
+  if y >= curses.LINES or x >= curses.COLS - 1:
+    return
+  try:
+    screen.addnstr(y, x, text, curses.COLS - 1 - x, attr)
+  except curses.error:
+    # Writing to the bottom right corner moves the cursor out of the screen
+    pass
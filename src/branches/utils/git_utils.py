@@ -1,56 +1,137 @@
+import fnmatch
 import os
-import git
-from git import Commit
-from gitdb.exc import BadName
+import time
 import re
+import subprocess
+from datetime import datetime, timezone
+from ..db import AtLeast, intern_sha
+
+# `fetch_shas` fetches this many commits per `git fetch`, so the command line stays short
+FETCH_BATCH_SIZE = 256
+# History fetched below each commit `fetch_shas` fetches in a shallow clone
+SHALLOW_FETCH_DEPTH = 100
+
+
+class GitCommandError(Exception):
+  """A `git` command exited with a non zero status"""
+
+
+def backend() -> type["GitUtils"]:
+  """Returns the `GitUtils` backend to use.
+
+  The `BRANCHES_GIT_BACKEND` envar picks one: "git" runs `git` commands (`GitUtils`) and "pygit2"
+  uses libgit2 in-process (`Pygit2Utils`). When it's not set, pygit2 is used if it can be imported.
+  """
+  name = os.environ.get("BRANCHES_GIT_BACKEND")
+  if name == "git":
+    return GitUtils
+
+  try:
+    from .pygit2_utils import Pygit2Utils
+  except ImportError:
+    if name == "pygit2":
+      raise
+    return GitUtils
+
+  return Pygit2Utils
 
 
 class GitUtils:
-  @classmethod
-  def repo_from_path(cls, repo_path: str | None = None) -> git.Repo | None:
-    """Can be used to check whether a path is a git repository or not"""
-    if repo_path is None:
-      repo_path = os.getcwd()
+  """Facade for everything the CLI needs from `git`.
 
-    ret = None
+  The public methods of this class are the interface the rest of the code works with. This
+  implementation runs `git` plumbing commands directly, without GitPython, and only deals with
+  shas, branch names and plain values. Other backends can subclass it and override the methods
+  they implement better, falling back to these for everything else.
+  """
 
-    while True:
-      try:
-        ret = git.Repo(repo_path, search_parent_directories=True)
-        break
-      except git.exc.InvalidGitRepositoryError:
-        if len(repo_path) > 1:
-          repo_path = os.path.dirname(repo_path)
-        else:
-          ret = None
-          break
+  @classmethod
+  def from_path(cls, path: str | None = None) -> "GitUtils | None":
+    """Returns a `GitUtils` for the repository `path` is in, or None if it's not in a repository.
 
-    return ret
+    A single `git rev-parse` finds the top level directory and the current branch, searching the
+    parent directories of `path` like any other `git` command does.
+    """
+    result = subprocess.run(
+      ["git", "-C", path or os.getcwd(), "rev-parse", "--show-toplevel", "--abbrev-ref", "HEAD"],
+      capture_output=True,
+      text=True,
+    )
+
+    lines = result.stdout.splitlines()
+    if not lines:
+      return None
 
-  def __init__(self, repo_path: str | None = None, repo: git.Repo | None = None):
-    if repo is not None:
-      self._repo = repo
+    ret = cls(lines[0])
+    if result.returncode == 0:
+      ret._current_branch = lines[1] if lines[1] != "HEAD" else None
     else:
-      self._repo = type(self).repo_from_path(repo_path)
+      # HEAD points to a branch with no commits yet
+      ret._current_branch = ret._run("symbolic-ref", "--short", "-q", "HEAD", check=False) or None
 
-    if self._repo is None:
-      raise Exception("Not a git repository")
+    return ret
 
-    self._repo_path = self._repo.working_tree_dir
-    self._cmd = git.cmd.Git(repo_path)
-    self._git = self._repo.git
+  def __init__(self, repo_path: str):
+    self._repo_path = repo_path
     self._current_branch = None
     self._owner_name = None
     self._repo_name = None
+    self._partial: bool | None = None
+    self._shallow_shas: frozenset[str] | None = None
+    # Shas `fetch_shas` already tried to fetch, so they're not fetched one by one afterwards
+    self._fetched: set[str] = set()
+
+  def _run(
+    self, *args: str, input: str | None = None, check: bool = True, env: dict | None = None
+  ) -> str:
+    """Runs `git *args` in the repository and returns its stdout without the trailing newline
+
+    Args:
+      env: environment variables to set on top of the current ones.
+
+    Raises:
+      GitCommandError: if `check` and the command exits with a non zero status.
+    """
+    result = subprocess.run(
+      ["git", "-C", self._repo_path, *args],
+      input=input,
+      capture_output=True,
+      text=True,
+      env={**os.environ, **env} if env else None,
+    )
+
+    if check and result.returncode != 0:
+      raise GitCommandError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+
+    return result.stdout.rstrip("\n")
+
+  def _returncode(self, *args: str) -> int:
+    """Runs `git *args` in the repository, ignoring its output, and returns its exit status"""
+    return subprocess.run(["git", "-C", self._repo_path, *args], capture_output=True).returncode
 
   def working_tree_dir(self) -> str:
-    return str(self._repo.working_tree_dir or "")
+    return self._repo_path
+
+  def git_dirs(self) -> tuple[str, str]:
+    """Returns the absolute paths of the git directory, where HEAD is, and of the common directory,
+    where refs are. They're the same directory except in linked worktrees.
+    """
+    git_dir, common_dir = self._run("rev-parse", "--absolute-git-dir", "--git-common-dir").split(
+      "\n"
+    )
+    return (git_dir, os.path.normpath(os.path.join(self._repo_path, common_dir)))
+
+  def hooks_dir(self) -> str:
+    """Returns the absolute path of the directory git runs hooks from"""
+    return os.path.normpath(
+      os.path.join(self._repo_path, self._run("rev-parse", "--git-path", "hooks"))
+    )
 
   def owner_and_repo(self):
     if self._owner_name and self._repo_name:
       return self._owner_name, self._repo_name
 
-    remotes = self._cmd.execute(["git", "-C", self._repo_path, "remote", "-v"])
+    remotes = self._run("remote", "-v")
     if "PYTEST_CURRENT_TEST" not in os.environ:
       match = re.search(r"github\.com(?::|\/)([\w\-]+)\/([\w\-]+)\.git \(fetch\)", remotes)
     else:
@@ -63,42 +144,162 @@ class GitUtils:
     return self._owner_name, self._repo_name
 
   def current_branch(self) -> str | None:
-    if self._current_branch:
-      return self._current_branch
+    """Returns the branch HEAD points to, or None if HEAD is detached"""
+    return self._current_branch
 
-    if self._repo.head.is_detached:
-      return None
+  def branches(
+    self,
+    include: list[str] | None = None,
+    exclude: list[str] | None = None,
+    max_age_days: int | None = None,
+    author_email: str | None = None,
+  ) -> list[str]:
+    """Returns the local branches, most recently authored first
+
+    All filtering happens here, off a single `git for-each-ref`, so that filtered out branches
+    don't cost anything else.
+
+    Args:
+      include: only branches matching at least one of these shell-style patterns.
+      exclude: leave out branches matching any of these shell-style patterns.
+      max_age_days: leave out branches whose last commit was authored more days ago than this.
+      author_email: only branches whose last commit was authored by this email.
+    """
+    output = self._run(
+      "for-each-ref",
+      "--sort=refname",
+      "--sort=-authordate",
+      "--format=%(refname:short)%09%(authordate:unix)%09%(authoremail)",
+      "refs/heads/",
+    )
 
-    self._current_branch = str(self._repo.active_branch)
+    ret = []
+    now = time.time()
+    for line in output.split("\n"):
+      if not line:
+        continue
+
+      branch, authored, email = line.split("\t")
+      # `for-each-ref` patterns would match differently: a name without wildcards matches the
+      # branches under it too, as if it ended in "/*"
+      if include and not any(fnmatch.fnmatchcase(branch, pattern) for pattern in include):
+        continue
+      if any(fnmatch.fnmatchcase(branch, pattern) for pattern in exclude or []):
+        continue
+      if max_age_days is not None and now - int(authored or 0) > max_age_days * 86400:
+        continue
+      if author_email is not None and email.strip("<>") != author_email:
+        continue
+
+      ret.append(branch)
 
-    return self._current_branch
+    return ret
+
+  def local_shas_from_branches(self) -> dict[str, str]:
+    """Returns the local sha every local branch points to, with a single `git for-each-ref`"""
+    output = self._run("for-each-ref", "--format=%(refname:short)%09%(objectname)", "refs/heads/")
+
+    ret = {}
+    for line in output.split("\n"):
+      if line:
+        branch, sha = line.split("\t")
+        ret[branch] = intern_sha(sha)
+    return ret
+
+  def tracking_shas(self) -> dict[str, str]:
+    """Returns the sha of every branch in origin as of the last fetch or push, by branch name.
+
+    Unlike `remote_shas`, this only reads the remote tracking branches and doesn't query origin.
+    """
+    output = self._run(
+      "for-each-ref", "--format=%(refname:lstrip=3)%09%(objectname)", "refs/remotes/origin/"
+    )
+
+    ret = {}
+    for line in output.split("\n"):
+      if line:
+        branch, sha = line.split("\t")
+        if branch != "HEAD":
+          ret[branch] = intern_sha(sha)
+    return ret
+
+  def has_changes(self) -> bool:
+    """Returns whether there is anything to commit: staged or unstaged changes, or untracked files.
+
+    It's a single `git status`, which uses `core.fsmonitor` and the untracked cache when they're
+    enabled, and it's stopped at the first changed path. `GIT_OPTIONAL_LOCKS=0` keeps it from
+    refreshing the index, so it never waits for or holds the index lock.
+    """
+    import tempfile
+
+    args = ["status", "--porcelain=v2", "-z", "--untracked-files=normal"]
+    # stderr goes to a file, a pipe nobody reads while stdout is read could fill up and block git
+    with (
+      tempfile.TemporaryFile() as stderr,
+      subprocess.Popen(
+        ["git", "-C", self._repo_path, *args],
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        env={**os.environ, "GIT_OPTIONAL_LOCKS": "0"},
+      ) as process,
+    ):
+      if process.stdout.read(1):
+        # One changed path is enough
+        process.kill()
+        return True
+
+      if process.wait() != 0:
+        raise GitCommandError(f"git {' '.join(args)} failed: {_read_stderr(stderr)}")
+
+    return False
+
+  def worktree_tree(self) -> str:
+    """Returns the tree `git add -A` would leave in the index: the working tree, untracked files
+    included. The index is not modified, it's a copy of it that is added to.
+    """
+    import shutil
+    import tempfile
+
+    git_dir = self.git_dirs()[0]
+    with tempfile.TemporaryDirectory() as tmp_dirpath:
+      index = os.path.join(tmp_dirpath, "index")
+      if os.path.exists(os.path.join(git_dir, "index")):
+        shutil.copyfile(os.path.join(git_dir, "index"), index)
+
+      self._run("add", "-A", env={"GIT_INDEX_FILE": index})
+      return self._run("write-tree", env={"GIT_INDEX_FILE": index})
+
+  def replay(self, onto: str, shas: list[str]) -> tuple[list[str], tuple[str, list[str]] | None]:
+    """Replays the commits `shas`, oldest first, on top of the tree of `onto` like `git rebase`
+    does, without touching the working tree, the index or any ref.
 
-  def branches(self) -> list[str]:
-    branches = self._cmd.execute(
-      [
-        "git",
-        "-C",
-        self._repo_path,
-        "for-each-ref",
-        "--sort=refname",
-        "--sort=-authordate",
-        "--format=%(refname:short)",
-        "refs/heads/",
-      ]
-    ).split("\n")
-    return [branch.replace("*", "").strip() for branch in branches if branch]
-
-  def staged_changes_filepaths(self) -> list[str]:
-    """Returns a list of filepaths. Each filepath has staged changes"""
-    return [diff.a_path for diff in self._repo.index.diff("HEAD")]
-
-  def unstaged_changes_filepaths(self) -> list[str]:
-    """Returns a list of filepaths. Each filepath has unstaged changes"""
-    return [diff.a_path for diff in self._repo.index.diff(None)]
-
-  def untracked_filepaths(self) -> list[str]:
-    """Returns a list of filepaths. Each filepath is a new untracked file"""
-    return self._repo.untracked_files
+    Each commit is merged with `git merge-tree --write-tree` using its parent as the merge base.
+    `merge-tree` can't be given the merge base before git 2.40, so the tree replayed so far is
+    wrapped in a temporary commit whose parent is that one.
+
+    Returns:
+      Tuple with two values:
+      1. The tree of `onto`, followed by the tree after each commit replayed.
+      2. If a commit doesn't apply, its sha and the paths that conflict, otherwise None.
+    """
+    trees = [self._run("rev-parse", "--verify", f"{onto}^{{tree}}")]
+    for sha in shas:
+      head = self._run(
+        *("-c", "user.name=branches", "-c", "user.email=branches@localhost"),
+        *("commit-tree", trees[-1], "-p", f"{sha}^", "-m", "branches --check-conflicts"),
+      )
+
+      args = ["merge-tree", "--write-tree", "--name-only", "--no-messages", head, sha]
+      result = subprocess.run(["git", "-C", self._repo_path, *args], capture_output=True, text=True)
+      if result.returncode not in [0, 1]:
+        raise GitCommandError(f"git {' '.join(args)} failed: {result.stderr.strip()}")
+
+      tree, *paths = result.stdout.splitlines()
+      if result.returncode == 1:
+        return (trees, (sha, [path for path in paths if path]))
+      trees.append(tree)
+
+    return (trees, None)
 
   def local_sha_from_branch(self, branch: str | None = None) -> str:
     """Returns the local sha the `branch` points to.
@@ -108,46 +309,110 @@ class GitUtils:
     if branch is None:
       branch = self.current_branch()
 
-    return str(self.local_commit_from_branch(branch))
+    return intern_sha(self._run("rev-parse", "--verify", "-q", f"refs/heads/{branch}^{{commit}}"))
+
+  def local_sha(self) -> str:
+    """Returns the sha of HEAD"""
+    return self._run("rev-parse", "HEAD")
+
+  def is_partial(self) -> bool:
+    """Returns whether the repository is a partial clone (`git clone --filter`). Objects missing
+    in those are downloaded from origin one at a time by any command that reads them.
+    """
+    if self._partial is None:
+      # Older clones set the extension, newer ones only mark the remote as a promisor
+      config = self._run(
+        "config",
+        "--get-regexp",
+        r"^(extensions\.partialclone|remote\.origin\.promisor)$",
+        check=False,
+      )
+      self._partial = any(not line.endswith(" false") for line in config.splitlines())
+    return self._partial
 
-  def local_commit_from_branch(self, branch: str) -> Commit:
-    return self._repo.commit(f"refs/heads/{branch}")
+  def shallow_shas(self) -> frozenset[str]:
+    """Returns the commits whose parents are missing because the repository is a shallow clone.
+    Empty if it isn't one.
+    """
+    if self._shallow_shas is None:
+      try:
+        with open(os.path.join(self.git_dirs()[1], "shallow")) as shallow_file:
+          self._shallow_shas = frozenset(intern_sha(sha) for sha in shallow_file.read().split())
+      except FileNotFoundError:
+        self._shallow_shas = frozenset()
+    return self._shallow_shas
 
-  def local_commit_from_sha(self, sha) -> Commit | None:
-    try:
-      return self._repo.commit(sha)
-    except ValueError:
-      # Sha doesn't exist locally. Ignore and return None
-      return None
+  def sha_exists(self, sha: str) -> bool:
+    """Returns whether the commit `sha` exists locally"""
+    return bool(sha) and not self.missing_shas([sha])
 
-  def local_commit(self) -> Commit:
-    return self._repo.head.commit
+  def missing_shas(self, shas: list[str]) -> list[str]:
+    """Returns the commits in `shas` that don't exist locally, checking all of them at once.
 
-  def local_sha(self) -> str:
-    """Returns the sha of HEAD"""
-    return str(self.local_commit())
+    `--missing` keeps git from downloading them in partial clones, which any other command that
+    looks them up does.
+    """
+    shas = [sha for sha in dict.fromkeys(shas) if sha]
+    if not shas:
+      return []
+
+    existing = self._run(
+      "rev-list",
+      "--no-walk",
+      "--missing=print",
+      "--ignore-missing",
+      "--stdin",
+      input="\n".join(shas) + "\n",
+      check=False,
+    ).split()
+    return [sha for sha in shas if sha not in existing]
+
+  def fetch_shas(self, shas: list[str]) -> None:
+    """Fetches from origin the commits in `shas` that don't exist locally, `FETCH_BATCH_SIZE` per
+    `git fetch`, instead of one round trip each.
+
+    Only commits are fetched in partial clones (`--filter=tree:0`), since nothing here reads trees
+    or blobs, and at most `SHALLOW_FETCH_DEPTH` commits of their history in shallow clones.
+    """
+    missing = [sha for sha in self.missing_shas(shas) if sha not in self._fetched]
+    if not missing:
+      return
+
+    self._fetched.update(missing)
+    options = []
+    if self.is_partial():
+      options.append("--filter=tree:0")
+    if self.shallow_shas():
+      options.append(f"--depth={SHALLOW_FETCH_DEPTH}")
+      # The fetch adds shallow commits
+      self._shallow_shas = None
+
+    for start in range(0, len(missing), FETCH_BATCH_SIZE):
+      batch = missing[start : start + FETCH_BATCH_SIZE]
+      self._run("fetch", "--no-tags", *options, "origin", *batch, check=False)
+
+  def fetch_single_sha(self, sha: str) -> bool:
+    """Fetches the commit `sha` from origin unless it exists locally or `fetch_shas` already tried
 
-  def fetch_single_sha(self, sha: str) -> Commit | None:
+    Returns:
+      Whether the commit exists locally after the fetch.
+    """
     if not sha:
-      return None
+      return False
 
-    ret = self.local_commit_from_sha(sha)
-    if not ret:
-      self._repo.remotes.origin.fetch(sha)
-      ret = self.local_commit_from_sha(sha)
-    return ret
+    self.fetch_shas([sha])
+    return self.sha_exists(sha)
 
-  def is_ancestor(self, older_commit: Commit, newer_commit: Commit) -> bool | None:
+  def is_ancestor(self, older_sha: str, newer_sha: str) -> bool | None:
     """
     Returns:
-      True if `older_commit` is an ancestor of `newer_commit`
+      True if `older_sha` is an ancestor of `newer_sha`
       False otherwise
       None if either one does not exist locally or an issue occurred
     """
-    try:
-      return self._repo.is_ancestor(older_commit, newer_commit)
-    except BadName, git.exc.GitCommandError:
-      return None
+    return {0: True, 1: False}.get(
+      self._returncode("merge-base", "--is-ancestor", older_sha, newer_sha)
+    )
 
   def remote_shas(self, branches: str | list[str]) -> dict[str, str]:
     ret = {}
@@ -156,17 +421,15 @@ class GitUtils:
       branches = branches.splitlines()
 
     try:
-      ls_remote_output = self._cmd.execute(
-        ["git", "-C", self._repo_path, "ls-remote", "origin", *branches]
-      )
-    except git.exc.GitCommandError:
+      ls_remote_output = self._run("ls-remote", "origin", *branches)
+    except GitCommandError:
       # origin doesn't exist
       return {}
 
     for line in ls_remote_output.split("\n"):
       result = re.search(r"^(\w+)\s+refs\/heads\/(.*)$", line)
       if result is not None:
-        ret[result.group(2)] = result.group(1)
+        ret[result.group(2)] = intern_sha(result.group(1))
 
     return ret
 
@@ -176,19 +439,28 @@ class GitUtils:
     First return number is how many commits branch_to is ahead of branch_from
     Second return number is how many commits branch_to is behind of branch_from
     """
-    result = self._cmd.execute(
-      [
-        "git",
-        "-C",
-        self._repo_path,
-        "rev-list",
-        "--left-right",
-        "--count",
-        f"{branch_from}...{branch_to}",
-      ]
-    )
-    result = re.split(r"\s+", result.strip())
-    return (int(result[0]), int(result[1]))
+    shallow_shas = self.shallow_shas()
+    if not shallow_shas:
+      result = self._run("rev-list", "--left-right", "--count", f"{branch_from}...{branch_to}")
+      result = re.split(r"\s+", result.strip())
+      return (int(result[0]), int(result[1]))
+
+    return self._shallow_distance(branch_from, branch_to, shallow_shas)
+
+  def _shallow_distance(
+    self, branch_from, branch_to, shallow_shas: frozenset[str]
+  ) -> tuple[int, int]:
+    """`distance` in a shallow clone. A side that reaches a shallow commit may have more commits
+    than the ones available locally, so its count is returned as an `AtLeast`.
+    """
+    counts = {"<": 0, ">": 0}
+    truncated = {"<": False, ">": False}
+    for line in self._run("rev-list", "--left-right", f"{branch_from}...{branch_to}").split():
+      side, sha = line[0], line[1:]
+      counts[side] += 1
+      truncated[side] = truncated[side] or sha in shallow_shas
+
+    return tuple(AtLeast(counts[side]) if truncated[side] else counts[side] for side in "<>")
 
   def parent_shas_of_ref(self, ref: str, n: int = 1) -> list[list[str]]:
     """Returns the parent shas of `ref`, going at most `n` levels deep
@@ -199,18 +471,18 @@ class GitUtils:
     """
     ret = []
 
-    command = ["git", "-C", self._repo_path, "rev-list", "--parents", f"-n{n}", ref, "--"]
-    for line in self._cmd.execute(command).split("\n"):
+    for line in self._run("rev-list", "--parents", f"-n{n}", ref, "--").split("\n"):
       ret.append(re.split(r"\s+", line.strip()))
 
     return ret
 
   def main_branch(self) -> str:
     try:
-      origin_ref = self._repo.refs["origin/HEAD"]
-    except IndexError as exception:
+      origin_head = self._run("symbolic-ref", "--short", "refs/remotes/origin/HEAD")
+    except GitCommandError as exception:
+      local_branches = self.local_shas_from_branches()
       for branch in ["main", "release", "master"]:
-        if branch in self._repo.branches:
+        if branch in local_branches:
           return branch
 
       branches = self.branches()
@@ -219,36 +491,108 @@ class GitUtils:
 
       raise exception
 
-    origin_head = origin_ref.reference.name
-    return re.search(r"\/([^\/]+?)\s*$", origin_head).group(1)
+    return origin_head.removeprefix("origin/")
 
   def shas_ahead_of(self, branch_from, branch_to) -> list[str]:
-    result = self._cmd.execute(
-      [
-        "git",
-        "-C",
-        self._repo_path,
-        "log",
-        f"{branch_from}..{branch_to}",
-        "--format=%H",
-        "--reverse",
-      ]
+    result = self._run("log", f"{branch_from}..{branch_to}", "--format=%H", "--reverse")
+    return [intern_sha(sha) for sha in re.split(r"\s+", result.strip()) if sha.strip()]
+
+  def commits_ahead_of(
+    self, branch_from: str | list[str], branches_to: list[str]
+  ) -> list[tuple[str, list[str], str]]:
+    """Returns every commit reachable from any of `branches_to` but not from `branch_from`, or from
+    any of them if it's a list
+
+    All the branches are walked with a single `git log`, so a commit shared by several of
+    `branches_to` is only listed once. Parents always come before their children.
+
+    Returns:
+      A list of (sha, parent shas, author email) tuples.
+    """
+    if not branches_to:
+      return []
+
+    branches_from = [branch_from] if isinstance(branch_from, str) else branch_from
+    output = self._run(
+      "log",
+      "--stdin",
+      "--topo-order",
+      "--reverse",
+      "--format=%H%x09%P%x09%ae",
+      input="\n".join([*[f"^{branch}" for branch in branches_from], *branches_to]) + "\n",
     )
-    return [sha for sha in re.split(r"\s+", result.strip()) if sha.strip()]
+
+    ret = []
+    for line in output.splitlines():
+      sha, parents, email = line.split("\t")
+      ret.append((intern_sha(sha), [intern_sha(parent) for parent in parents.split()], email))
+
+    return ret
+
+  def other_authors_ahead_of(
+    self, branch_from: str, branch_to: str, email: str | None, limit: int | None = None
+  ) -> frozenset[str]:
+    """Returns the authors other than `email` of the commits reachable from `branch_to` but not
+    from `branch_from`.
+
+    The commits are read as `git log` outputs them, newest first, and it's stopped as soon as
+    `limit` authors are found. With a limit of 1 this is a yes/no question that's usually answered
+    by the first few commits, even on branches with thousands of them.
+    """
+    import tempfile
+
+    args = ["log", "--format=%ae", f"{branch_from}..{branch_to}", "--"]
+    ret = set()
+    # stderr goes to a file, see `has_changes`
+    with (
+      tempfile.TemporaryFile() as stderr,
+      subprocess.Popen(
+        ["git", "-C", self._repo_path, *args],
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        text=True,
+      ) as process,
+    ):
+      for line in process.stdout:
+        author = line.rstrip("\n")
+        if author != email:
+          ret.add(author)
+          if limit is not None and len(ret) >= limit:
+            # The rest of the commits are not needed
+            process.kill()
+            break
+      else:
+        # Only reported when git failed on its own, not because it was killed
+        if process.wait() != 0:
+          raise GitCommandError(f"git {' '.join(args)} failed: {_read_stderr(stderr)}")
+
+    return frozenset(ret)
+
+  def config_values(self, name: str) -> list[str]:
+    """Returns all the values of the git config `name`, empty if it's not set"""
+    return self._run("config", "--get-all", name, check=False).splitlines()
 
   def current_user_email(self) -> str | None:
     try:
-      return self._cmd.execute(["git", "-C", self._repo_path, "config", "user.email"]).strip()
-    except git.exc.GitCommandError:
+      return self._run("config", "user.email").strip()
+    except GitCommandError:
       return None
 
   def commit_author_email(self, sha):
-    return self._cmd.execute(
-      ["git", "-C", self._repo_path, "show", "--format=%ae", "--no-patch", sha]
-    ).strip()
+    return self._run("log", "-1", "--format=%ae", sha).strip()
+
+  def date_authored(self, sha) -> datetime:
+    return self._date("%at", sha)
+
+  def date_committed(self, sha) -> datetime:
+    return self._date("%ct", sha)
+
+  def _date(self, format: str, sha: str) -> datetime:
+    timestamp = self._run("log", "-1", f"--format={format}", sha).strip()
+    return datetime.fromtimestamp(int(timestamp), timezone.utc)
 
-  def date_authored(self, sha):
-    return self.local_commit_from_sha(sha).authored_datetime
 
-  def date_committed(self, sha):
-    return self.local_commit_from_sha(sha).committed_datetime
+def _read_stderr(stderr) -> str:
+  """Returns what a process wrote to the temporary file `stderr`"""
+  stderr.seek(0)
+  return stderr.read().decode(errors="replace").strip()
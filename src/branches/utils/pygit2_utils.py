@@ -0,0 +1,164 @@
+"""`GitUtils` backend on top of pygit2 (libgit2).
+
+The queries that run once per branch or commit (distances, commit walks, commit authors and dates,
+the merges `--check-conflicts` replays commits with) are answered in-process instead of spawning a
+`git` process each. Everything else (`fetch`, `ls-remote`,
+`config`, filtered `for-each-ref`, the working tree state) is inherited from `GitUtils`.
+
+pygit2 is optional. See `git_utils.backend` for how the backend is chosen.
+"""
+
+from datetime import datetime, timezone
+
+import pygit2
+
+from ..db import intern_sha
+from .git_utils import GitCommandError, GitUtils
+
+
+class Pygit2Utils(GitUtils):
+  def __init__(self, repo_path: str):
+    super().__init__(repo_path)
+    self._repository = pygit2.Repository(repo_path)
+
+  def _commit(self, ref: str) -> pygit2.Commit:
+    """Returns the commit `ref` (a sha, branch name, or anything `git rev-parse` takes) points to
+
+    Raises:
+      GitCommandError: if `ref` doesn't exist, like the `git` commands `GitUtils` runs would.
+    """
+    try:
+      return self._repository.revparse_single(ref).peel(pygit2.Commit)
+    except (KeyError, ValueError, pygit2.GitError) as exception:
+      raise GitCommandError(f"unknown revision {ref}: {exception}") from exception
+
+  def _walk(self, hide: list[str], push: list[str], sort: pygit2.enums.SortMode):
+    walker = self._repository.walk(None, sort)
+    for ref in push:
+      walker.push(self._commit(ref).id)
+    for ref in hide:
+      walker.hide(self._commit(ref).id)
+    return walker
+
+  def local_shas_from_branches(self) -> dict[str, str]:
+    return {
+      branch: intern_sha(str(self._repository.branches.local[branch].peel(pygit2.Commit).id))
+      for branch in self._repository.branches.local
+    }
+
+  def local_sha_from_branch(self, branch: str | None = None) -> str:
+    if branch is None:
+      branch = self.current_branch()
+
+    return intern_sha(str(self._commit(f"refs/heads/{branch}").id))
+
+  def local_sha(self) -> str:
+    return str(self._commit("HEAD").id)
+
+  def sha_exists(self, sha: str) -> bool:
+    if not sha:
+      return False
+
+    try:
+      return isinstance(self._repository.get(sha), pygit2.Commit)
+    except ValueError:
+      return False
+
+  def missing_shas(self, shas: list[str]) -> list[str]:
+    # libgit2 never downloads missing objects, even in partial clones
+    return [sha for sha in dict.fromkeys(shas) if sha and not self.sha_exists(sha)]
+
+  def shallow_shas(self) -> frozenset[str]:
+    if self._shallow_shas is None and not self._repository.is_shallow:
+      self._shallow_shas = frozenset()
+    return super().shallow_shas()
+
+  def is_ancestor(self, older_sha: str, newer_sha: str) -> bool | None:
+    try:
+      older = self._commit(older_sha).id
+      newer = self._commit(newer_sha).id
+    except GitCommandError:
+      return None
+
+    return older == newer or self._repository.descendant_of(newer, older)
+
+  def distance(self, branch_from, branch_to) -> tuple[int, int]:
+    if self.shallow_shas():
+      # Only `GitUtils` tells apart the counts that reached the end of the shallow history
+      return super().distance(branch_from, branch_to)
+
+    return self._repository.ahead_behind(self._commit(branch_from).id, self._commit(branch_to).id)
+
+  def parent_shas_of_ref(self, ref: str, n: int = 1) -> list[list[str]]:
+    ret = []
+    for commit in self._walk([], [ref], pygit2.enums.SortMode.TIME):
+      if len(ret) >= n:
+        break
+      ret.append([str(commit.id), *[str(parent_id) for parent_id in commit.parent_ids]])
+    return ret
+
+  def shas_ahead_of(self, branch_from, branch_to) -> list[str]:
+    sort = pygit2.enums.SortMode.TIME | pygit2.enums.SortMode.REVERSE
+    return [intern_sha(str(commit.id)) for commit in self._walk([branch_from], [branch_to], sort)]
+
+  def commits_ahead_of(
+    self, branch_from: str | list[str], branches_to: list[str]
+  ) -> list[tuple[str, list[str], str]]:
+    if not branches_to:
+      return []
+
+    branches_from = [branch_from] if isinstance(branch_from, str) else branch_from
+    sort = pygit2.enums.SortMode.TOPOLOGICAL | pygit2.enums.SortMode.REVERSE
+    return [
+      (
+        intern_sha(str(commit.id)),
+        [intern_sha(str(parent_id)) for parent_id in commit.parent_ids],
+        commit.author.email,
+      )
+      for commit in self._walk(branches_from, branches_to, sort)
+    ]
+
+  def other_authors_ahead_of(
+    self, branch_from: str, branch_to: str, email: str | None, limit: int | None = None
+  ) -> frozenset[str]:
+    if limit is not None:
+      # libgit2 walks all of the hidden history before returning the first commit, `git log` can be
+      # stopped as soon as the limit is reached
+      return super().other_authors_ahead_of(branch_from, branch_to, email, limit)
+
+    ret = set()
+    for commit in self._walk([branch_from], [branch_to], pygit2.enums.SortMode.NONE):
+      if commit.author.email != email:
+        ret.add(commit.author.email)
+    return frozenset(ret)
+
+  def replay(self, onto: str, shas: list[str]) -> tuple[list[str], tuple[str, list[str]] | None]:
+    # The merges happen in memory, only the trees of the commits that apply are written
+    try:
+      tree = self._repository.revparse_single(onto).peel(pygit2.Tree)
+    except (KeyError, ValueError, pygit2.GitError) as exception:
+      raise GitCommandError(f"unknown revision {onto}: {exception}") from exception
+
+    trees = [str(tree.id)]
+    for sha in shas:
+      commit = self._commit(sha)
+      index = self._repository.merge_trees(commit.parents[0].tree, tree, commit.tree)
+      if index.conflicts is not None:
+        paths = {
+          entry.path for entries in index.conflicts for entry in entries if entry is not None
+        }
+        return (trees, (sha, sorted(paths)))
+
+      tree = self._repository[index.write_tree(self._repository)]
+      trees.append(str(tree.id))
+
+    return (trees, None)
+
+  def commit_author_email(self, sha):
+    return self._commit(sha).author.email
+
+  def date_authored(self, sha) -> datetime:
+    return datetime.fromtimestamp(self._commit(sha).author.time, timezone.utc)
+
+  def date_committed(self, sha) -> datetime:
+    return datetime.fromtimestamp(self._commit(sha).commit_time, timezone.utc)
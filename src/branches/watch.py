@@ -0,0 +1,184 @@
+"""Waits for refs to change, for `branches --watch`.
+
+On Linux the ref directories are watched with inotify, called through ctypes so there's nothing to
+install. Elsewhere, or when inotify can't be set up (for example when the user's watch limit is
+reached), the ref files are polled every `POLL_SECONDS` instead.
+
+Watched: `HEAD` in the git directory, and `packed-refs`, `refs/heads` and `refs/remotes` in the
+common directory (they're different in linked worktrees). git writes refs to a `.lock` file and
+renames it into place, so the directories containing them are watched rather than the files.
+"""
+
+import ctypes
+import os
+import select
+import struct
+import time
+
+POLL_SECONDS = 0.5
+# Ref changes come in bursts: a commit moves the branch and then HEAD's reflog, a rebase moves HEAD
+# and then the branch. Changes this close to the first one are reported together.
+SETTLE_SECONDS = 0.02
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ONLYDIR = 0x1000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENT_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_EVENT_HEADER = struct.Struct("iIII")
+
+
+class RefWatcher:
+  """Reports which ref files changed since the last call to `wait`
+
+  Args:
+    git_dir: absolute path of the git directory, where HEAD is.
+    common_dir: absolute path of the common git directory, where refs are.
+  """
+
+  def __init__(self, git_dir: str, common_dir: str):
+    self._files = {os.path.join(git_dir, "HEAD"), os.path.join(common_dir, "packed-refs")}
+    self._refs_dir = os.path.join(common_dir, "refs")
+    self._ref_dirs = [
+      os.path.join(self._refs_dir, "heads"),
+      os.path.join(self._refs_dir, "remotes"),
+    ]
+    self._directories: dict[int, str] = {}
+    self._snapshot: dict[str, tuple[int, int, int]] = {}
+
+    try:
+      self._libc = ctypes.CDLL(None, use_errno=True)
+      self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+      if self._fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    except (AttributeError, OSError):
+      # Not Linux
+      self._fd = None
+      self._snapshot = self._stat_ref_files()
+      return
+
+    try:
+      for directory in {git_dir, common_dir, self._refs_dir, *self._ref_dirs}:
+        self._add_watches(directory)
+    except OSError:
+      os.close(self._fd)
+      self._fd = None
+      self._snapshot = self._stat_ref_files()
+
+  @property
+  def method(self) -> str:
+    return "inotify" if self._fd is not None else "polling"
+
+  def close(self) -> None:
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+
+  def wait(self, timeout: float) -> set[str]:
+    """Blocks until refs change or `timeout` seconds pass.
+
+    Returns:
+      The paths of the ref files that changed. Empty if none did before the timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        return set()
+
+      if self._fd is None:
+        time.sleep(min(POLL_SECONDS, remaining))
+        changed = self._poll()
+      elif select.select([self._fd], [], [], remaining)[0]:
+        changed = self._read_events()
+      else:
+        changed = set()
+
+      if changed:
+        time.sleep(SETTLE_SECONDS)
+        changed |= self._poll() if self._fd is None else self._read_events()
+        return changed
+
+  def _is_ref_file(self, path: str) -> bool:
+    if path.endswith(".lock"):
+      return False
+    return path in self._files or any(path.startswith(f"{d}{os.sep}") for d in self._ref_dirs)
+
+  def _is_ref_dir(self, path: str) -> bool:
+    return any(path == d or path.startswith(f"{d}{os.sep}") for d in self._ref_dirs)
+
+  def _add_watches(self, directory: str) -> None:
+    """Watches `directory`, and its subdirectories if it has refs. Missing directories are skipped,
+    they're watched once they're created.
+    """
+    wd = self._libc.inotify_add_watch(self._fd, directory.encode(), IN_EVENT_MASK | IN_ONLYDIR)
+    if wd < 0:
+      errno = ctypes.get_errno()
+      if errno in (2, 20):  # ENOENT, ENOTDIR
+        return
+      raise OSError(errno, f"inotify_add_watch {directory} failed")
+
+    self._directories[wd] = directory
+    if self._is_ref_dir(directory):
+      for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+          self._add_watches(entry.path)
+
+  def _read_events(self) -> set[str]:
+    changed = set()
+    while True:
+      try:
+        data = os.read(self._fd, 65536)
+      except BlockingIOError:
+        return changed
+
+      offset = 0
+      while offset < len(data):
+        wd, mask, _cookie, length = IN_EVENT_HEADER.unpack_from(data, offset)
+        offset += IN_EVENT_HEADER.size
+        name = data[offset : offset + length].rstrip(b"\0").decode(errors="surrogateescape")
+        offset += length
+
+        directory = self._directories.get(wd)
+        if directory is None or not name:
+          continue
+
+        path = os.path.join(directory, name)
+        if mask & IN_ISDIR:
+          if mask & (IN_CREATE | IN_MOVED_TO) and self._is_ref_dir(path):
+            self._add_watches(path)
+            changed |= {p for p in self._stat_ref_files() if p.startswith(f"{path}{os.sep}")}
+        elif self._is_ref_file(path):
+          changed.add(path)
+
+  def _poll(self) -> set[str]:
+    snapshot = self._stat_ref_files()
+    changed = {
+      path
+      for path in snapshot.keys() | self._snapshot.keys()
+      if snapshot.get(path) != self._snapshot.get(path)
+    }
+    self._snapshot = snapshot
+    return changed
+
+  def _stat_ref_files(self) -> dict[str, tuple[int, int, int]]:
+    ret = {}
+    paths = list(self._files)
+    for ref_dir in self._ref_dirs:
+      for dirpath, _dirnames, filenames in os.walk(ref_dir):
+        paths += [os.path.join(dirpath, filename) for filename in filenames]
+
+    for path in filter(self._is_ref_file, paths):
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      ret[path] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    return ret
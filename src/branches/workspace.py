@@ -0,0 +1,186 @@
+"""`branches --workspace`: the branches of many repositories at once.
+
+Every repository given, or found right under a directory given, is shown by `cli.show` in a process
+of its own, with as many processes as cores. Most of the time goes to waiting on git, origin and
+GitHub, so the total is about that of the slowest repository rather than the sum.
+
+Output is printed in the order the repositories were found, each one as soon as it and the ones
+before it are done: a `==> path <==` header followed by what `branches -C path` would print. With
+`--json` a single document holds the document of every repository instead.
+
+The processes share one budget of GitHub requests, `GITHUB_REQUEST_BUDGET`, lowered to what GitHub
+reports is left of the rate limit. Once it's spent PRs aren't fetched and a warning is printed.
+"""
+
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+import traceback
+
+from . import cli
+
+GITHUB_REQUEST_BUDGET = 1000
+
+# Options that depend on a single repository or on the terminal
+INCOMPATIBLE_ARGS = {
+  "path": "-C",
+  "ndjson": "--ndjson",
+  "tui": "--tui",
+  "daemon": "--daemon",
+  "prompt": "--prompt",
+  "watch": "--watch",
+  "install_hooks": "--install-hooks",
+  "uninstall_hooks": "--uninstall-hooks",
+  "refresh_state": "--refresh-state",
+  "operation": "amend",
+}
+
+
+def run(args: argparse.Namespace) -> int:
+  """Shows the branches of every repository in `args.workspace`, and offers to run the update
+  commands of each one in it.
+
+  Returns:
+    int: Exit code (0 for success), the highest of the repositories'.
+  """
+  incompatible = [option for attr, option in INCOMPATIBLE_ARGS.items() if getattr(args, attr)]
+  if incompatible:
+    print(f"--workspace can't be combined with {', '.join(incompatible)}.")
+    return 1
+
+  for path in args.workspace:
+    if not os.path.isdir(path):
+      print(f"Path '{path}' does not exist or is not a directory.")
+      return 1
+
+  paths = repositories(args.workspace)
+  if not paths:
+    print(f"No git repositories found in {', '.join(args.workspace)}.")
+    return 1
+
+  import multiprocessing
+
+  budget = multiprocessing.Value("i", GITHUB_REQUEST_BUDGET)
+  workers = min(len(paths), os.cpu_count() or 1)
+  results = []
+
+  with contextlib.ExitStack() as stack:
+    if workers > 1:
+      from concurrent.futures import ProcessPoolExecutor
+
+      pool = stack.enter_context(
+        ProcessPoolExecutor(workers, initializer=start_worker, initargs=(budget,))
+      )
+      outputs = pool.map(show_repository, paths, [args] * len(paths))
+    else:
+      # A pool of one only adds the cost of starting it
+      start_worker(budget)
+      outputs = map(show_repository, paths, [args] * len(paths))
+
+    for result in outputs:
+      results.append(result)
+      if not args.json:
+        print(f"==> {result['path']} <==")
+        sys.stdout.write(result["stdout"])
+        sys.stdout.flush()
+        sys.stderr.write(result["stderr"])
+
+  if args.json:
+    print_document(results)
+
+  ret = max(result["returncode"] for result in results)
+  for result in results:
+    if result["commands"] and (
+      args.yes
+      or (
+        "PYTEST_CURRENT_TEST" not in os.environ
+        and cli.prompt(f"Run update command in {result['path']}?")
+      )
+    ):
+      ret = max(ret, cli.run_commands(result["commands"], result["path"]))
+
+  return ret
+
+
+def repositories(paths: list[str]) -> list[str]:
+  """Returns `paths` that are git repositories, and the git repositories right under the rest"""
+  ret = []
+  for path in paths:
+    if os.path.exists(os.path.join(path, ".git")):
+      ret.append(path)
+      continue
+
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+      if entry.is_dir() and os.path.exists(os.path.join(entry.path, ".git")):
+        ret.append(os.path.normpath(entry.path))
+
+  return ret
+
+
+def start_worker(budget) -> None:
+  """Sets up a process of the pool: the shared GitHub budget, and a session reused by all the
+  repositories it shows
+  """
+  cli.github_budget = budget
+  if "GITHUB_TOKEN" in os.environ:
+    import requests
+
+    cli.github_session = requests.Session()
+
+
+def show_repository(path: str, args: argparse.Namespace) -> dict:
+  """Runs `cli.show` for the repository at `path`, capturing what it prints.
+
+  Returns:
+    The path, the captured stdout and stderr, the exit code, and the update commands to offer.
+  """
+  from .utils.git_utils import backend
+
+  args = copy.copy(args)
+  args.path = path
+  stdout = io.StringIO()
+  stderr = io.StringIO()
+  commands = []
+
+  with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+    try:
+      git_utils = backend().from_path(path)
+      if git_utils is None:
+        print("Not a git repository.")
+        returncode = 1
+      else:
+        returncode, commands = cli.show(args, git_utils)
+    except Exception:
+      traceback.print_exc()
+      returncode = 1
+
+  return {
+    "path": path,
+    "stdout": stdout.getvalue(),
+    "stderr": stderr.getvalue(),
+    "returncode": returncode,
+    "commands": commands,
+  }
+
+
+def print_document(results: list[dict]) -> None:
+  """Prints the `--json` documents of all the repositories as one. Repositories that failed have
+  an `error` with what they printed instead. Warnings go to stderr, under the repository's header.
+  """
+  records = []
+  for result in results:
+    if result["stderr"]:
+      sys.stderr.write(f"==> {result['path']} <==\n{result['stderr']}")
+
+    record = {"path": result["path"], "returncode": result["returncode"]}
+    if result["returncode"] == 0:
+      record.update(json.loads(result["stdout"]))
+    else:
+      record["error"] = (result["stdout"] or result["stderr"]).strip()
+    records.append(record)
+
+  print(json.dumps({"repositories": records}, indent=2))
@@ -9,11 +9,16 @@ from subprocess import CompletedProcess
 import re
 from datetime import datetime, timezone, timedelta
 import json
+import socket
+import sys
+import time
 from pytest_httpserver.httpserver import HTTPServer
 
 GIT_TMP_DIRPATH_LOCAL = os.path.join(os.path.dirname(__file__), "test_cli_local")
 GIT_TMP_DIRPATH_ORIGIN = os.path.join(os.path.dirname(__file__), "test_cli_origin")
 SRC_DIRPATH = os.path.join(Path(__file__).resolve().parents[2], "src")
+# For the tests that call functions directly instead of running `branches`
+sys.path.insert(0, SRC_DIRPATH)
 
 
 @pytest.fixture(autouse=True)
@@ -1194,6 +1199,237 @@ def test_cli_amend():
   )
 
 
+def test_amend_changes():
+  """
+  Description:
+    Tests which working trees amend finds changes in: none in a clean one, untracked files alone,
+    staged changes alone, and modified files while another git command holds the index lock
+
+  Setup:
+
+      B  <- branch1 (current)
+     /
+    A    <- main
+  """
+  result = run_command(
+    " && ".join(["git init", commit("A"), "git checkout -b branch1", commit("B")])
+  )
+  assert result.returncode == 0, result.stderr
+
+  table = [
+    r"                ",
+    r" Local  Branch  ",
+    r" ────────────── ",
+    r" \w{5}  main    ",
+    r" \w{5}  branch1 ",
+    r"                ",
+  ]
+  amend = [
+    r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+    r"git add -A && git commit --amend --no-edit",
+    r"",
+  ]
+  for prep_command, expected_stdout, expected_returncode in [
+    (None, [*table, r"No changes to amend with.", r""], 1),
+    ("echo new > untracked.txt", [*table, *amend], 0),
+    (
+      "rm untracked.txt && echo changed > B.txt && git add B.txt",
+      [*table, *amend],
+      0,
+    ),
+    # A clean tree is still clean while the index is locked, and changes are still found
+    ("git reset --hard && touch .git/index.lock", [*table, r"No changes to amend with.", r""], 1),
+    ("echo changed > B.txt", [*table, *amend], 0),
+  ]:
+    run_test(
+      prep_command,
+      "branches amend -n --columns local,branch",
+      expected_stdout,
+      expected_returncode,
+    )
+
+  assert os.path.exists(os.path.join(GIT_TMP_DIRPATH_LOCAL, ".git", "index.lock"))
+
+  # Looking for changes never takes the index lock to refresh the index, not even for files whose
+  # modification time changed
+  index_path = os.path.join(GIT_TMP_DIRPATH_LOCAL, ".git", "index")
+  result = run_command("rm .git/index.lock && git reset --hard && sleep 1 && touch B.txt")
+  assert result.returncode == 0, result.stderr
+  index_mtime = os.stat(index_path).st_mtime_ns
+  run_test(
+    None, "branches amend -n --columns local,branch", [*table, r"No changes to amend with.", r""], 1
+  )
+  assert os.stat(index_path).st_mtime_ns == index_mtime
+
+
+def test_amend_siblings():
+  """
+  Description:
+    Tests that branches on top of the current branch are all rebased onto it after an amend, even
+    when they're siblings that share its commits, and that the stacks on top of them are rebased
+    onto them
+
+  Setup:
+
+          E  <- branch4
+         /
+      C-´    <- branch3
+     /
+    | D      <- branch2
+    |/
+    B        <- branch1 (current, with changes)
+   /
+  A          <- main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b branch1",
+        commit("B", now + sec * 2),
+        "git checkout -b branch2",
+        commit("D", now + sec * 3),
+        "git checkout branch1",
+        "git checkout -b branch3",
+        commit("C", now + sec * 4),
+        "git checkout -b branch4",
+        commit("E", now + sec * 5),
+        "git checkout branch1",
+        "echo changed > B.txt",
+      ]
+    ),
+    "branches amend -n --columns local,behind,ahead,branch,base",
+    [
+      r"                              ",
+      r" Local  <- -> Branch  Base    ",
+      r" ──────────────────────────── ",
+      r" \w{5}   0 0  main            ",
+      r" \w{5}   0 1  branch1         ",
+      r" \w{5}   0 2  branch2 branch1 ",
+      r" \w{5}   0 2  branch3 branch1 ",
+      r" \w{5}   0 3  branch4 branch3 ",
+      r"                              ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git add -A && git commit --amend --no-edit && \\",
+      r"git checkout branch2 && git rebase --onto branch1 branch2~1 && \\",
+      r"git checkout branch3 && git rebase --onto branch1 branch3~1 && \\",
+      r"git checkout branch4 && git rebase --onto branch3 branch4~1 && \\",
+      r"git checkout branch1",
+      r"",
+    ],
+  )
+
+
+def test_amend_merge_commits():
+  """
+  Description:
+    Tests that a branch that merged the current branch, whose first parents don't go through it,
+    is left out of the short list, so an amend plans no rebase for it. A db with every branch finds
+    it on top of the current branch anyway, and refuses to amend because of the merge.
+
+  Setup:
+
+      C---M  <- branch2
+     /   /
+    A---B    <- main (A), branch1 (B, current, with changes)
+  """
+  from branches.cli import create_db, generate_amend_commands
+  from branches.utils.git_utils import backend
+
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b branch1",
+        commit("B", now + sec * 2),
+        "git checkout -b branch2 main",
+        commit("C", now + sec * 3),
+        "git merge --no-edit branch1",
+        "git checkout branch1",
+        "echo changed > B.txt",
+      ]
+    ),
+    "branches amend -n --columns local,behind,ahead,branch,base",
+    [
+      r"                           ",
+      r" Local  <- -> Branch  Base ",
+      r" ───────────────────────── ",
+      r" \w{5}   0 0  main         ",
+      r" \w{5}   0 1  branch1      ",
+      r"                           ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git add -A && git commit --amend --no-edit",
+      r"",
+    ],
+  )
+
+  git_utils = backend().from_path(GIT_TMP_DIRPATH_LOCAL)
+  db = create_db(git_utils, load_remote=False)
+  assert db.local["branch2"].has_merge_commits
+  assert generate_amend_commands(db, git_utils) == (
+    "Tool limitation: cannot amend or update branches with merge commits.",
+    None,
+  )
+
+
+def test_amend_integration_branch():
+  """
+  Description:
+    Tests amending an integration branch, which has no commits ahead of the default branch for the
+    branches on top of it to share: the db is loaded again from the current branch, and the stack
+    on top of it is rebased onto it
+
+  Setup:
+
+        B---C  <- branch1 (B), branch2 (C)
+       /
+      R        <- release/1 (current, with changes)
+     /
+    A          <- main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b release/1",
+        commit("R", now + sec * 2),
+        "git checkout -b branch1",
+        commit("B", now + sec * 3),
+        "git checkout -b branch2",
+        commit("C", now + sec * 4),
+        "git checkout release/1",
+        "echo changed > R.txt",
+      ]
+    ),
+    "branches amend -n --integration 'release/*' --columns local,behind,ahead,branch,base",
+    [
+      r"                                  ",
+      r" Local  <- -> Branch    Base      ",
+      r" ──────────────────────────────── ",
+      r" \w{5}   0 0  main                ",
+      r" \w{5}   0 1  release/1           ",
+      r" \w{5}   0 1  branch1   release/1 ",
+      r" \w{5}   0 2  branch2   branch1   ",
+      r"                                  ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git add -A && git commit --amend --no-edit && \\",
+      r"git checkout branch1 && git rebase --onto release/1 branch1~1 && \\",
+      r"git checkout branch2 && git rebase --onto branch1 branch2~1 && \\",
+      r"git checkout release/1",
+      r"",
+    ],
+  )
+
+
 def test_subdir():
   #     D     <- branch2
   #    /
@@ -1939,3 +2175,1400 @@ def test_path_argument():
     expected_returncode=0,
     directory=os.environ["HOME"],
   )
+
+
+def test_branch_filters():
+  """
+  Description:
+    Tests the --include, --exclude, --max-age and --mine branch filters
+
+  Setup:
+
+      F      <- other (authored by someone else)
+     /
+    | E      <- stale (authored 30 days ago)
+    |/
+    | D      <- wip/two
+    |/
+    | C      <- feature/one
+    |/
+    A        <- *main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b feature/one main",
+        commit("C", now + sec * 2),
+        "git checkout -b wip/two main",
+        commit("D", now + sec * 3),
+        "git checkout -b stale main",
+        commit("E", now - timedelta(days=30)),
+        "git checkout -b other main",
+        commit("F", now + sec * 4, "Someone Else <someone.else@example.com>"),
+        "git checkout main",
+      ]
+    ),
+    "branches --include 'feature/*' --include 'wip/*'",
+    [
+      r"                                               ",
+      r" Origin - Local  Age <- -> Branch      Base PR ",
+      r" ───────────────────────────────────────────── ",
+      r"          \w{5}    0  0 0  main                ",
+      r"          \w{5}    0  0 1  wip/two             ",
+      r"          \w{5}    0  0 1  feature/one         ",
+      r"                                               ",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches --exclude 'wip/*' --max-age 10",
+    [
+      r"                                               ",
+      r" Origin - Local  Age <- -> Branch      Base PR ",
+      r" ───────────────────────────────────────────── ",
+      r"          \w{5}    0  0 0  main                ",
+      r"          \w{5}!   0  0 1  other               ",
+      r"          \w{5}    0  0 1  feature/one         ",
+      r"                                               ",
+    ],
+  )
+
+  run_test(
+    "git checkout wip/two",
+    "branches --mine --exclude 'wip/*'",
+    [
+      r"                                               ",
+      r" Origin - Local  Age <- -> Branch      Base PR ",
+      r" ───────────────────────────────────────────── ",
+      r"          \w{5}    0  0 0  main                ",
+      r"          \w{5}    0  0 1  wip/two             ",
+      r"          \w{5}    0  0 1  feature/one         ",
+      r"          \w{5}   30  0 1  stale               ",
+      r"                                               ",
+    ],
+  )
+
+  # --include patterns match the whole name like --exclude ones: no branches under a plain name,
+  # and * matches / too
+  run_test(
+    "git checkout main",
+    "branches --include feature --exclude '*two'",
+    [
+      r"                                          ",
+      r" Origin - Local  Age <- -> Branch Base PR ",
+      r" ──────────────────────────────────────── ",
+      r"          \w{5}    0  0 0  main           ",
+      r"                                          ",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches --include '*one'",
+    [
+      r"                                               ",
+      r" Origin - Local  Age <- -> Branch      Base PR ",
+      r" ───────────────────────────────────────────── ",
+      r"          \w{5}    0  0 0  main                ",
+      r"          \w{5}    0  0 1  feature/one         ",
+      r"                                               ",
+    ],
+  )
+
+  run_test(None, "branches --max-age -1", [], 2)
+
+
+def test_integration_branches():
+  """
+  Description:
+    Tests that branches cut from integration branches are compared to and rebased onto the nearest
+    one, and that integration branches are not rebased
+
+  Setup:
+
+          G    <- feature2
+         /
+        F      <- feature
+       /
+      D1---D2  <- develop
+     /
+    | R1---X   <- release/1 (R1), fix (X)
+    |/
+    A---B      <- *main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b develop",
+        commit("D1", now + sec * 2, "Someone Else <someone.else@example.com>"),
+        "git checkout -b feature",
+        commit("F", now + sec * 3),
+        "git checkout -b feature2",
+        commit("G", now + sec * 4),
+        "git checkout develop",
+        commit("D2", now + sec * 5, "Someone Else <someone.else@example.com>"),
+        "git checkout -b release/1 main",
+        commit("R1", now + sec * 6, "Someone Else <someone.else@example.com>"),
+        "git checkout -b fix",
+        commit("X", now + sec * 7),
+        "git checkout main",
+        commit("B", now + sec * 8),
+        "git config --add branches.integration develop",
+        "git config --add branches.integration 'release/*'",
+      ]
+    ),
+    "branches --columns local,behind,ahead,branch,base",
+    [
+      r"                                  ",
+      r" Local  <- -> Branch    Base      ",
+      r" ──────────────────────────────── ",
+      r" \w{5}   0 0  main                ",
+      r" \w{5}   0 1  fix       release/1 ",
+      r" \w{5}   1 1  release/1           ",
+      r" \w{5}   1 2  develop             ",
+      r" \w{5}   1 2  feature2  feature   ",
+      r" \w{5}   1 1  feature   develop~1 ",
+      r"                                  ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git checkout feature && git rebase develop && \\",
+      r"git checkout feature2 && git rebase --onto feature feature2~1 && \\",
+      r"git checkout main",
+      r"",
+    ],
+  )
+
+  # --integration replaces the git config
+  result = run_command(
+    f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json --integration develop"
+  )
+  assert result.returncode == 0, result.stderr
+  records = {record["name"]: record for record in json.loads(result.stdout)["branches"]}
+  assert records["feature"]["integration"] == "develop"
+  assert (records["feature"]["behind"], records["feature"]["ahead"]) == (1, 1)
+  assert records["feature"]["other_authors"] == []
+  assert records["develop"]["integration"] == "main"
+  assert records["fix"]["integration"] == "main"
+  assert (records["fix"]["base"], records["fix"]["behind"]) == ("release/1", 1)
+  assert records["main"]["integration"] is None
+
+  # The short list of an integration branch has the branches on top of it
+  run_test(
+    "git checkout release/1",
+    "branches -s -q --columns local,behind,ahead,branch,base",
+    [
+      r"                                  ",
+      r" Local  <- -> Branch    Base      ",
+      r" ──────────────────────────────── ",
+      r" \w{5}   0 0  main                ",
+      r" \w{5}   1 1  release/1           ",
+      r" \w{5}   0 1  fix       release/1 ",
+      r"                                  ",
+    ],
+  )
+
+  # But the short list of those doesn't have the integration branch
+  run_test(
+    "git checkout fix",
+    "branches -s -q --columns local,behind,ahead,branch,base",
+    [
+      r"                               ",
+      r" Local  <- -> Branch Base      ",
+      r" ───────────────────────────── ",
+      r" \w{5}   0 0  main             ",
+      r" \w{5}   0 1  fix    release/1 ",
+      r"                               ",
+    ],
+  )
+
+
+def test_check_conflicts():
+  """
+  Description:
+    Tests that --check-conflicts replays the planned rebases without touching the working tree, and
+    reports which ones conflict
+
+  Setup:
+
+      D---E   <- branch3 (D), branch4 (E)
+     /
+    | B---C   <- branch1 (B changes f.txt like M), branch2 (C)
+    |/
+    A---M     <- *main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  run_test(
+    " && ".join(
+      [
+        "git init",
+        "printf '1\\n2\\n3\\n' > f.txt",
+        commit("A", now + sec * 1),
+        "git checkout -b branch1",
+        "printf '1\\nB\\n3\\n' > f.txt",
+        commit("B", now + sec * 2),
+        "git checkout -b branch2",
+        commit("C", now + sec * 3),
+        "git checkout -b branch3 main",
+        commit("D", now + sec * 4),
+        "git checkout -b branch4",
+        commit("E", now + sec * 5),
+        "git checkout main",
+        "printf '1\\nM\\n3\\n' > f.txt",
+        commit("M", now + sec * 6),
+      ]
+    ),
+    "branches --check-conflicts --columns local,behind,ahead,branch,base",
+    [
+      r"                              ",
+      r" Local  <- -> Branch  Base    ",
+      r" ──────────────────────────── ",
+      r" \w{5}   0 0  main            ",
+      r" \w{5}   1 2  branch4 branch3 ",
+      r" \w{5}   1 1  branch3         ",
+      r" \w{5}   1 2  branch2 branch1 ",
+      r" \w{5}   1 1  branch1         ",
+      r"                              ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git checkout branch1 && git rebase main && \\",
+      r"git checkout branch2 && git rebase --onto branch1 branch2~1 && \\",
+      r"git checkout branch3 && git rebase main && \\",
+      r"git checkout branch4 && git rebase --onto branch3 branch4~1 && \\",
+      r"git checkout main",
+      r"",
+      r"Conflict check:",
+      r"  branch1: conflicts in f\.txt when applying \w{5}",
+      r"  branch2: unknown, branch1 can't be replayed",
+      r"  branch3: clean",
+      r"  branch4: clean",
+      r"",
+    ],
+  )
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json --check-conflicts")
+  assert result.returncode == 0, result.stderr
+  checks = {check["branch"]: check for check in json.loads(result.stdout)["conflict_checks"]}
+  assert checks["branch1"]["status"] == "conflict"
+  assert checks["branch1"]["paths"] == ["f.txt"]
+  assert checks["branch1"]["sha"] == run_command("git rev-parse branch1").stdout.strip()
+  assert checks["branch2"]["status"] == "unknown"
+  assert (checks["branch3"]["status"], checks["branch4"]["status"]) == ("clean", "clean")
+  assert checks["branch4"]["onto"] == "branch3"
+
+  # Nothing was checked out or rebased
+  assert run_command("git status --porcelain").stdout == ""
+  assert run_command("git branch --show-current").stdout.strip() == "main"
+  assert run_command("git rev-parse branch3~1").stdout != run_command("git rev-parse main").stdout
+
+
+def test_columns():
+  """
+  Description:
+    Tests the --columns argument, and that the update commands that need data from hidden columns
+    are not suggested
+
+  Setup:
+
+      C    <- branch1
+     /
+    A---B  <- main, origin/main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  run_test(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A", now + sec * 1),
+        "git push",
+        "git checkout -b branch1",
+        commit("C", now + sec * 2),
+        "git push",
+        "git checkout main",
+        commit("B", now + sec * 3),
+        "git push",
+      ]
+    ),
+    "branches --columns origin,behind,ahead,base",
+    [
+      r"                           ",
+      r" Origin <- -> Branch  Base ",
+      r" ───────────────────────── ",
+      r"  \w{5}  0 0  main         ",
+      r"  \w{5}  1 1  branch1      ",
+      r"                           ",
+      r"NOTE: PR is not displayed, so delete commands for merged branches can't be suggested.",
+      r"git checkout branch1 && git rebase main && git push -f && \\",
+      r"git checkout main",
+      r"",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches --columns local,behind,ahead -n",
+    [
+      r"                      ",
+      r" Local  <- -> Branch  ",
+      r" ──────────────────── ",
+      r" \w{5}   0 0  main    ",
+      r" \w{5}   1 1  branch1 ",
+      r"                      ",
+      r"NOTE: Origin is not displayed, so pull, push and delete commands can't be suggested.",
+      r"git checkout branch1 && git rebase main && \\",
+      r"git checkout main",
+      r"",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches --columns local,unknown",
+    [],
+    expected_returncode=2,
+  )
+
+
+def test_json_output():
+  """
+  Description:
+    Tests --json and --ndjson. Stdout must be valid JSON with the state of every branch and the
+    update commands, which are not run.
+
+  Setup:
+
+        D     <- branch2
+       /
+      C       <- branch1, origin/branch1
+     /
+    A---B     <- main, origin/main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  result = run_command(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A", now + sec * 1),
+        "git push",
+        "git checkout -b branch1",
+        commit("C", now + sec * 2),
+        "git push",
+        "git checkout -b branch2",
+        commit("D", now + sec * 3),
+        "git checkout main",
+        commit("B", now + sec * 4),
+        "git push",
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json -y")
+  assert result.returncode == 0, result.stderr
+  document = json.loads(result.stdout)
+  assert document["default"] == "main"
+  assert document["current"] == "main"
+  assert [branch["name"] for branch in document["branches"]] == ["main", "branch2", "branch1"]
+
+  main, branch2, branch1 = document["branches"]
+  assert main["default"] and main["current"] and main["base"] is None
+  assert main["remote"]["relationship"] == "="
+  assert (branch1["behind"], branch1["ahead"], branch1["base"]) == (1, 1, None)
+  assert branch1["remote"]["sha"] == branch1["sha"]
+  assert (branch2["behind"], branch2["ahead"], branch2["base"]) == (1, 2, "branch1")
+  assert (branch2["base_behind"], branch2["base_ahead"]) == (0, 1)
+  assert branch2["remote"] is None
+  assert branch2["pr"] is None
+  assert document["commands"] == [
+    "git checkout branch1 && git rebase main && git push -f",
+    "git checkout branch2 && git rebase --onto branch1 branch2~1",
+    "git checkout main",
+  ]
+
+  # -y is ignored, nothing was rebased
+  assert run_command("git rev-parse branch1~1").stdout != run_command("git rev-parse main").stdout
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --ndjson --columns local")
+  assert result.returncode == 0, result.stderr
+  records = [json.loads(line) for line in result.stdout.splitlines()]
+  assert [record["type"] for record in records] == [
+    "repository",
+    "branch",
+    "branch",
+    "branch",
+    "commands",
+  ]
+  assert records[0]["remote_loaded"] is False
+  assert records[3]["name"] == "branch1"
+  assert records[3]["remote"] is None
+  assert records[-1]["commands"][0] == "git checkout branch1 && git rebase main"
+  assert records[-1]["notes"] == [
+    "Origin is not displayed, so pull, push and delete commands can't be suggested."
+  ]
+
+
+def test_max_authors():
+  """
+  Description:
+    Tests that --max-authors limits the other authors listed per branch, and that tables still mark
+    branches with other authors.
+
+  Setup:
+
+      C---D---E <- branch1 (C, D and E by other authors), origin/branch1 at D
+     /
+    A           <- main, origin/main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+
+  result = run_command(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A", now + sec * 1),
+        "git push",
+        "git checkout -b branch1",
+        commit("C", now + sec * 2, "C <c@git.com>"),
+        commit("D", now + sec * 3, "D <d@git.com>"),
+        "git push",
+        commit("E", now + sec * 4, "E <e@git.com>"),
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json")
+  assert result.returncode == 0, result.stderr
+  branch1 = json.loads(result.stdout)["branches"][1]
+  assert branch1["other_authors"] == ["c@git.com", "d@git.com", "e@git.com"]
+  assert branch1["remote"]["other_authors"] == ["c@git.com", "d@git.com"]
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json --max-authors 1")
+  assert result.returncode == 0, result.stderr
+  branch1 = json.loads(result.stdout)["branches"][1]
+  assert len(branch1["other_authors"]) == 1
+  assert set(branch1["other_authors"]) <= {"c@git.com", "d@git.com", "e@git.com"}
+  assert len(branch1["remote"]["other_authors"]) == 1
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --max-authors 0")
+  assert result.returncode == 2
+
+  run_test(
+    None,
+    "branches",
+    [
+      r"                                           ",
+      r" Origin - Local  Age <- -> Branch  Base PR ",
+      r" ───────────────────────────────────────── ",
+      r"  \w{5}   \w{5}    0  0 0  main            ",
+      r" !\w{5} < \w{5}!   0  0 3  branch1         ",
+      r"                                           ",
+    ],
+  )
+
+
+def test_renderers():
+  """
+  Description:
+    Tests that --rich and the plain renderer, which is used when stdout is not a terminal, print the
+    same table, and the --tsv renderer
+
+  Setup:
+
+      C    <- branch1
+     /
+    A---B  <- main, origin/main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  run_test(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A", now + sec * 1),
+        "git push",
+        "git checkout -b branch1",
+        commit("C", now + sec * 2),
+        "git checkout main",
+        commit("B", now + sec * 3),
+        "git push",
+      ]
+    ),
+    "branches --rich -q",
+    [
+      r"                                           ",
+      r" Origin - Local  Age <- -> Branch  Base PR ",
+      r" ───────────────────────────────────────── ",
+      r"  \w{5}   \w{5}    0  0 0  main            ",
+      r"          \w{5}    0  1 1  branch1         ",
+      r"                                           ",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches -q",
+    [
+      r"                                           ",
+      r" Origin - Local  Age <- -> Branch  Base PR ",
+      r" ───────────────────────────────────────── ",
+      r"  \w{5}   \w{5}    0  0 0  main            ",
+      r"          \w{5}    0  1 1  branch1         ",
+      r"                                           ",
+    ],
+  )
+
+  run_test(
+    None,
+    "branches --tsv --columns origin,local,behind,ahead,base",
+    [
+      r"origin\tlocal\tbehind\tahead\tbranch\tbase",
+      r"\w{5}\t\w{5}\t0\t0\tmain\t",
+      r"\t\w{5}\t1\t1\tbranch1\t",
+      r"NOTE: PR is not displayed, so delete commands for merged branches can't be suggested.",
+      r"git checkout branch1 && git rebase main && \\",
+      r"git checkout main",
+      r"",
+    ],
+  )
+
+
+def test_tui_needs_terminal():
+  run_test(
+    "git init && " + commit("A"),
+    "branches --tui",
+    [
+      r"--tui needs stdout to be a terminal.",
+    ],
+    expected_returncode=1,
+  )
+
+
+def test_tui_view():
+  """
+  Description:
+    Tests the state of the interactive view without a terminal: moving the selection keeps it on
+    the screen and within the branches, the filter narrows the branches down, and rows are loaded
+    selected first, then in screen order
+  """
+  from branches.render import Segment
+  from branches.tui import BranchesView
+
+  loaded = []
+
+  def load_row(branch: str) -> dict:
+    loaded.append(branch)
+    return {"branch": (Segment(f"{branch} loaded"),)}
+
+  view = BranchesView(
+    [f"branch{idx}" for idx in range(10)],
+    {"branch": {"column_name": "Branch", "column_props": None}},
+    quick_row=lambda branch: {"branch": (Segment(branch),)},
+    load_row=load_row,
+  )
+  height = 3
+
+  # Only the rows that fit on the screen are visible
+  assert view.visible(height) == ["branch0", "branch1", "branch2"]
+  assert view.selected_branch() == "branch0"
+
+  view.move(4, height)
+  assert (view.selected, view.top) == (4, 2)
+  assert view.visible(height) == ["branch2", "branch3", "branch4"]
+
+  view.move(-3, height)
+  assert (view.selected, view.top) == (1, 1)
+
+  # Page moves past the ends stop at the first and last branches
+  view.move(100, height)
+  assert (view.selected, view.top) == (9, 7)
+  assert view.visible(height) == ["branch7", "branch8", "branch9"]
+  view.move(-100, height)
+  assert (view.selected, view.top) == (0, 0)
+
+  # The selected branch first, then the rest of the screen
+  view.move(1, height)
+  while (branch := view.next_to_load(height)) is not None:
+    view.load(branch)
+  assert loaded == ["branch1", "branch0", "branch2"]
+  assert view.row("branch1") == [(Segment("branch1 loaded"),)]
+  assert view.row("branch5") == [(Segment("branch5"),)]
+  assert view.widths == [len("branch1 loaded")]
+
+  # The selection is kept while it matches the filter
+  view.set_filter("1", height)
+  assert view.matches == ["branch1"]
+  assert view.selected_branch() == "branch1"
+
+  view.set_filter("", height)
+  assert len(view.matches) == 10
+  assert (view.selected, view.top) == (1, 0)
+
+  view.move(8, height)
+  view.set_filter("BRANCH", height)
+  assert view.selected_branch() == "branch9"
+  assert view.visible(height) == ["branch7", "branch8", "branch9"]
+
+  # Otherwise it goes back to the first match
+  view.set_filter("3", height)
+  assert view.matches == ["branch3"]
+  assert (view.selected, view.top) == (0, 0)
+  assert view.next_to_load(height) == "branch3"
+
+  view.set_filter("nothing", height)
+  assert view.matches == []
+  assert view.selected_branch() is None
+  assert view.visible(height) == []
+  assert view.next_to_load(height) is None
+
+
+def test_rebase_order():
+  """
+  Description:
+    Tests that base branches come before the branches based on them, that cycles of base branches
+    are reported, and that stacks deeper than Python's recursion limit are ordered
+  """
+  from branches.cli import BaseBranchCycleError, rebase_order
+
+  assert rebase_order({"b3": ("b2", 0, 1), "b2": ("main", 0, 1), "b1": ("main", 0, 1)}) == [
+    "main",
+    "b2",
+    "b3",
+    "b1",
+  ]
+
+  for base_branches, cycle in [
+    ({"b1": ("b2", 0, 1), "b2": ("b1", 0, 1)}, "b1 -> b2 -> b1"),
+    (
+      {"b1": ("main", 0, 1), "b2": ("b3", 0, 1), "b3": ("b4", 0, 1), "b4": ("b2", 0, 1)},
+      "b2 -> b3 -> b4 -> b2",
+    ),
+  ]:
+    with pytest.raises(BaseBranchCycleError, match=f"cycle: {cycle}$"):
+      rebase_order(base_branches)
+
+  depth = sys.getrecursionlimit() + 500
+  base_branches = {f"b{idx}": (f"b{idx - 1}" if idx else "main", 0, 1) for idx in range(depth)}
+  # The tip of the stack first
+  base_branches = dict(reversed(base_branches.items()))
+  assert rebase_order(base_branches) == ["main", *(f"b{idx}" for idx in range(depth))]
+
+
+def test_commit_store():
+  """
+  Description:
+    Tests the chains, depths, fork points, authors and merge flags of the commits in a CommitStore
+
+  Setup:
+
+      C    <- b2
+     /
+    | B    <- b1 (B by another author)
+    |/
+    A   E  <- b3
+    |   |
+    |   D  <- merge of O
+    |  /
+    M-´    <- main
+  """
+  from branches.db import CommitStore
+
+  commits = CommitStore()
+  commits.add("A", ["M"], "me", "me")
+  commits.add("B", ["A"], "other", "me")
+  commits.add("C", ["A"], "me", "me")
+  commits.add("D", ["M", "O"], "me", "me")
+  commits.add("E", ["D"], "me", "me")
+  idx = commits.indexes
+
+  assert len(commits) == 5
+  assert commits.chain_shas(idx["B"]) == ["A", "B"]
+  assert commits.chain_shas(idx["C"]) == ["A", "C"]
+  assert commits.chain_shas(-1) == []
+  assert [commits.depths[idx[sha]] for sha in "ABCDE"] == [1, 2, 2, 1, 2]
+  assert [commits.fork_points[idx[sha]] for sha in "ABCDE"] == ["M"] * 5
+  # Commits keep the other authors of the commits below them, not of their siblings
+  assert [commits.other_authors[idx[sha]] for sha in "ABC"] == [set(), {"other"}, set()]
+  # A merge commit flags every commit on top of it
+  assert [commits.has_merges[idx[sha]] for sha in "ABCDE"] == [False, False, False, True, True]
+
+  commits = CommitStore(authors_limit=1)
+  commits.add("A", ["M"], "other1", "me")
+  commits.add("B", ["A"], "other2", "me")
+  assert commits.other_authors[commits.indexes["B"]] == {"other1"}
+
+
+def test_base_branches_from_commits():
+  """
+  Description:
+    Tests that each branch is based on the shortest branch sharing its commits, with ties broken by
+    name, the offset from the base's tip when it forks below it, and branches that own all their
+    commits left out
+
+  Setup:
+
+      D    <- b2
+     /
+    | E    <- b3
+    | |
+    C |    <- b1, b1b
+    |/
+    B      <- b0
+    |
+    A
+    |
+    |   G  <- u2
+    |  /
+    | F    <- u1
+    |/
+    M      <- main
+  """
+  from branches.db import CommitStore, base_branches_from_commits
+
+  commits = CommitStore()
+  for sha, parent in [("A", "M"), ("B", "A"), ("C", "B"), ("D", "C"), ("E", "B")]:
+    commits.add(sha, [parent], None, None)
+  commits.add("F", ["M"], None, None)
+  commits.add("G", ["F"], None, None)
+  branch_shas = {"b0": "B", "b1": "C", "b1b": "C", "b2": "D", "b3": "E", "u1": "F", "u2": "G"}
+  tips = {branch: commits.indexes[sha] for branch, sha in branch_shas.items()}
+
+  assert base_branches_from_commits(commits, tips) == {
+    "b1": ("b0", 0, 1),
+    # Same tip as b1, which wins by name
+    "b1b": ("b1", 0, 0),
+    "b2": ("b1", 0, 1),
+    "b3": ("b0", 0, 1),
+    "u2": ("u1", 0, 1),
+  }
+
+  # Without b0, b3 forks one commit below the tip of b1
+  del tips["b0"]
+  assert base_branches_from_commits(commits, tips) == {
+    "b1b": ("b1", 0, 0),
+    "b2": ("b1", 0, 1),
+    "b3": ("b1", 1, 1),
+    "u2": ("u1", 0, 1),
+  }
+
+
+def test_connected_branches():
+  """
+  Description:
+    Tests that --short only keeps the default branch and the stack of the current branch, leaving
+    out unrelated stacks, branches with merge commits and branches with nothing ahead of the default
+    branch, unless they're current
+
+  Setup:
+
+      C    <- b2
+     /
+    | D    <- b3
+    | |
+    B |    <- b1
+    |/
+    A   G  <- u2
+    |   |
+    |   F  <- u1
+    |  /
+    | | H  <- mg (merge of O)
+    | |/
+    M-´    <- main, e
+  """
+  from branches.cli import connected_branches
+  from branches.db import CommitStore
+
+  commits = CommitStore()
+  for sha, parent in [("A", "M"), ("B", "A"), ("C", "B"), ("D", "A"), ("F", "M"), ("G", "F")]:
+    commits.add(sha, [parent], None, None)
+  commits.add("H", ["M", "O"], None, None)
+  branch_shas = {"main": "M", "b1": "B", "b2": "C", "b3": "D", "u1": "F", "u2": "G", "mg": "H"}
+  branch_shas["e"] = "M"
+  branches = list(branch_shas)
+
+  for current, expected in [
+    ("b2", ["main", "b2", "b1", "b3"]),
+    ("b1", ["main", "b1", "b2", "b3"]),
+    ("u1", ["main", "u1", "u2"]),
+    ("mg", ["main", "mg"]),
+    # The stacks fork from the tip of e, but it's also the tip of main
+    ("e", ["main", "e"]),
+    ("main", ["main"]),
+  ]:
+    assert connected_branches(commits, branches, branch_shas, "main", current) == expected, current
+
+
+def test_lazy_imports():
+  """
+  Description:
+    Tests that GitPython is never imported, that --version, and --json and --plain without a
+    GITHUB_TOKEN, don't import requests or rich, and that --prompt doesn't even import the CLI.
+    benchmarks/bench_startup.py checks the same modules along with startup times.
+  """
+  result = run_command("git init && " + commit("A"))
+  assert result.returncode == 0, result.stderr
+
+  for arguments, forbidden_modules in [
+    ("--version", {"git", "requests", "rich"}),
+    ("--json", {"git", "requests", "rich"}),
+    ("--plain", {"git", "requests", "rich"}),
+    ("--prompt", {"argparse", "git", "json", "re", "requests", "rich", "subprocess"}),
+  ]:
+    result = run_command(
+      f"env -u GITHUB_TOKEN PYTHONPATH='{SRC_DIRPATH}' python -X importtime -m branches {arguments}"
+    )
+    assert result.returncode == 0, result.stderr
+
+    imported = set()
+    for line in result.stderr.splitlines():
+      if line.startswith("import time:"):
+        imported.add(line.split("|")[-1].strip().split(".")[0])
+
+    assert not imported & forbidden_modules, arguments
+
+
+def test_daemon(httpserver: HTTPServer, monkeypatch: pytest.MonkeyPatch):
+  """
+  Description:
+    Tests that invocations are answered by a running `branches --daemon`, that repeated ones reuse
+    its output, that its output is recomputed once refs change, and that invocations run with the
+    client's GitHub token and get their own output for it.
+
+  Setup:
+
+      C    <- branch1
+     /
+    A---B  <- main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  result = run_command(
+    " && ".join(
+      [
+        "git init",
+        f"git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A", now + sec * 1),
+        "git checkout -b branch1",
+        commit("C", now + sec * 2),
+        "git checkout main",
+        commit("B", now + sec * 3),
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  daemon = subprocess.Popen(
+    ["python", "-m", "branches", "--daemon"],
+    cwd=GIT_TMP_DIRPATH_LOCAL,
+    env={**os.environ, "PYTHONPATH": SRC_DIRPATH},
+    stdout=subprocess.PIPE,
+    text=True,
+  )
+  try:
+    serving = daemon.stdout.readline()
+    assert serving.startswith("Serving ")
+    socket_path = serving.split(" on ")[-1].strip()
+
+    for _ in range(2):
+      run_test(
+        None,
+        "branches -q --columns local,behind,ahead",
+        [
+          r"                      ",
+          r" Local  <- -> Branch  ",
+          r" ──────────────────── ",
+          r" \w{5}   0 0  main    ",
+          r" \w{5}   1 1  branch1 ",
+          r"                      ",
+        ],
+      )
+
+    run_test(
+      commit("D", now + sec * 4),
+      "branches -q --columns local,behind,ahead",
+      [
+        r"                      ",
+        r" Local  <- -> Branch  ",
+        r" ──────────────────── ",
+        r" \w{5}   0 0  main    ",
+        r" \w{5}   2 1  branch1 ",
+        r"                      ",
+      ],
+    )
+
+    # Rendered with rich for clients whose stdout is a terminal
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+      connection.connect(socket_path)
+      request = {"argv": ["-q", "--columns", "branch"], "isatty": True, "columns": 40}
+      connection.sendall(json.dumps(request).encode())
+      connection.shutdown(socket.SHUT_WR)
+      response = json.loads(connection.makefile().read())
+    assert "\x1b[" in response["stdout"]
+
+    # The daemon has no GITHUB_TOKEN, the client's is used
+    set_mockserver_expectations(
+      httpserver,
+      [
+        ("main", []),
+        (
+          "branch1",
+          [
+            {
+              "number": 123,
+              "title": "Fix thing",
+              "head": {"sha": "5259dcf3e0e9b774689f5fb761e07d25f6683fd5"},
+              "html_url": "http://localhost/branches/test_cli_origin/pull/123",
+              "user": {"login": "santi-h"},
+            }
+          ],
+        ),
+      ],
+    )
+    for _ in range(2):
+      run_test(
+        None,
+        "branches -q --columns branch,pr",
+        [
+          r"                                 ",
+          r" Branch  PR                      ",
+          r" ─────────────────────────────── ",
+          r" main                            ",
+          r" branch1 #123 \(5259d\) by santi-h ",
+          r"                                 ",
+        ],
+        httpserver=httpserver,
+      )
+
+    # Without the token, the pull requests aren't shown
+    run_test(
+      None,
+      "branches -q --columns branch,pr",
+      [
+        r"            ",
+        r" Branch  PR ",
+        r" ────────── ",
+        r" main       ",
+        r" branch1    ",
+        r"            ",
+      ],
+    )
+
+    # Combined with other short options, -v still isn't sent to the daemon
+    run_test(None, "branches -qv", [r"\d+\.\d+\.\d+"])
+
+    # Not answered by a daemon whose socket other users can connect to
+    os.chmod(socket_path, 0o777)
+    run_test(
+      None,
+      "branches -q --columns local,behind,ahead",
+      [
+        r"                      ",
+        r" Local  <- -> Branch  ",
+        r" ──────────────────── ",
+        r" \w{5}   0 0  main    ",
+        r" \w{5}   2 1  branch1 ",
+        r"                      ",
+      ],
+    )
+  finally:
+    daemon.terminate()
+    output, _ = daemon.communicate(timeout=10)
+
+  assert [line.split()[1] for line in output.splitlines()] == [
+    "ran",
+    "cached",
+    "ran",
+    "ran",
+    "ran",
+    "cached",
+    "ran",
+  ]
+
+  # Outputs go stale when the pull requests they may show are due to be fetched again
+  from branches import cli, daemon
+
+  monkeypatch.setattr(cli, "github_session", None)
+  monkeypatch.setattr(cli, "pull_request_cache", None)
+  local_daemon = daemon.Daemon(GIT_TMP_DIRPATH_LOCAL)
+  assert local_daemon._expires_at() - time.monotonic() > daemon.OUTPUT_CACHE_SECONDS - 1
+  fetched_at = time.monotonic() - cli.PULL_REQUEST_CACHE_SECONDS + 5
+  cli.pull_request_cache["branch1"] = (fetched_at, None)
+  assert local_daemon._expires_at() == fetched_at + cli.PULL_REQUEST_CACHE_SECONDS
+
+
+def test_watch():
+  """
+  Description:
+    Tests that --watch prints the table again when a branch moves
+
+  Setup:
+
+      C    <- branch1
+     /
+    A---B  <- main
+  """
+  now = datetime.now(timezone.utc) - timedelta(hours=6)
+  sec = timedelta(seconds=1)
+  result = run_command(
+    " && ".join(
+      [
+        "git init",
+        commit("A", now + sec * 1),
+        "git checkout -b branch1",
+        commit("C", now + sec * 2),
+        "git checkout main",
+        commit("B", now + sec * 3),
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  watcher = subprocess.Popen(
+    ["python", "-m", "branches", "--watch", "-q", "--columns", "local,behind,ahead"],
+    cwd=GIT_TMP_DIRPATH_LOCAL,
+    env={**os.environ, "PYTHONPATH": SRC_DIRPATH},
+    stdout=subprocess.PIPE,
+    text=True,
+  )
+
+  def read_frame() -> list[str]:
+    lines = []
+    while not (line := watcher.stdout.readline()).startswith("Watching refs"):
+      assert line, "--watch exited"
+      lines.append(line.rstrip("\n"))
+    return lines
+
+  try:
+    first = read_frame()
+    result = run_command(commit("D", now + sec * 4))
+    assert result.returncode == 0, result.stderr
+    second = read_frame()
+  finally:
+    watcher.terminate()
+    watcher.communicate(timeout=10)
+
+  for frame, expected in [
+    (
+      first,
+      [
+        r"                      ",
+        r" Local  <- -> Branch  ",
+        r" ──────────────────── ",
+        r" \w{5}   0 0  main    ",
+        r" \w{5}   1 1  branch1 ",
+        r"                      ",
+      ],
+    ),
+    (
+      second,
+      [
+        r"                      ",
+        r" Local  <- -> Branch  ",
+        r" ──────────────────── ",
+        r" \w{5}   0 0  main    ",
+        r" \w{5}   2 1  branch1 ",
+        r"                      ",
+      ],
+    ),
+  ]:
+    assert len(frame) == len(expected), frame
+    for line, expected_line in zip(frame, expected):
+      assert re.fullmatch(expected_line, line), frame
+
+
+def test_hooks():
+  """
+  Description:
+    Tests that --install-hooks saves the state of the branches, that the hooks refresh it in the
+    background after a checkout, and that --uninstall-hooks removes the hooks and the state
+  """
+  result = run_command("git init && " + commit("A") + " && git branch branch1")
+  assert result.returncode == 0, result.stderr
+
+  hooks_dirpath = os.path.join(GIT_TMP_DIRPATH_LOCAL, ".git", "hooks")
+  state_dirpath = os.path.join(GIT_TMP_DIRPATH_LOCAL, ".git", "branches-state")
+  run_test(
+    None,
+    "branches --install-hooks",
+    [
+      rf"Installed {re.escape(os.path.join(hooks_dirpath, hook))}"
+      for hook in ["post-checkout", "post-merge", "post-rewrite"]
+    ],
+  )
+
+  def saved_state() -> dict:
+    with open(os.path.join(state_dirpath, "state.json")) as state_file:
+      return json.load(state_file)
+
+  assert saved_state()["default"] == "main"
+  assert sorted(saved_state()["branches"]) == ["branch1", "main"]
+  assert saved_state()["branches"]["main"]["current"]
+
+  result = run_command("git checkout -b branch2")
+  assert result.returncode == 0, result.stderr
+
+  deadline = datetime.now() + timedelta(seconds=10)
+  while "branch2" not in saved_state()["branches"] and datetime.now() < deadline:
+    time.sleep(0.1)
+  assert saved_state()["branches"]["branch2"]["current"]
+
+  while os.path.exists(os.path.join(state_dirpath, "refreshing")) and datetime.now() < deadline:
+    time.sleep(0.1)
+
+  # A lock without a pid is being set up by another hook, which starts the refresher
+  lock_dirpath = os.path.join(state_dirpath, "refreshing")
+  os.mkdir(lock_dirpath)
+  result = run_command("git checkout -b branch3")
+  assert result.returncode == 0, result.stderr
+  assert os.listdir(lock_dirpath) == []
+
+  from branches import state
+
+  assert state._running(lock_dirpath)
+
+  # Unless it was left behind by one that died
+  left_at = time.time() - 120
+  os.utime(lock_dirpath, (left_at, left_at))
+  assert not state._running(lock_dirpath)
+  result = run_command("git checkout -b branch4")
+  assert result.returncode == 0, result.stderr
+
+  deadline = datetime.now() + timedelta(seconds=10)
+  while os.path.exists(lock_dirpath) and datetime.now() < deadline:
+    time.sleep(0.1)
+  assert saved_state()["branches"]["branch4"]["current"]
+
+  run_test(
+    None,
+    "branches --uninstall-hooks",
+    [
+      rf"Removed {re.escape(os.path.join(hooks_dirpath, hook))}"
+      for hook in ["post-checkout", "post-merge", "post-rewrite"]
+    ],
+  )
+  assert not os.path.exists(state_dirpath)
+  assert not os.path.exists(os.path.join(hooks_dirpath, "post-checkout"))
+
+
+def test_prompt():
+  """
+  Description:
+    Tests that --prompt shows the saved state of the current branch, marks it as out of date after
+    a commit the hooks don't refresh it for, and starts a refresh that brings it up to date
+  """
+  result = run_command(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A"),
+        "git push -u origin main",
+        "git checkout -b branch1",
+        commit("B"),
+        "git push -u origin branch1",
+        "git checkout main",
+        commit("C"),
+        "git checkout branch1",
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  # Nothing saved yet
+  run_test(None, "branches --prompt", [r"branch1 \.\.\. origin="])
+
+  state_dirpath = os.path.join(GIT_TMP_DIRPATH_LOCAL, ".git", "branches-state")
+  run_test(None, "branches --install-hooks", [r"Installed .*"] * 3)
+  run_test(None, "branches --prompt", [r"branch1 <-1 ->1 origin="])
+
+  result = run_command(commit("D"))
+  assert result.returncode == 0, result.stderr
+  run_test(None, "branches --prompt", [r"branch1 \.\.\. origin\?"])
+
+  deadline = datetime.now() + timedelta(seconds=10)
+  while os.path.exists(os.path.join(state_dirpath, "refreshing")) and datetime.now() < deadline:
+    time.sleep(0.1)
+
+  run_test(None, "branches --prompt", [r"branch1 <-1 ->2 origin<"])
+
+  # Tables without the origin columns keep the origin state saved before
+  run_test(
+    None,
+    "branches -q --columns local,branch",
+    [
+      r"                ",
+      r" Local  Branch  ",
+      r" ────────────── ",
+      r" \w{5}  main    ",
+      r" \w{5}  branch1 ",
+      r"                ",
+    ],
+  )
+  run_test(None, "branches --prompt", [r"branch1 <-1 ->2 origin<"])
+
+  run_test(None, "branches --prompt -C /", [], 1)
+
+
+def test_workspace():
+  """
+  Description:
+    Tests that --workspace shows every repository found in the directory under its own header, and
+    that --json combines the documents of all of them
+  """
+  result = run_command(
+    " && ".join(
+      [
+        "mkdir repo1 repo2 other",
+        "cd repo1 && git init && " + commit("A") + " && git checkout -b branch1 && " + commit("B"),
+        "cd ../repo2 && git init && " + commit("C"),
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  run_test(
+    None,
+    "branches --workspace . --columns local,behind,ahead -q",
+    [
+      "==> repo1 <==",
+      r"                      ",
+      r" Local  <- -> Branch  ",
+      r" ──────────────────── ",
+      r" \w{5}   0 0  main    ",
+      r" \w{5}   0 1  branch1 ",
+      r"                      ",
+      "==> repo2 <==",
+      r"                     ",
+      r" Local  <- -> Branch ",
+      r" ─────────────────── ",
+      r" \w{5}   0 0  main   ",
+      r"                     ",
+    ],
+  )
+
+  result = subprocess.run(
+    f"cd '{GIT_TMP_DIRPATH_LOCAL}' && PYTHONPATH='{SRC_DIRPATH}' "
+    "python -m branches --workspace repo2 repo1 --json --columns local,behind,ahead",
+    shell=True,
+    capture_output=True,
+    text=True,
+  )
+  assert result.returncode == 0, result.stderr
+  document = json.loads(result.stdout)
+  assert [repository["path"] for repository in document["repositories"]] == ["repo2", "repo1"]
+  assert [branch["name"] for branch in document["repositories"][1]["branches"]] == [
+    "main",
+    "branch1",
+  ]
+
+
+def test_shallow_clone():
+  """
+  Description:
+    Tests that in a shallow clone the distances that reach the end of the available history are
+    shown, and output to JSON, as lower bounds
+  """
+  result = run_command(
+    " && ".join(
+      [
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A"),
+        commit("B"),
+        commit("C"),
+        "git push origin main",
+        "git checkout -b branch1 HEAD~2",
+        commit("D"),
+        "git push origin branch1",
+        f"cd / && rm -rf '{GIT_TMP_DIRPATH_LOCAL}'",
+        "git clone --depth=1 --no-single-branch -b main "
+        f"'file://{GIT_TMP_DIRPATH_ORIGIN}' '{GIT_TMP_DIRPATH_LOCAL}'",
+        f"cd '{GIT_TMP_DIRPATH_LOCAL}' && git branch branch1 origin/branch1",
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  run_test(
+    None,
+    "branches --columns local,behind,ahead -q",
+    [
+      r"                      ",
+      r" Local  <- -> Branch  ",
+      r" ──────────────────── ",
+      r" \w{5}   0 0  main    ",
+      r" \w{5}  1\+ 1\+ branch1 ",
+      r"                      ",
+    ],
+  )
+
+  result = run_command(f"PYTHONPATH='{SRC_DIRPATH}' python -m branches --json -q")
+  assert result.returncode == 0, result.stderr
+  branch1 = json.loads(result.stdout)["branches"][1]
+  assert (branch1["behind"], branch1["ahead"], branch1["distance_at_least"]) == (1, 1, True)
+
+
+def test_partial_clone():
+  """
+  Description:
+    Tests that in a partial clone the origin commits missing locally are fetched without their
+    trees
+  """
+  result = run_command(
+    " && ".join(
+      [
+        f"git -C '{GIT_TMP_DIRPATH_ORIGIN}' config uploadpack.allowFilter true",
+        f"git -C '{GIT_TMP_DIRPATH_ORIGIN}' config uploadpack.allowAnySHA1InWant true",
+        f"git init && git remote add origin {GIT_TMP_DIRPATH_ORIGIN}",
+        commit("A"),
+        "git push origin main",
+        "git checkout -b branch1",
+        commit("B"),
+        "git push origin branch1",
+        f"cd / && rm -rf '{GIT_TMP_DIRPATH_LOCAL}'",
+        "git clone --filter=blob:none -b main "
+        f"'file://{GIT_TMP_DIRPATH_ORIGIN}' '{GIT_TMP_DIRPATH_LOCAL}'",
+        f"cd '{GIT_TMP_DIRPATH_LOCAL}' && git branch branch1 origin/branch1",
+        # branch1 moves in origin after the clone, and this clone doesn't fetch it
+        f"git clone -b branch1 '{GIT_TMP_DIRPATH_ORIGIN}' other",
+        "cd other && " + commit("C") + " && git push origin branch1",
+        f"cd '{GIT_TMP_DIRPATH_LOCAL}' && rm -rf other",
+      ]
+    )
+  )
+  assert result.returncode == 0, result.stderr
+
+  run_test(
+    None,
+    "branches --columns origin,relationship,local,behind,ahead -q",
+    [
+      r"                               ",
+      r" Origin - Local  <- -> Branch  ",
+      r" ───────────────────────────── ",
+      r"  \w{5}   \w{5}   0 0  main    ",
+      r"  \w{5} > \w{5}   0 1  branch1 ",
+      r"                               ",
+    ],
+  )
+
+  # Reading the tree would download it, list what's missing instead
+  result = run_command(
+    "sha=$(git ls-remote origin branch1 | cut -f1) && git log -1 --format=%T $sha && "
+    "git rev-list --objects --missing=print --no-walk $sha"
+  )
+  assert result.returncode == 0, result.stderr
+  tree, *objects = result.stdout.split()
+  assert f"?{tree}" in objects